@@ -8,26 +8,77 @@ https://github.com/codetheweb/tuyapi/issues/31.
 """
 import logging
 
+import voluptuous as vol
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import CONF_HOST
 from homeassistant.core import HomeAssistant, callback
+import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.entity_registry import async_migrate_entries
 from homeassistant.util import slugify
 
 from .const import (
     CONF_DEVICE_ID,
     CONF_LOCAL_KEY,
+    CONF_MESSAGE_HISTORY,
+    CONF_METRIC_SENSORS,
     CONF_POLL_ONLY,
+    CONF_PROMETHEUS,
     CONF_PROTOCOL_VERSION,
+    CONF_STALL_THRESHOLD,
     CONF_TYPE,
+    CONF_WORKER_PROCESS,
+    DATA_OPTIONS,
     DOMAIN,
 )
 from .device import setup_device, get_device_id, async_delete_device
 from .helpers.device_config import get_config
+from .helpers.history import DEFAULT_HISTORY_SIZE
+from .helpers.scheduler import start_command_executor
+from .helpers.watchdog import set_stall_threshold
+from .prometheus import TuyaLocalMetricsView
+from .services import async_setup_services
+from .worker import async_start_worker
 
 _LOGGER = logging.getLogger(__name__)
 NOT_FOUND = "Configuration file for %s not found"
 
+CONFIG_SCHEMA = vol.Schema(
+    {
+        DOMAIN: vol.Schema(
+            {
+                vol.Optional(CONF_WORKER_PROCESS, default=False): cv.boolean,
+                vol.Optional(CONF_METRIC_SENSORS, default=False): cv.boolean,
+                vol.Optional(CONF_PROMETHEUS, default=False): cv.boolean,
+                vol.Optional(CONF_STALL_THRESHOLD): cv.positive_int,
+                vol.Optional(
+                    CONF_MESSAGE_HISTORY,
+                    default=DEFAULT_HISTORY_SIZE,
+                ): cv.positive_int,
+            }
+        )
+    },
+    extra=vol.ALLOW_EXTRA,
+)
+
+
+async def async_setup(hass: HomeAssistant, config: dict):
+    """Set up integration wide options from configuration.yaml."""
+    conf = config.get(DOMAIN, {})
+    hass.data[DATA_OPTIONS] = conf
+    await async_setup_services(hass)
+    start_command_executor(hass)
+    if conf.get(CONF_STALL_THRESHOLD):
+        set_stall_threshold(conf[CONF_STALL_THRESHOLD] / 1000)
+    if conf.get(CONF_WORKER_PROCESS, False):
+        await async_start_worker(hass)
+    if conf.get(CONF_PROMETHEUS, False):
+        if hasattr(hass, "http"):
+            hass.http.register_view(TuyaLocalMetricsView())
+        else:
+            _LOGGER.warning("Prometheus metrics need the http integration")
+
+    return True
+
 
 async def async_migrate_entry(hass, entry: ConfigEntry):
     """Migrate to latest config format."""
@@ -244,6 +295,8 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
     entities.add(e.entity)
     for e in device_conf.secondary_entities():
         entities.add(e.entity)
+    if hass.data.get(DATA_OPTIONS, {}).get(CONF_METRIC_SENSORS):
+        entities.add("sensor")
 
     await hass.config_entries.async_forward_entry_setups(entry, entities)
 
@@ -268,6 +321,8 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
     for e in device_conf.secondary_entities():
         if e.config_id in data:
             entities[e.entity] = True
+    if data.get("metric_sensors"):
+        entities["sensor"] = True
 
     for e in entities:
         await hass.config_entries.async_forward_entry_unload(entry, e)
@@ -280,5 +335,12 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
 
 async def async_update_entry(hass: HomeAssistant, entry: ConfigEntry):
     _LOGGER.debug("Updating entry for device: %s", get_device_id(entry.data))
-    await async_unload_entry(hass, entry)
-    await async_setup_entry(hass, entry)
+    config = {**entry.data, **entry.options}
+    data = hass.data.get(DOMAIN, {}).get(get_device_id(config))
+    if data:
+        # Options can be applied to the running device, keeping its entities
+        await data["device"].async_reconfigure(config)
+    else:
+        # The device id changed, so the device needs to be recreated
+        await async_unload_entry(hass, entry)
+        await async_setup_entry(hass, entry)
@@ -0,0 +1,253 @@
+"""
+Bulk import of devices from tinytuya devices.json or snapshot.json files.
+
+Devices are probed concurrently, up to a limit, and their types detected
+from the dps they return.  Config entries are then created in batches, so
+that the new devices do not all try to connect at once.
+"""
+import asyncio
+import json
+import logging
+
+from homeassistant import config_entries
+from homeassistant.components import persistent_notification
+from homeassistant.const import CONF_HOST, CONF_NAME
+from homeassistant.core import HomeAssistant
+from homeassistant.data_entry_flow import FlowResultType
+
+from .const import (
+    API_PROTOCOL_VERSIONS,
+    CONF_DEVICE_CID,
+    CONF_DEVICE_ID,
+    CONF_LOCAL_KEY,
+    CONF_POLL_ONLY,
+    CONF_PROTOCOL_VERSION,
+    CONF_TYPE,
+    DOMAIN,
+)
+from .device import TuyaLocalDevice
+from .helpers.config import get_device_id
+from .helpers.detection import IncrementalDetector, load_signatures
+from .helpers.log import log_json
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 10
+BATCH_SIZE = 10
+# Pause between batches of new config entries, to spread out their setup
+BATCH_DELAY = 5
+NOTIFICATION_ID = "tuya_local_import"
+
+ADDED = "added"
+CONFIGURED = "already configured"
+FAILED = "failed"
+NO_ADDRESS = "no address"
+NO_RESPONSE = "no response"
+NOT_DETECTED = "not supported"
+
+
+def _protocol_version(version):
+    try:
+        version = float(version)
+    except (TypeError, ValueError):
+        return "auto"
+    return version if version in API_PROTOCOL_VERSIONS else "auto"
+
+
+def parse_devices(content):
+    """
+    Parse the contents of a tinytuya devices.json or snapshot.json file.
+
+    Returns:
+        a list of config dicts for the devices.
+    """
+    if isinstance(content, dict):
+        content = content.get("devices", [])
+    gateways = {}
+    for d in content:
+        gateways[d.get("id")] = d
+        if d.get("node_id"):
+            gateways[d["node_id"]] = d
+
+    devices = []
+    for d in content:
+        config = {
+            CONF_NAME: d.get("name") or d.get("id"),
+            CONF_DEVICE_ID: d.get("id"),
+            CONF_HOST: d.get("ip") or "",
+            CONF_LOCAL_KEY: d.get("key") or "",
+            CONF_PROTOCOL_VERSION: _protocol_version(d.get("version") or d.get("ver")),
+            CONF_POLL_ONLY: False,
+        }
+        gateway = gateways.get(d.get("parent"))
+        if gateway is not None and d.get("node_id"):
+            config[CONF_DEVICE_CID] = d["node_id"]
+            config[CONF_DEVICE_ID] = gateway.get("id")
+            config[CONF_HOST] = gateway.get("ip") or ""
+            config[CONF_LOCAL_KEY] = gateway.get("key") or ""
+            config[CONF_PROTOCOL_VERSION] = _protocol_version(
+                gateway.get("version") or gateway.get("ver")
+            )
+        if config[CONF_DEVICE_ID] and config[CONF_LOCAL_KEY]:
+            devices.append(config)
+    return devices
+
+
+def load_devices(path):
+    """Read the devices from a tinytuya file.  This blocks."""
+    with open(path) as f:
+        return parse_devices(json.load(f))
+
+
+def detect_type(dps):
+    """
+    Find the config that best matches dps.  This blocks, so use the executor.
+
+    Returns:
+        the config type and match quality, or None and 0 if nothing matches.
+    """
+    detector = IncrementalDetector(load_signatures())
+    detector.observe(dps)
+    best, quality = detector.best()
+    return (best.config_type, quality) if best else (None, 0)
+
+
+async def async_probe(hass: HomeAssistant, config, limit: asyncio.Semaphore):
+    """Connect to a device and detect its type."""
+    async with limit:
+        try:
+            device = TuyaLocalDevice(
+                config[CONF_NAME],
+                config[CONF_DEVICE_ID],
+                config[CONF_HOST],
+                config[CONF_LOCAL_KEY],
+                config[CONF_PROTOCOL_VERSION],
+                config.get(CONF_DEVICE_CID),
+                hass,
+                True,
+            )
+            await device.async_refresh()
+            dps = await device.async_detection_state()
+        except Exception as e:
+            _LOGGER.warning("Probing %s failed with %s", config[CONF_NAME], e)
+            return NO_RESPONSE, None
+    if len(dps) <= 1:
+        return NO_RESPONSE, None
+    config_type, quality = await hass.async_add_executor_job(detect_type, dps)
+    if config_type is None:
+        _LOGGER.warning(
+            "%s was not detected from dps %s", config[CONF_NAME], log_json(dps)
+        )
+        return NOT_DETECTED, None
+    return config_type, quality
+
+
+async def async_import_devices(
+    hass: HomeAssistant,
+    devices,
+    concurrency=DEFAULT_CONCURRENCY,
+):
+    """
+    Probe devices and add config entries for those that are detected.
+
+    Returns:
+        a list of results, with the name, device id, outcome, and for
+        devices that were detected, their type and match quality.  If
+        adding a detected device failed, the reason is also given.
+    """
+    configured = {
+        e.unique_id for e in hass.config_entries.async_entries(DOMAIN) if e.unique_id
+    }
+    results = []
+    probes = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def probe(config, result):
+        return config, result, *await async_probe(hass, config, limit)
+
+    for config in devices:
+        result = {
+            "name": config[CONF_NAME],
+            "device_id": get_device_id(config),
+        }
+        results.append(result)
+        if result["device_id"] in configured:
+            result["result"] = CONFIGURED
+        elif not config[CONF_HOST]:
+            result["result"] = NO_ADDRESS
+        else:
+            configured.add(result["device_id"])
+            probes.append(probe(config, result))
+
+    done = 0
+    pending = []
+    for next_probe in asyncio.as_completed(probes):
+        config, result, config_type, quality = await next_probe
+        done += 1
+        if quality is None:
+            result["result"] = config_type
+        else:
+            result["type"] = config_type
+            result["quality"] = quality
+            pending.append(({**config, CONF_TYPE: config_type}, result))
+        _async_notify_progress(hass, done, len(probes))
+        if len(pending) >= BATCH_SIZE:
+            await _async_create_entries(hass, pending)
+            pending = []
+            await asyncio.sleep(BATCH_DELAY)
+    if pending:
+        await _async_create_entries(hass, pending)
+
+    return results
+
+
+async def _async_create_entries(hass: HomeAssistant, pending):
+    """Create config entries, recording the outcome in each result."""
+    outcomes = await asyncio.gather(
+        *(
+            hass.config_entries.flow.async_init(
+                DOMAIN,
+                context={"source": config_entries.SOURCE_IMPORT},
+                data=config,
+            )
+            for config, _ in pending
+        ),
+        return_exceptions=True,
+    )
+    for (config, result), outcome in zip(pending, outcomes):
+        if isinstance(outcome, BaseException):
+            _LOGGER.warning("Adding %s failed with %s", config[CONF_NAME], outcome)
+            result["result"] = FAILED
+            result["reason"] = str(outcome)
+        elif outcome.get("type") == FlowResultType.CREATE_ENTRY:
+            result["result"] = ADDED
+        elif outcome.get("reason") == "already_configured":
+            result["result"] = CONFIGURED
+        else:
+            result["result"] = FAILED
+            result["reason"] = outcome.get("reason")
+
+
+def _async_notify_progress(hass: HomeAssistant, done, total):
+    persistent_notification.async_create(
+        hass,
+        f"Probed {done} of {total} devices.",
+        title="Tuya Local import",
+        notification_id=NOTIFICATION_ID,
+    )
+
+
+def summary(results):
+    """Return a markdown summary of the results of an import."""
+    counts = {}
+    for result in results:
+        counts[result["result"]] = counts.get(result["result"], 0) + 1
+    lines = [", ".join(f"{n} {r}" for r, n in counts.items()) + ".", ""]
+    for result in results:
+        if result["result"] == ADDED:
+            lines.append(f"- {result['name']}: added as {result['type']}")
+        elif result.get("reason"):
+            lines.append(f"- {result['name']}: {result['result']}, {result['reason']}")
+        elif result["result"] != CONFIGURED:
+            lines.append(f"- {result['name']}: {result['result']}")
+    return "\n".join(lines)
@@ -6,6 +6,7 @@ from homeassistant.components.camera import (
     Camera as CameraEntity,
     CameraEntityFeature,
 )
+from homeassistant.core import callback
 import logging
 
 from .device import TuyaLocalDevice
@@ -15,6 +16,11 @@ from .helpers.mixin import TuyaLocalEntity
 
 _LOGGER = logging.getLogger(__name__)
 
+# Upper limit on the size of a snapshot being reassembled from chunks
+MAX_SNAPSHOT_SIZE = 4 * 1024 * 1024
+JPEG_START = b"\xff\xd8"
+JPEG_END = b"\xff\xd9"
+
 
 async def async_setup_entry(hass, config_entry, async_add_entities):
     config = {**config_entry.data, **config_entry.options}
@@ -43,6 +49,7 @@ class TuyaLocalCamera(TuyaLocalEntity, CameraEntity):
         self._snapshot_dp = dps_map.pop("snapshot", None)
         self._record_dp = dps_map.pop("record", None)
         self._motion_enable_dp = dps_map.pop("motion_enable", None)
+        self._snapshot = SnapshotAssembler()
 
         self._init_end(dps_map)
         if self._switch_dp:
@@ -62,7 +69,20 @@ class TuyaLocalCamera(TuyaLocalEntity, CameraEntity):
 
     async def async_camera_image(self, width=None, height=None):
         if self._snapshot_dp:
-            return self._snapshot_dp.decoded_value(self._device)
+            self._update_snapshot()
+            return self._snapshot.image
+
+    def _update_snapshot(self):
+        """Feed the current snapshot dp value to the assembler."""
+        self._snapshot.add(self._snapshot_dp.decoded_value(self._device))
+
+    @callback
+    def async_write_ha_state(self):
+        # Snapshots may arrive in several messages, so each one needs to be
+        # collected as it arrives rather than when the image is requested.
+        if self._snapshot_dp:
+            self._update_snapshot()
+        super().async_write_ha_state()
 
     @property
     def is_on(self):
@@ -93,3 +113,63 @@ class TuyaLocalCamera(TuyaLocalEntity, CameraEntity):
         if not self._motion_enable_dp:
             raise NotImplementedError()
         await self._motion_enable_dp.async_set_value(self._device, False)
+
+
+class SnapshotAssembler:
+    """
+    Reassemble snapshots that are sent in several chunks.
+
+    JPEG images are recognised by their start and end markers, so a chunk
+    that starts an image without ending it begins a new frame, and following
+    chunks are appended until the end marker arrives.  The end of a frame
+    whose start was missed is dropped, and anything else that does not look
+    like JPEG is treated as a complete image.  Partial frames are discarded
+    once they exceed max_size, so memory use stays bounded.
+    """
+
+    def __init__(self, max_size=MAX_SNAPSHOT_SIZE):
+        self._max_size = max_size
+        self._last_chunk = None
+        self._partial = None
+        self._discarding = False
+        self.image = None
+
+    def add(self, chunk):
+        """Add the latest decoded snapshot value."""
+        # The decoded value is cached by the dps config, so an unchanged
+        # value is the same object as last time.
+        if chunk is self._last_chunk:
+            return
+        self._last_chunk = chunk
+
+        if not isinstance(chunk, bytes):
+            self._partial = None
+            self._discarding = False
+            self.image = chunk
+        elif chunk.startswith(JPEG_START):
+            self._discarding = False
+            if chunk.endswith(JPEG_END):
+                self._partial = None
+                self.image = chunk
+            else:
+                self._partial = bytearray(chunk)
+        elif self._discarding:
+            # Skip the rest of an oversized frame
+            self._discarding = not chunk.endswith(JPEG_END)
+        elif self._partial is None:
+            if chunk.endswith(JPEG_END):
+                _LOGGER.debug("Dropping the end of a snapshot without its start")
+            else:
+                self.image = chunk
+        else:
+            self._partial += chunk
+            if chunk.endswith(JPEG_END):
+                self.image = bytes(self._partial)
+                self._partial = None
+            elif len(self._partial) > self._max_size:
+                _LOGGER.warning(
+                    "Discarding snapshot larger than %d bytes",
+                    self._max_size,
+                )
+                self._partial = None
+                self._discarding = True
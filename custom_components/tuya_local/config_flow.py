@@ -1,4 +1,3 @@
-import asyncio
 import logging
 
 import voluptuous as vol
@@ -7,11 +6,13 @@ from homeassistant.const import CONF_HOST, CONF_NAME
 from homeassistant.core import HomeAssistant, callback
 
 from . import DOMAIN
-from .device import TuyaLocalDevice
+from .device import TuyaLocalDevice, hand_off_device
 from .const import (
     API_PROTOCOL_VERSIONS,
+    CONF_DEADBAND,
     CONF_DEVICE_ID,
     CONF_LOCAL_KEY,
+    CONF_MIN_UPDATE_INTERVAL,
     CONF_POLL_ONLY,
     CONF_DEVICE_CID,
     CONF_PROTOCOL_VERSION,
@@ -75,6 +76,14 @@ class ConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
             errors=errors,
         )
 
+    async def async_step_import(self, import_data):
+        """Add a device that was probed and detected by a bulk import."""
+        await self.async_set_unique_id(get_device_id(import_data))
+        self._abort_if_unique_id_configured()
+        data = {**import_data}
+        title = data.pop(CONF_NAME)
+        return self.async_create_entry(title=title, data=data)
+
     async def async_step_select_type(self, user_input=None):
         if user_input is not None:
             self.data[CONF_TYPE] = user_input[CONF_TYPE]
@@ -123,6 +132,8 @@ class ConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
             title = user_input[CONF_NAME]
             del user_input[CONF_NAME]
 
+            if self.device:
+                hand_off_device(self.hass, self.data, self.device)
             return self.async_create_entry(
                 title=title, data={**self.data, **user_input}
             )
@@ -178,6 +189,14 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
                 CONF_DEVICE_CID,
                 default=config.get(CONF_DEVICE_CID, ""),
             ): str,
+            vol.Optional(
+                CONF_MIN_UPDATE_INTERVAL,
+                default=config.get(CONF_MIN_UPDATE_INTERVAL, 0),
+            ): vol.All(vol.Coerce(float), vol.Range(min=0, max=3600)),
+            vol.Optional(
+                CONF_DEADBAND,
+                default=config.get(CONF_DEADBAND, 0),
+            ): vol.All(vol.Coerce(float), vol.Range(min=0, max=100)),
         }
         cfg = get_config(config[CONF_TYPE])
         if cfg is None:
@@ -194,9 +213,16 @@ async def async_test_connection(config: dict, hass: HomeAssistant):
     domain_data = hass.data.get(DOMAIN)
     existing = domain_data.get(get_device_id(config)) if domain_data else None
     if existing:
+        # If the running device is already working with these settings,
+        # there is nothing to test.
+        if existing["device"].connection_matches(config):
+            return existing["device"]
         existing["device"].pause()
-        await asyncio.sleep(5)
+        # Devices only accept one connection, so release it for the test
+        if existing["device"].address == config[CONF_HOST]:
+            await existing["device"].async_close_connection()
 
+    device = None
     try:
         subdevice_id = config.get(CONF_DEVICE_CID)
         device = TuyaLocalDevice(
@@ -215,6 +241,10 @@ async def async_test_connection(config: dict, hass: HomeAssistant):
         _LOGGER.warning("Connection test failed with %s %s", type(e), e)
         retval = None
 
+    # A device that failed the test is not used again
+    if retval is None and device is not None:
+        device.release()
+
     if existing:
         existing["device"].resume()
 
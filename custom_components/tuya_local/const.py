@@ -8,4 +8,15 @@ CONF_TYPE = "type"
 CONF_POLL_ONLY = "poll_only"
 CONF_DEVICE_CID = "device_cid"
 CONF_PROTOCOL_VERSION = "protocol_version"
+CONF_MIN_UPDATE_INTERVAL = "min_update_interval"
+CONF_DEADBAND = "deadband"
+CONF_WORKER_PROCESS = "worker_process"
+CONF_METRIC_SENSORS = "metric_sensors"
+CONF_PROMETHEUS = "prometheus"
+CONF_STALL_THRESHOLD = "stall_threshold"
+CONF_MESSAGE_HISTORY = "message_history"
+# Integration wide options from configuration.yaml
+DATA_OPTIONS = "tuya_local_options"
+# Devices tested by the config flow, waiting for their entry to be set up
+DATA_HANDOFF = "tuya_local_handoff"
 API_PROTOCOL_VERSIONS = [3.3, 3.1, 3.2, 3.4, 3.5]
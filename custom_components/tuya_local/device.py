@@ -3,10 +3,11 @@ API for Tuya Local devices.
 """
 
 import asyncio
+from functools import partial
 import logging
 import tinytuya
 from threading import Lock
-from time import time
+from time import monotonic, time
 
 
 from homeassistant.const import (
@@ -19,20 +20,50 @@ from homeassistant.core import HomeAssistant
 
 from .const import (
     API_PROTOCOL_VERSIONS,
+    CONF_DEADBAND,
     CONF_DEVICE_ID,
     CONF_LOCAL_KEY,
+    CONF_MESSAGE_HISTORY,
+    CONF_MIN_UPDATE_INTERVAL,
     CONF_POLL_ONLY,
     CONF_PROTOCOL_VERSION,
     DOMAIN,
     CONF_DEVICE_CID,
+    DATA_HANDOFF,
+    DATA_OPTIONS,
 )
+from .helpers.capture import TrafficCapture
 from .helpers.config import get_device_id
-from .helpers.device_config import possible_matches
+from .helpers.detection import IncrementalDetector, load_signatures
+from .helpers.device_config import TuyaDeviceConfig
+from .helpers.history import DEFAULT_HISTORY_SIZE, MessageHistory
 from .helpers.log import log_json
+from .helpers.metrics import DeviceMetrics
+from .helpers.scheduler import CommandTracker, get_command_executor
+from .helpers.update_filter import DpFilter, EntityUpdateFilter
+from .helpers.trace import (
+    COMMAND_TRACK,
+    QUEUE_TRACK,
+    RECEIVE_TRACK,
+    get_tracer,
+    trace_span,
+)
+from .helpers.watchdog import watch_stall
+from .worker import WorkerApi, get_worker
 
 
 _LOGGER = logging.getLogger(__name__)
 
+# How long a device tested by the config flow waits to be adopted
+HANDOFF_TIMEOUT = 60
+# Errors from tinytuya when the connection is closed
+_CONNECTION_LOST = tuple(str(e) for e in (tinytuya.ERR_CONNECT, tinytuya.ERR_OFFLINE))
+# Extra polls for dps that tell candidate types apart during detection,
+# and the most dps to ask for in each
+DETECTION_ROUNDS = 3
+DETECTION_DPS = 10
+DETECTION_PROBE_DPS = ("1", "20", "101")
+
 
 class TuyaLocalDevice(object):
     def __init__(
@@ -45,6 +76,10 @@ class TuyaLocalDevice(object):
         dev_cid,
         hass: HomeAssistant,
         poll_only=False,
+        worker=None,
+        history_size=DEFAULT_HISTORY_SIZE,
+        min_update_interval=0,
+        deadband=0,
     ):
         """
         Represents a Tuya-based device.
@@ -57,26 +92,52 @@ class TuyaLocalDevice(object):
             dev_cid (str): The sub device id.
             hass (HomeAssistant): The Home Assistant instance.
             poll_only (bool): True if the device should be polled only
+            worker (Worker): The worker process to connect through, if any.
+            history_size (int): The number of recent messages to keep.
+            min_update_interval (float): Minimum seconds between state
+                writes for sensors, overriding the device config if set.
+            deadband (float): Percentage change needed to write the state
+                of sensors, overriding the device config if set.
         """
         self._name = name
+        self._address = address
+        self._local_key = local_key
         self._children = []
         self._force_dps = []
+        self._entity_dps = None
+        self._required_dps = set()
+        self._update_filters = {}
+        # Dps whose values are extrapolated between reports, and the dps
+        # whose report times they need
+        self._extrapolated_dps = []
+        self._tracked_dps = set()
+        self._reported_at = {}
+        self._extrapolating = []
+        self._extrapolation_timer = None
+        # Set when the next poll must be a full status, not updatedps
+        self._full_poll_due = False
+        self._min_update_interval = min_update_interval
+        self._deadband = f"{deadband}%" if deadband else None
         self._running = False
         self._shutdown_listener = None
         self._startup_listener = None
         self._api_protocol_version_index = None
         self._api_protocol_working = False
+        self._negotiated_protocol = None
         self._api_working_protocol_failures = 0
+        self.metrics = DeviceMetrics()
+        self._commands = CommandTracker()
+        # Tracks the receive loop's calls to the api, in the same way
+        self._receiving = CommandTracker()
+        self.history = MessageHistory(history_size)
+        self._capture = None
+        # The last decoding of each encoded dp, kept for the dp configs
+        self.decoded_dps = {}
+        self._worker = worker
+        self._dev_id = dev_id
+        self.dev_cid = dev_cid
         try:
-            if dev_cid is not None:
-                self._api = tinytuya.Device(
-                    dev_id,
-                    cid=dev_cid,
-                    parent=tinytuya.Device(dev_id, address, local_key),
-                )
-            else:
-                self._api = tinytuya.Device(dev_id, address, local_key)
-            self.dev_cid = dev_cid
+            self._api = self._create_api(dev_id, address, local_key)
         except Exception as e:
             _LOGGER.error(
                 "%s: %s while initialising device %s",
@@ -86,11 +147,6 @@ class TuyaLocalDevice(object):
             )
             raise e
 
-        # we handle retries at a higher level so we can rotate protocol version
-        self._api.set_socketRetryLimit(1)
-        if self._api.parent:
-            self._api.parent.set_socketRetryLimit(1)
-
         self._refresh_task = None
         self._protocol_configured = protocol_version
         self._poll_only = poll_only
@@ -114,8 +170,50 @@ class TuyaLocalDevice(object):
         self._SINGLE_PROTO_CONNECTION_ATTEMPTS = 3
         # The number of failures from a working protocol before retrying other protocols.
         self._AUTO_FAILURE_RESET_COUNT = 10
+        # The longest wait between attempts to reconnect.
+        self._MAX_RECONNECT_DELAY = 30
+        # The longest wait for a message pushed by the worker process.
+        self._RECEIVE_TIMEOUT = 5
         self._lock = Lock()
 
+    def _create_api(self, dev_id, address, local_key):
+        """Create the api used to communicate with the device."""
+        if self._worker is not None:
+            parent = None
+            if self.dev_cid is not None:
+                parent = WorkerApi(self._worker, dev_id, address, local_key)
+            api = WorkerApi(
+                self._worker,
+                dev_id,
+                address,
+                local_key,
+                cid=self.dev_cid,
+                parent=parent,
+            )
+        elif self.dev_cid is not None:
+            api = tinytuya.Device(
+                dev_id,
+                cid=self.dev_cid,
+                parent=tinytuya.Device(dev_id, address, local_key),
+            )
+        else:
+            api = tinytuya.Device(dev_id, address, local_key)
+
+        # Decoding happens within tinytuya calls, so wrap it to trace it
+        # separately from the socket communication.
+        for layer in (api, api.parent):
+            if hasattr(layer, "_decode_payload"):
+                layer._decode_payload = partial(
+                    self._traced_decode,
+                    layer._decode_payload,
+                )
+
+        # we handle retries at a higher level so we can rotate protocol version
+        api.set_socketRetryLimit(1)
+        if api.parent:
+            api.parent.set_socketRetryLimit(1)
+        return api
+
     @property
     def name(self):
         return self._name
@@ -168,10 +266,14 @@ class TuyaLocalDevice(object):
             self._shutdown_listener = None
         self._children.clear()
         self._force_dps.clear()
+        self._entity_dps = None
+        self._cancel_update_filters()
+        self._cancel_extrapolation()
         if self._refresh_task:
             await self._refresh_task
         _LOGGER.debug("Monitor loop for %s stopped", self.name)
         self._refresh_task = None
+        await self.async_stop_capture()
 
     def register_entity(self, entity):
         # If this is the first child entity to register, and HA is still
@@ -180,8 +282,9 @@ class TuyaLocalDevice(object):
         should_poll = len(self._children) == 0 and not self._hass.is_running
 
         self._children.append(entity)
+        self._entity_dps = None
         for dp in entity._config.dps():
-            if dp.force and dp.id not in self._force_dps:
+            if dp.force and int(dp.id) not in self._force_dps:
                 self._force_dps.append(int(dp.id))
 
         if not self._running and not self._startup_listener:
@@ -193,9 +296,185 @@ class TuyaLocalDevice(object):
 
     async def async_unregister_entity(self, entity):
         self._children.remove(entity)
+        self._entity_dps = None
         if not self._children:
             await self.async_stop()
 
+    def reload_entity_configs(self, configs):
+        """
+        Give the registered entities the new versions of changed configs.
+
+        Args:
+            configs (dict): the changed TuyaDeviceConfigs, by config type.
+        Returns:
+            the number of entities reloaded, and whether the device's
+            entities need to be recreated for the changes to take effect.
+        """
+        reloaded = 0
+        recreate = False
+        for entity in self._children:
+            old = entity._config._device
+            config = configs.get(old.config_type)
+            if config is None:
+                continue
+            if _entity_ids(config) != _entity_ids(old):
+                # Entities were added or removed
+                recreate = True
+            entity_config = config.find_entity(entity._config.config_id)
+            if entity_config is None or not entity.reload_config(entity_config):
+                recreate = True
+                continue
+            entity.async_schedule_update_ha_state()
+            reloaded += 1
+        if reloaded:
+            self._entity_dps = None
+        return reloaded, recreate
+
+    def _get_entity_dps(self):
+        """
+        Return the ids of the dps used by each registered entity.
+
+        Entities that are disabled in the entity registry are never
+        registered, so this also determines the dps that need to be
+        requested from the device.  Redirects, mirrors and conditions can
+        only refer to dps within the same entity, so these dependencies
+        are covered by the entity's own dps.
+        """
+        if self._entity_dps is None:
+            self._entity_dps = []
+            self._required_dps = set()
+            self._force_dps = []
+            self._extrapolated_dps = []
+            self._tracked_dps = set()
+            self._cancel_update_filters()
+            self._cancel_extrapolation()
+            for entity in self._children:
+                dps = set()
+                for dp in entity._config.dps():
+                    dps.add(dp.id)
+                    if dp.force and int(dp.id) not in self._force_dps:
+                        self._force_dps.append(int(dp.id))
+                    self._track_extrapolation(entity, dp)
+                self._entity_dps.append((entity, dps))
+                self._required_dps |= dps
+                update_filter = self._update_filter(entity)
+                if update_filter is not None:
+                    self._update_filters[entity] = update_filter
+            if self._extrapolated_dps:
+                # Carry on from the times already reported
+                self._schedule_extrapolation()
+        return self._entity_dps
+
+    def _update_filter(self, entity):
+        """Return the filter for state writes of an entity, if it needs one."""
+        if not getattr(entity, "filter_updates", True):
+            return None
+        filters = []
+        for dp in entity._config.dps():
+            min_interval = dp.min_interval
+            deadband = dp.deadband
+            if entity._config.entity == "sensor" and dp.type in (int, float):
+                min_interval = self._min_update_interval or min_interval
+                deadband = self._deadband or deadband
+            if min_interval or deadband is not None:
+                filters.append(DpFilter(dp, min_interval, deadband))
+        return EntityUpdateFilter(filters) if filters else None
+
+    def _track_extrapolation(self, entity, dp):
+        model = dp.extrapolation
+        if model is None:
+            return
+        self._extrapolated_dps.append((entity, dp))
+        self._tracked_dps.add(dp.id)
+        if model.toward is not None:
+            toward = entity._config.find_dps(model.toward)
+            if toward is not None:
+                self._tracked_dps.add(toward.id)
+
+    def reported_at(self, *dps_ids):
+        """Return the monotonic time any of the dps were last reported or set."""
+        times = [self._reported_at[id] for id in dps_ids if id in self._reported_at]
+        return max(times) if times else None
+
+    def _record_reports(self, dps):
+        """Record the time that tracked dps were reported or set."""
+        # The dps to track are only known once the entity dps are
+        self._get_entity_dps()
+        if self._tracked_dps.isdisjoint(dps):
+            return
+        now = monotonic()
+        for id in self._tracked_dps.intersection(dps):
+            self._reported_at[id] = now
+        self._schedule_extrapolation()
+
+    def _schedule_extrapolation(self):
+        """Schedule a state write for when an extrapolated value next changes."""
+        self._cancel_extrapolation()
+        now = monotonic()
+        delay = None
+        for entity, dp in self._extrapolated_dps:
+            wait = dp.extrapolate(self, dp._raw_value(self))[1]
+            if wait is not None:
+                self._extrapolating.append((now + wait, entity, dp))
+                delay = wait if delay is None else min(delay, wait)
+        if delay is not None:
+            self._extrapolation_timer = self._hass.loop.call_later(
+                delay,
+                self._extrapolation_due,
+            )
+
+    def _extrapolation_due(self):
+        """Write the extrapolated states, confirming with the device at the end."""
+        self._extrapolation_timer = None
+        now = monotonic()
+        ended = False
+        written = set()
+        for due, entity, dp in self._extrapolating:
+            if due > now + 0.001:
+                continue
+            if dp.extrapolate(self, dp._raw_value(self))[1] is None:
+                ended = True
+            if entity not in written:
+                written.add(entity)
+                self._write_entity_state(entity, {dp.id})
+        if ended:
+            # Fetch the real values on the next loop, once only, as the
+            # extrapolation stops here until the device reports again.
+            _LOGGER.debug("%s extrapolation ended, resyncing", self.name)
+            self._cached_state["updated_at"] = 0
+            # with status, as updatedps may not include the extrapolated dps
+            self._full_poll_due = True
+        self._schedule_extrapolation()
+
+    def _cancel_extrapolation(self):
+        if self._extrapolation_timer is not None:
+            self._extrapolation_timer.cancel()
+            self._extrapolation_timer = None
+        self._extrapolating = []
+
+    def _cancel_update_filters(self):
+        for update_filter in self._update_filters.values():
+            update_filter.cancel()
+        self._update_filters = {}
+
+    @property
+    def required_dps(self):
+        """Return the set of dps used by the registered entities."""
+        self._get_entity_dps()
+        return self._required_dps
+
+    def _limit_requested_dps(self):
+        """Only request the required dps from devices that need a list."""
+        required = self.required_dps
+        if required and self._api.dev_type == "device22":
+            self._api.set_dpsUsed({dp: None for dp in sorted(required, key=int)})
+
+    def _reconnect_delay(self, failures):
+        """Return how long to wait before the next attempt to reconnect."""
+        if failures <= 1:
+            return 0
+        return min(2 ** (failures - 2), self._MAX_RECONNECT_DELAY)
+
     async def receive_loop(self):
         """Coroutine wrapper for async_receive generator."""
         try:
@@ -206,16 +485,10 @@ class TuyaLocalDevice(object):
                         self.name,
                         log_json(poll),
                     )
-                    full_poll = poll.pop("full_poll", False)
-                    self._cached_state = self._cached_state | poll
-                    self._cached_state["updated_at"] = time()
-                    for entity in self._children:
-                        # clear non-persistant dps that were not in a full poll
-                        if full_poll:
-                            for dp in entity._config.dps():
-                                if not dp.persist and dp.id not in poll:
-                                    self._cached_state.pop(dp.id, None)
-                        entity.async_write_ha_state()
+                    self.metrics.messages_received += 1
+                    with trace_span("process poll", "update", self.name):
+                        with watch_stall(self, "processing update", dps=poll):
+                            self._process_poll(poll)
                 else:
                     _LOGGER.debug(
                         "%s received non data %s",
@@ -229,6 +502,148 @@ class TuyaLocalDevice(object):
                 "%s receive loop terminated by exception %s", self.name, t
             )
 
+    def _process_poll(self, poll):
+        """Merge a poll into the cached state and update affected entities."""
+        full_poll = poll.pop("full_poll", False)
+        with trace_span("cache merge", "update", self.name):
+            self._cached_state = self._cached_state | poll
+            self._cached_state["updated_at"] = time()
+            entity_dps = self._get_entity_dps()
+            if full_poll:
+                # clear non-persistant dps that were not in a full poll
+                for entity, dps in entity_dps:
+                    for dp in entity._config.dps():
+                        if not dp.persist and dp.id not in poll:
+                            self._cached_state.pop(dp.id, None)
+        # Extrapolation restarts from the values just reported
+        self._record_reports(poll)
+
+        for entity, dps in entity_dps:
+            # entities only depend on their own dps, so skip
+            # those that are not affected by a partial update
+            if full_poll:
+                self._write_entity_state(entity, dps)
+            elif not dps.isdisjoint(poll):
+                self._write_entity_state(entity, dps.intersection(poll), True)
+
+    def _write_entity_state(self, entity, changed_dps, filtered=False):
+        """Write the state of an entity, recording how long it took."""
+        update_filter = self._update_filters.get(entity)
+        if update_filter is not None:
+            now = monotonic()
+            if filtered:
+                delay = update_filter.delay(self, changed_dps, now)
+                if delay is None:
+                    return
+                if delay > 0:
+                    # Write the latest state once the interval has elapsed
+                    if update_filter.timer is None:
+                        update_filter.timer = self._hass.loop.call_later(
+                            delay,
+                            self._write_entity_state,
+                            entity,
+                            changed_dps,
+                        )
+                    return
+            update_filter.written(self, now)
+
+        entity_id = entity._config.config_id
+        with trace_span("entity write", "update", self.name, {"entity": entity_id}):
+            with watch_stall(self, "state update", entity_id, changed_dps):
+                entity.async_write_ha_state()
+
+    def _traced_decode(self, decode, payload):
+        with trace_span("decrypt and parse", "decode", self.name):
+            return decode(payload)
+
+    def _call_api(self, name, func, *args, **kwargs):
+        """Call the api from the executor, recording metrics and traces."""
+        start = monotonic()
+        with trace_span(name, "socket", self.name):
+            result = self.metrics.call(name, func, *args, **kwargs)
+        self._record_call(name, args, result, monotonic() - start)
+        return result
+
+    async def _async_call_api(self, name, method, *args, executor=None, **kwargs):
+        """
+        Call an api method, awaiting it directly when connected through the
+        worker process, or otherwise from the executor.
+        """
+        if not self._api_is_async:
+            return await self._async_executor_job(
+                partial(
+                    self._call_api, name, getattr(self._api, method), *args, **kwargs
+                ),
+                executor=executor,
+            )
+        return await self._async_observe(
+            name,
+            args,
+            self._api.async_call(method, *args, **kwargs),
+        )
+
+    async def _async_observe(self, name, args, coro):
+        """Await an api coroutine, recording metrics and traces."""
+        start = monotonic()
+        with trace_span(name, "socket", self.name):
+            result = await self.metrics.async_call(name, coro)
+        self._record_call(name, args, result, monotonic() - start)
+        return result
+
+    def _record_call(self, name, args, result, elapsed):
+        self.history.record_call(name, args, result, elapsed)
+        capture = self._capture
+        if capture is not None:
+            capture.record_call(name, args, result)
+
+    @property
+    def _api_is_async(self):
+        """Whether the api is connected through the worker's event loop."""
+        return isinstance(self._api, WorkerApi) and self._api.is_async
+
+    async def async_start_capture(self, path, max_bytes):
+        """Start appending the traffic of this device to a file."""
+        await self.async_stop_capture()
+        header = {"device": self.name, "id": self.unique_id}
+        if self._children:
+            header["config_type"] = self._children[0]._config._device.config_type
+        capture = TrafficCapture(path, max_bytes)
+        await self._hass.async_add_executor_job(capture.open, header)
+        self._capture = capture
+
+    async def async_stop_capture(self):
+        """Stop capturing traffic, returning the capture if there was one."""
+        capture, self._capture = self._capture, None
+        if capture is not None:
+            await self._hass.async_add_executor_job(capture.close)
+        return capture
+
+    async def _async_executor_job(self, func, *args, executor=None):
+        """Run func in the executor, tracing how long it waits for a thread."""
+        tracer = get_tracer()
+        if executor is not None:
+            run = partial(self._hass.loop.run_in_executor, executor)
+        else:
+            run = self._hass.async_add_executor_job
+        if tracer is None:
+            return await run(func, *args)
+
+        queued = tracer.now()
+
+        def job():
+            tracer.add(
+                "queue wait",
+                "queue",
+                self.name,
+                queued,
+                tracer.now(),
+                None,
+                QUEUE_TRACK,
+            )
+            return func(*args)
+
+        return await run(job)
+
     @property
     def should_poll(self):
         return self._poll_only or self._temporary_poll or not self.has_returned_state
@@ -239,6 +654,133 @@ class TuyaLocalDevice(object):
     def resume(self):
         self._temporary_poll = False
 
+    @property
+    def address(self):
+        return self._address
+
+    def connection_matches(self, config):
+        """
+        Return True if the device is working with the connection settings
+        in config, so they do not need testing with a new connection.
+        """
+        if not (self._api_protocol_working and self.has_returned_state):
+            return False
+        # A change of protocol alone is handled by async_reconfigure, which
+        # negotiates again on the working connection if it needs to.
+        return (
+            config[CONF_HOST] == self._address
+            and config[CONF_LOCAL_KEY] == self._local_key
+            and (config.get(CONF_DEVICE_CID) or None) == (self.dev_cid or None)
+        )
+
+    @property
+    def _working_protocol(self):
+        """Return the protocol version known to work, if any."""
+        if not self._api_protocol_working:
+            return None
+        if self._api_protocol_version_index is None:
+            return self._negotiated_protocol
+        return API_PROTOCOL_VERSIONS[self._api_protocol_version_index]
+
+    def adopt(self, device):
+        """
+        Take over the protocol negotiated and the state fetched by another
+        device with the same connection settings, so they do not need to be
+        negotiated and fetched again.  The other device's connection is
+        closed, as it is not used again.
+        """
+        device.release()
+        if not (device._working_protocol and device.has_returned_state):
+            return
+        self._negotiated_protocol = device._working_protocol
+        self._api_protocol_working = True
+        self._cached_state = device._cached_state.copy()
+
+    def release(self):
+        """
+        Close the connection of a device that is no longer used.  Like the
+        receive loop's own changes to persistence, this does not block.
+        """
+        _close_api(self._api)
+
+    async def async_close_connection(self, api=None):
+        """Close any persistent connection, so another can be made."""
+        api = api or self._api
+        # Closing the socket under a call in progress would break it
+        await self._receiving.async_wait_idle()
+        await self._hass.async_add_executor_job(api.set_socketPersistent, False)
+        if api.parent:
+            await self._hass.async_add_executor_job(
+                api.parent.set_socketPersistent,
+                False,
+            )
+
+    async def async_reconfigure(self, config):
+        """
+        Apply changed options without recreating the device or its entities.
+
+        The connection is only replaced if the host or key changed, and the
+        protocol is only negotiated again if the working one is no longer
+        allowed by the configured protocol version.  A changed sub device id
+        changes the device id, so the device is recreated instead.
+        """
+        self._poll_only = config.get(CONF_POLL_ONLY, False)
+
+        deadband = config.get(CONF_DEADBAND, 0)
+        deadband = f"{deadband}%" if deadband else None
+        min_update_interval = config.get(CONF_MIN_UPDATE_INTERVAL, 0)
+        if (min_update_interval, deadband) != (
+            self._min_update_interval,
+            self._deadband,
+        ):
+            self._min_update_interval = min_update_interval
+            self._deadband = deadband
+            # Rebuild the update filters on next use
+            self._entity_dps = None
+
+        protocol = config[CONF_PROTOCOL_VERSION]
+        working = self._working_protocol
+        if protocol != self._protocol_configured:
+            self._protocol_configured = protocol
+            if protocol not in ("auto", working):
+                working = None
+                self._api_protocol_version_index = None
+                self._api_protocol_working = False
+                self._negotiated_protocol = None
+
+        if (config[CONF_HOST], config[CONF_LOCAL_KEY]) == (
+            self._address,
+            self._local_key,
+        ):
+            return
+
+        _LOGGER.info("Reconnecting to %s with new settings", self.name)
+        old_api = self._api
+        self._address = config[CONF_HOST]
+        self._local_key = config[CONF_LOCAL_KEY]
+        # Nothing is known to work with the new settings yet
+        self._api_protocol_working = False
+        self._api_working_protocol_failures = 0
+        self._api = await self._hass.async_add_executor_job(
+            self._create_api,
+            self._dev_id,
+            self._address,
+            self._local_key,
+        )
+        # Start the new connection with the protocol that was working
+        self._negotiated_protocol = working
+        self._api_protocol_version_index = None
+        await self._rotate_api_protocol_version()
+        if self._running and not self.should_poll:
+            await self._hass.async_add_executor_job(
+                self._api.set_socketPersistent,
+                True,
+            )
+        # Fetch the full state through the new connection on the next loop
+        self._cached_state["updated_at"] = 0
+        await self.async_close_connection(old_api)
+        _close_api(old_api)
+
     async def async_receive(self):
         """Receive messages from a persistent connection asynchronously."""
         # If we didn't yet get any state from the device, we may need to
@@ -247,6 +789,8 @@ class TuyaLocalDevice(object):
         # flag to alternate updatedps and status calls to ensure we get
         # all dps updated
         dps_updated = False
+        # consecutive failures to reach the device, for backing off
+        failures = 0
 
         self._api.set_socketPersistent(persist)
         if self._api.parent:
@@ -254,9 +798,12 @@ class TuyaLocalDevice(object):
 
         while self._running:
             try:
+                # Commands take priority over polling the device
+                await self._commands.async_wait_idle()
                 last_cache = self._cached_state.get("updated_at", 0)
                 now = time()
                 full_poll = False
+                waiting = False
                 if persist == self.should_poll:
                     # use persistent connections after initial communication
                     # has been established.  Until then, we need to rotate
@@ -267,38 +814,88 @@ class TuyaLocalDevice(object):
                     if self._api.parent:
                         self._api.parent.set_socketPersistent(persist)
 
-                if now - last_cache > self._CACHE_TIMEOUT:
-                    if (
-                        self._force_dps
-                        and not dps_updated
-                        and self._api_protocol_working
-                    ):
-                        poll = await self._retry_on_failed_connection(
-                            lambda: self._api.updatedps(self._force_dps),
-                            f"Failed to update device dps for {self.name}",
+                # Connections are only closed once the loop is not using them
+                self._receiving.start()
+                try:
+                    if now - last_cache > self._CACHE_TIMEOUT:
+                        self._limit_requested_dps()
+                        if (
+                            self._force_dps
+                            and not dps_updated
+                            and not self._full_poll_due
+                            and self._api_protocol_working
+                        ):
+                            poll = await self._retry_on_failed_connection(
+                                partial(
+                                    self._async_call_api,
+                                    "updatedps",
+                                    "updatedps",
+                                    self._force_dps,
+                                ),
+                                f"Failed to update device dps for {self.name}",
+                                "updatedps",
+                            )
+                            dps_updated = True
+                        else:
+                            poll = await self._retry_on_failed_connection(
+                                partial(self._async_call_api, "status", "status"),
+                                f"Failed to fetch device status for {self.name}",
+                                "status",
+                            )
+                            dps_updated = False
+                            full_poll = True
+                            if poll and "Error" not in poll:
+                                self._full_poll_due = False
+                    elif persist and self._api_is_async:
+                        # The worker runs the receive loop, and pushes messages
+                        self._api.listen()
+                        with trace_span(
+                            "wait for message",
+                            "receive",
+                            self.name,
+                            track=RECEIVE_TRACK,
+                        ):
+                            poll = await self._async_observe(
+                                "receive",
+                                (),
+                                self._api.async_receive(
+                                    min(
+                                        last_cache + self._CACHE_TIMEOUT - now,
+                                        self._RECEIVE_TIMEOUT,
+                                    )
+                                ),
+                            )
+                    elif persist:
+                        await self._async_executor_job(
+                            self._call_api,
+                            "heartbeat",
+                            self._api.heartbeat,
+                            True,
                         )
-                        dps_updated = True
+                        with trace_span(
+                            "wait for message",
+                            "receive",
+                            self.name,
+                            track=RECEIVE_TRACK,
+                        ):
+                            poll = await self._async_executor_job(
+                                self._call_api,
+                                "receive",
+                                self._api.receive,
+                            )
                     else:
-                        poll = await self._retry_on_failed_connection(
-                            lambda: self._api.status(),
-                            f"Failed to fetch device status for {self.name}",
-                        )
-                        dps_updated = False
-                        full_poll = True
-                elif persist:
-                    await self._hass.async_add_executor_job(
-                        self._api.heartbeat,
-                        True,
-                    )
-                    poll = await self._hass.async_add_executor_job(
-                        self._api.receive,
-                    )
-                else:
+                        poll = None
+                        waiting = True
+                finally:
+                    self._receiving.done()
+                if waiting:
                     await asyncio.sleep(5)
-                    poll = None
 
+                if full_poll and not poll:
+                    failures += 1
                 if poll:
                     if "Error" in poll:
+                        self.metrics.receive_errors += 1
                         _LOGGER.warning(
                             "%s error reading: %s", self.name, poll["Error"]
                         )
@@ -308,13 +905,26 @@ class TuyaLocalDevice(object):
                                 self.name,
                                 poll["Payload"],
                             )
+                        if persist and poll.get("Err") in _CONNECTION_LOST:
+                            # Fetch the full state on reconnecting, to catch
+                            # up with changes made while disconnected.
+                            _LOGGER.info("%s connection lost", self.name)
+                            self.metrics.reconnects += 1
+                            self._cached_state["updated_at"] = 0
+                            # with status, not updatedps for the forced dps
+                            dps_updated = True
+                            failures += 1
                     else:
+                        failures = 0
                         if "dps" in poll:
                             poll = poll["dps"]
                         poll["full_poll"] = full_poll
                         yield poll
 
-                await asyncio.sleep(0.1 if self.has_returned_state else 5)
+                if failures:
+                    await asyncio.sleep(self._reconnect_delay(failures))
+                else:
+                    await asyncio.sleep(0.1 if self.has_returned_state else 5)
 
             except asyncio.CancelledError:
                 self._running = False
@@ -324,6 +934,7 @@ class TuyaLocalDevice(object):
                     self._api.parent.set_socketPersistent(False)
                 raise
             except Exception as t:
+                self.metrics.receive_errors += 1
                 _LOGGER.exception(
                     "%s receive loop error %s:%s",
                     self.name,
@@ -337,7 +948,8 @@ class TuyaLocalDevice(object):
         if self._api.parent:
             self._api.parent.set_socketPersistent(False)
 
-    async def async_possible_types(self):
+    async def async_detection_state(self):
+        """Return the state of the device to detect its type from."""
         cached_state = self._get_cached_state()
         if len(cached_state) <= 1:
             # in case of device22 devices, we need to poll them with a dp
@@ -345,44 +957,89 @@ class TuyaLocalDevice(object):
             # devices have dp 1. Lights generally start from 20.  101 is where
             # vendor specific dps start.  Between them, these three should cover
             # most devices.
-            self._api.set_dpsUsed({"1": None, "20": None, "101": None})
+            self._api.set_dpsUsed({id: None for id in DETECTION_PROBE_DPS})
             await self.async_refresh()
             cached_state = self._get_cached_state()
+        return cached_state
 
-        for match in possible_matches(cached_state):
-            yield match
+    async def async_detect(self):
+        """
+        Narrow down the possible types of the device from its dps, polling
+        for more dps until a single best match is found.
 
-    async def async_inferred_type(self):
-        best_match = None
-        best_quality = 0
-        cached_state = self._get_cached_state()
-        async for config in self.async_possible_types():
-            quality = config.match_quality(cached_state)
+        Returns:
+            the IncrementalDetector holding the candidates.
+        """
+        start = monotonic()
+        signatures = await self._hass.async_add_executor_job(load_signatures)
+        detector = IncrementalDetector(signatures)
+        probed = len(self._get_cached_state()) <= 1
+        state = await self.async_detection_state()
+        detector.observe(state)
+        # What the last status poll asked for and got back, where known.
+        requested = DETECTION_PROBE_DPS if probed else None
+        polled = [id for id in state if id != "updated_at"]
+        for _ in range(DETECTION_ROUNDS):
+            if detector.confident:
+                break
+            # Other devices return all their dps from a status poll, so
+            # only device22 devices, or ones that returned fewer dps than
+            # requested, are asked for the dps that would tell the remaining
+            # candidates apart.
+            if self._api.dev_type != "device22" and (
+                requested is None or len(polled) >= len(requested)
+            ):
+                break
+            ids = detector.unseen_dps(DETECTION_DPS)
+            if not ids:
+                break
+            dps = [id for id in self._get_cached_state() if id != "updated_at"]
+            requested = dps + ids
+            self._api.set_dpsUsed({id: None for id in requested})
+            polled = await self.async_refresh() or {}
+            if not detector.observe(self._get_cached_state()):
+                break
+        self.metrics.detection_time = monotonic() - start
+        self.metrics.detection_history = detector.history
+        for step in detector.history:
             _LOGGER.info(
-                "%s considering %s with quality %s",
+                "%s detection after %ss: %s dps, %s candidates, "
+                "best %s with quality %s",
                 self.name,
-                config.name,
-                quality,
+                step["elapsed"],
+                step["dps"],
+                step["candidates"],
+                step["best"],
+                step["quality"],
             )
-            if quality > best_quality:
-                best_quality = quality
-                best_match = config
+        return detector
 
+    async def async_possible_types(self):
+        detector = await self.async_detect()
+        for signature in detector.matches():
+            yield TuyaDeviceConfig(signature.fname)
+
+    async def async_inferred_type(self):
+        detector = await self.async_detect()
+        best_match, _ = detector.best()
         if best_match is None:
             _LOGGER.warning(
                 "Detection for %s with dps %s failed",
                 self.name,
-                log_json(cached_state),
+                log_json(self._get_cached_state()),
             )
             return None
 
         return best_match.config_type
 
     async def async_refresh(self):
+        """Poll the device for its state, returning the dps it reported."""
         _LOGGER.debug("Refreshing device state for %s", self.name)
-        await self._retry_on_failed_connection(
+        await self._commands.async_wait_idle()
+        return await self._retry_on_failed_connection(
             lambda: self._refresh_cached_state(),
             f"Failed to refresh device state for {self.name}.",
+            "status",
         )
 
     def get_property(self, dps_id):
@@ -409,7 +1066,7 @@ class TuyaLocalDevice(object):
         self._last_connection = 0
 
     def _refresh_cached_state(self):
-        new_state = self._api.status()
+        new_state = self._call_api("status", self._api.status)
         if new_state:
             self._cached_state = self._cached_state | new_state.get("dps", {})
             self._cached_state["updated_at"] = time()
@@ -428,6 +1085,7 @@ class TuyaLocalDevice(object):
             "new state (incl pending): %s",
             log_json(self._get_cached_state()),
         )
+        return new_state.get("dps", {}) if new_state else {}
 
     async def async_set_properties(self, properties):
         if len(properties) == 0:
@@ -436,6 +1094,17 @@ class TuyaLocalDevice(object):
         self._add_properties_to_pending_updates(properties)
         await self._debounce_sending_updates()
 
+    async def async_send_properties(self, properties):
+        """
+        Send properties straight away, without waiting to combine them with
+        other commands.
+
+        Returns:
+            True if the command was sent.
+        """
+        self._add_properties_to_pending_updates(properties)
+        return await self._send_pending_updates()
+
     def _add_properties_to_pending_updates(self, properties):
         now = time()
 
@@ -446,6 +1115,7 @@ class TuyaLocalDevice(object):
                 "updated_at": now,
                 "sent": False,
             }
+        self._record_reports(properties)
 
         _LOGGER.debug(
             "%s new pending updates: %s",
@@ -469,6 +1139,9 @@ class TuyaLocalDevice(object):
 
     async def _send_pending_updates(self):
         pending_properties = self._get_unsent_properties()
+        if not pending_properties:
+            # Already sent along with another command
+            return True
 
         _LOGGER.debug(
             "%s sending dps update: %s",
@@ -476,26 +1149,72 @@ class TuyaLocalDevice(object):
             log_json(pending_properties),
         )
 
-        await self._retry_on_failed_connection(
-            lambda: self._set_values(pending_properties),
-            "Failed to update device state.",
-        )
+        queued = monotonic()
+        self._commands.start()
+        try:
+            with trace_span(
+                "send pending updates",
+                "command",
+                self.name,
+                {"dps": list(pending_properties)},
+                COMMAND_TRACK,
+            ):
+                sent = await self._retry_on_failed_connection(
+                    partial(self._async_set_values, pending_properties, queued),
+                    "Failed to update device state.",
+                    "set",
+                )
+        finally:
+            self._commands.done()
+        return bool(sent)
 
-    def _set_values(self, properties):
+    def _set_values(self, properties, queued=None):
         try:
             self._lock.acquire()
-            self._api.set_multiple_values(properties, nowait=True)
-            self._cached_state["updated_at"] = 0
-            now = time()
-            self._last_connection = now
-            pending_updates = self._get_pending_updates()
-            for key in properties.keys():
-                pending_updates[key]["updated_at"] = now
-                pending_updates[key]["sent"] = True
+            if queued is not None:
+                self.metrics.command_wait.observe(monotonic() - queued)
+            self._call_api(
+                "set",
+                self._api.set_multiple_values,
+                properties,
+                nowait=True,
+            )
+            self._mark_sent(properties)
+            return True
         finally:
             self._lock.release()
 
-    async def _retry_on_failed_connection(self, func, error_message):
+    async def _async_set_values(self, properties, queued=None):
+        if not self._api_is_async:
+            # Commands have their own threads, so they are not stuck
+            # behind receives waiting for messages
+            return await self._async_executor_job(
+                self._set_values,
+                properties,
+                queued,
+                executor=get_command_executor(self._hass),
+            )
+        if queued is not None:
+            self.metrics.command_wait.observe(monotonic() - queued)
+        await self._async_call_api(
+            "set",
+            "set_multiple_values",
+            properties,
+            nowait=True,
+        )
+        self._mark_sent(properties)
+        return True
+
+    def _mark_sent(self, properties):
+        self._cached_state["updated_at"] = 0
+        now = time()
+        self._last_connection = now
+        pending_updates = self._get_pending_updates()
+        for key in properties.keys():
+            pending_updates[key]["updated_at"] = now
+            pending_updates[key]["sent"] = True
+
+    async def _retry_on_failed_connection(self, func, error_message, call=None):
         if self._api_protocol_version_index is None:
             await self._rotate_api_protocol_version()
         auto = (self._protocol_configured == "auto") and (
@@ -510,7 +1229,26 @@ class TuyaLocalDevice(object):
         for i in range(connections):
             try:
                 if not self._hass.is_stopping:
-                    retval = await self._hass.async_add_executor_job(func)
+                    with trace_span(
+                        f"{call or 'call'} attempt {i + 1}",
+                        "connection",
+                        self.name,
+                        track=COMMAND_TRACK if call == "set" else RECEIVE_TRACK,
+                    ):
+                        if asyncio.iscoroutinefunction(func):
+                            retval = await func()
+                        else:
+                            retval = await self._async_executor_job(
+                                func,
+                                # Commands have their own threads, so they
+                                # are not stuck behind receives waiting for
+                                # messages
+                                executor=(
+                                    get_command_executor(self._hass)
+                                    if call == "set"
+                                    else None
+                                ),
+                            )
                     if type(retval) is dict and "Error" in retval:
                         raise AttributeError(retval["Error"])
                     self._api_protocol_working = True
@@ -526,6 +1264,7 @@ class TuyaLocalDevice(object):
                 )
 
                 if i + 1 == connections:
+                    self.metrics.connection_failures += 1
                     self._reset_cached_state()
                     self._api_working_protocol_failures += 1
                     if (
@@ -537,6 +1276,8 @@ class TuyaLocalDevice(object):
                         entity.async_schedule_update_ha_state()
                     _LOGGER.error(error_message)
 
+                else:
+                    self.metrics.retries += 1
                 if not self._api_protocol_working:
                     await self._rotate_api_protocol_version()
 
@@ -570,7 +1311,7 @@ class TuyaLocalDevice(object):
         if self._api_protocol_version_index is None:
             try:
                 self._api_protocol_version_index = API_PROTOCOL_VERSIONS.index(
-                    self._protocol_configured
+                    self._negotiated_protocol or self._protocol_configured
                 )
             except ValueError:
                 self._api_protocol_version_index = 0
@@ -578,6 +1319,7 @@ class TuyaLocalDevice(object):
         # only rotate if configured as auto
         elif self._protocol_configured == "auto":
             self._api_protocol_version_index += 1
+            self.metrics.protocol_rotations += 1
 
         if self._api_protocol_version_index >= len(API_PROTOCOL_VERSIONS):
             self._api_protocol_version_index = 0
@@ -605,8 +1347,58 @@ class TuyaLocalDevice(object):
         return keys[values.index(value)] if value in values else fallback
 
 
+def _close_api(api):
+    """
+    Close an api that is not used again, and the gateway's it connects
+    through, releasing them from the worker process if it owns them.
+    """
+    api.close()
+    if api.parent:
+        api.parent.close()
+
+
+def _entity_ids(config):
+    """Return the config ids of the entities in a device config."""
+    return {e.config_id for e in [config.primary_entity, *config.secondary_entities()]}
+
+
+def hand_off_device(hass: HomeAssistant, config: dict, device):
+    """Keep a tested device, for setup_device to adopt shortly after."""
+    device_id = get_device_id(config)
+    hass.data.setdefault(DATA_HANDOFF, {})[device_id] = (monotonic(), device)
+    # Release it if setup never comes for it
+    hass.loop.call_later(
+        HANDOFF_TIMEOUT,
+        _expire_handoff,
+        hass,
+        device_id,
+        device,
+    )
+
+
+def _expire_handoff(hass: HomeAssistant, device_id, device):
+    handoffs = hass.data.get(DATA_HANDOFF, {})
+    if handoffs.get(device_id, (None, None))[1] is device:
+        del handoffs[device_id]
+        device.release()
+
+
+def _take_handed_off_device(hass: HomeAssistant, config: dict):
+    added, device = hass.data.get(DATA_HANDOFF, {}).pop(
+        get_device_id(config),
+        (None, None),
+    )
+    if device is None:
+        return None
+    if monotonic() - added > HANDOFF_TIMEOUT or not device.connection_matches(config):
+        device.release()
+        return None
+    return device
+
+
 def setup_device(hass: HomeAssistant, config: dict):
     """Setup a tuya device based on passed in config."""
+    tested = _take_handed_off_device(hass, config)
 
     _LOGGER.info("Creating device: %s", get_device_id(config))
     hass.data[DOMAIN] = hass.data.get(DOMAIN, {})
@@ -619,7 +1411,17 @@ def setup_device(hass: HomeAssistant, config: dict):
         config.get(CONF_DEVICE_CID),
         hass,
         config[CONF_POLL_ONLY],
+        get_worker(hass),
+        hass.data.get(DATA_OPTIONS, {}).get(
+            CONF_MESSAGE_HISTORY,
+            DEFAULT_HISTORY_SIZE,
+        ),
+        config.get(CONF_MIN_UPDATE_INTERVAL, 0),
+        config.get(CONF_DEADBAND, 0),
     )
+    if tested:
+        _LOGGER.debug("Adopting the tested connection for %s", config[CONF_NAME])
+        device.adopt(tested)
     hass.data[DOMAIN][get_device_id(config)] = {"device": device}
 
     return device
@@ -628,5 +1430,7 @@ def setup_device(hass: HomeAssistant, config: dict):
 async def async_delete_device(hass: HomeAssistant, config: dict):
     device_id = get_device_id(config)
     _LOGGER.info("Deleting device: %s", device_id)
-    await hass.data[DOMAIN][device_id]["device"].async_stop()
+    device = hass.data[DOMAIN][device_id]["device"]
+    await device.async_stop()
+    device.release()
     del hass.data[DOMAIN][device_id]["device"]
@@ -82,6 +82,8 @@ def _async_device_as_dict(
         "pending_state": device._pending_updates,
         "connected": device._running,
         "force_dps": device._force_dps,
+        "metrics": device.metrics.as_dict(),
+        "recent_messages": device.history.as_list(),
     }
 
     device_registry = dr.async_get(hass)
@@ -0,0 +1,101 @@
+"""
+Streaming aggregation of sensor values.
+
+Values reported by devices hold until the next report, so the mean is
+weighted by how long each value held, and the energy is a left Riemann sum
+of power over time.  Each sample is processed in constant amortized time,
+and only the samples within the window are kept.
+"""
+from collections import deque
+
+AGGREGATE_TYPES = ("mean", "min", "max", "energy")
+
+
+class WindowedAggregate:
+    """Time weighted mean, minimum and maximum over a sliding time window."""
+
+    def __init__(self, window):
+        self.window = window
+        # (sequence, start time, value) of each sample in the window
+        self._samples = deque()
+        # Samples that could still become the minimum or maximum
+        self._mins = deque()
+        self._maxs = deque()
+        # Sum of value * duration of all but the last sample
+        self._area = 0.0
+        self._sequence = 0
+
+    def add(self, time, value):
+        if self._samples:
+            _, start, last = self._samples[-1]
+            self._area += last * (time - start)
+        sample = (self._sequence, time, value)
+        self._sequence += 1
+        self._samples.append(sample)
+        while self._mins and self._mins[-1][2] >= value:
+            self._mins.pop()
+        self._mins.append(sample)
+        while self._maxs and self._maxs[-1][2] <= value:
+            self._maxs.pop()
+        self._maxs.append(sample)
+        self._evict(time)
+
+    def _evict(self, now):
+        """Drop samples that were replaced before the window started."""
+        start = now - self.window
+        while len(self._samples) > 1 and self._samples[1][1] <= start:
+            _, t, value = self._samples.popleft()
+            self._area -= value * (self._samples[0][1] - t)
+        oldest = self._samples[0][0] if self._samples else self._sequence
+        while self._mins and self._mins[0][0] < oldest:
+            self._mins.popleft()
+        while self._maxs and self._maxs[0][0] < oldest:
+            self._maxs.popleft()
+
+    def mean(self, now):
+        if not self._samples:
+            return None
+        self._evict(now)
+        window_start = now - self.window
+        _, first, first_value = self._samples[0]
+        _, last, last_value = self._samples[-1]
+        area = self._area + last_value * (now - last)
+        if first < window_start:
+            area -= first_value * (window_start - first)
+            first = window_start
+        duration = now - first
+        return area / duration if duration > 0 else last_value
+
+    def min(self, now):
+        self._evict(now)
+        return self._mins[0][2] if self._mins else None
+
+    def max(self, now):
+        self._evict(now)
+        return self._maxs[0][2] if self._maxs else None
+
+
+class EnergyIntegral:
+    """The energy used, from samples of power."""
+
+    def __init__(self, total=0.0, scale=1 / 1000):
+        """
+        Args:
+            total (float): the energy used so far, in kWh.
+            scale (float): the factor to convert power samples to kW.
+        """
+        self.total = total
+        self.scale = scale
+        self._last = None
+
+    def value(self, time):
+        """Return the energy used up to time, in kWh."""
+        if self._last is None:
+            return self.total
+        start, last_power = self._last
+        return self.total + last_power * self.scale * (time - start) / 3600
+
+    def add(self, time, power):
+        """Add a power sample, or None to stop integrating until the next."""
+        self.total = self.value(time)
+        self._last = None if power is None else (time, power)
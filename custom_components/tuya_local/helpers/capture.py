@@ -0,0 +1,142 @@
+"""
+Capture and replay of the traffic to and from a device.
+
+A capture is a file with one compact JSON record per line.  The first is a
+header describing the device, followed by the polls and errors received,
+and the commands sent, each with the time in seconds since the capture
+started.  Captures stop growing once they reach their maximum size.
+
+Replaying a capture feeds the polls into a TuyaLocalDevice and its entities
+without using the network, so real traffic can be used to reproduce and
+measure the load of processing updates.
+"""
+import asyncio
+import json
+import logging
+from threading import Lock
+from time import monotonic, time
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+
+HEADER = "header"
+POLL = "poll"
+ERROR = "error"
+SET = "set"
+
+
+def _encode(record):
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+class TrafficCapture:
+    """Write the traffic of a device to a file, up to a maximum size."""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.records = 0
+        self.full = False
+        self._file = None
+        self._started = None
+        self._lock = Lock()
+
+    def open(self, header):
+        """
+        Open the file and write the header.  This blocks.
+
+        An existing file is replaced, so the size limit covers the whole
+        file, and replays only see the one header and its start time.
+        """
+        self._started = time()
+        self._file = open(self.path, "w")
+        self._write(_encode({"type": HEADER, "started": self._started} | header))
+
+    def close(self):
+        """Close the file.  This blocks."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write(self, line):
+        if self.full or self._file is None:
+            return
+        if self.size + len(line) > self.max_bytes:
+            self.full = True
+            _LOGGER.warning(
+                "Capture to %s stopped after reaching %d bytes",
+                self.path,
+                self.size,
+            )
+            return
+        self._file.write(line)
+        self.size += len(line)
+        self.records += 1
+
+    def record(self, kind, data, **extra):
+        """Append a record.  This is called from executor threads."""
+        line = _encode(
+            {"t": round(time() - self._started, 3), "type": kind, "data": data} | extra
+        )
+        with self._lock:
+            self._write(line)
+
+    def record_call(self, name, args, result):
+        """Record the traffic of a call to the api."""
+        if name == "set":
+            self.record(SET, args[0])
+        elif type(result) is dict:
+            if "Error" in result:
+                self.record(ERROR, result["Error"])
+            elif "dps" in result:
+                self.record(POLL, result["dps"], full=name == "status")
+
+
+def read_capture(path):
+    """Return the records of a capture file.  This blocks."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def async_replay(device, records, speed=1.0):
+    """
+    Feed the records of a capture into device.
+
+    Args:
+        device (TuyaLocalDevice): the device to replay into.
+        records (list): the records returned by read_capture.
+        speed (float): how much faster than the original to replay, or 0 to
+            replay as fast as possible.
+    Returns:
+        the number of polls replayed, and the total time spent processing
+        them in seconds.
+    """
+    start = monotonic()
+    polls = 0
+    processing = 0.0
+    for record in records:
+        kind = record["type"]
+        if kind == HEADER:
+            continue
+        if speed:
+            delay = record["t"] / speed - (monotonic() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if kind == POLL:
+            poll = dict(record["data"])
+            poll["full_poll"] = record.get("full", False)
+            device.metrics.messages_received += 1
+            begin = monotonic()
+            device._process_poll(poll)
+            processing += monotonic() - begin
+            polls += 1
+        elif kind == SET:
+            device._add_properties_to_pending_updates(record["data"])
+        elif kind == ERROR:
+            device.metrics.receive_errors += 1
+        # Let other tasks run between records, as the receive loop would.
+        await asyncio.sleep(0)
+    return polls, processing
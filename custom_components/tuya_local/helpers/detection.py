@@ -0,0 +1,210 @@
+"""
+Incremental detection of device types from the dps they report.
+
+The configs are reduced to signatures of the dps they declare, which are
+indexed by dp id, so each dp observed only needs to be checked against the
+configs that declare it.  Candidates are eliminated when a dp they declare
+reports a value of the wrong type, and become matches once all the dps
+they require have been seen, so detection can stop as soon as a single
+best match has been found.
+"""
+import logging
+from os import scandir
+from os.path import dirname, splitext
+from time import monotonic
+
+import custom_components.tuya_local.devices as config_dir
+
+from .device_config import TuyaDeviceConfig, _typematch
+
+_LOGGER = logging.getLogger(__name__)
+
+# Signatures of the configs, with the modification time of their file, so
+# they are only parsed again when the file changes.
+_SIGNATURES = {}
+
+
+class ConfigSignature:
+    """The dps declared by a config, as needed for detection."""
+
+    __slots__ = ("fname", "order", "dps", "required")
+
+    def __init__(self, fname, order, dps):
+        """
+        Args:
+            fname (str): the filename of the config.
+            order (int): the position of the config, for breaking ties.
+            dps (dict): the types declared for each dp id, and whether the
+                dp is required.
+        """
+        self.fname = fname
+        self.order = order
+        self.dps = dps
+        self.required = sum(1 for _, required in dps.values() if required)
+
+    @property
+    def config_type(self):
+        return splitext(self.fname)[0]
+
+    @classmethod
+    def from_config(cls, config, order=0):
+        dps = {}
+        for dp in config._get_all_dps():
+            types, required = dps.get(dp.id, ((), False))
+            dps[dp.id] = (types + (dp.type,), required or not dp.optional)
+        return cls(config._fname, order, dps)
+
+    def accepts(self, id, value):
+        """Return whether value has the type declared for dp id."""
+        try:
+            return all(_typematch(t, value) for t in self.dps[id][0])
+        except TypeError:
+            return False
+
+
+def load_signatures():
+    """
+    Return the signatures of all the configs, parsing those that changed.
+
+    This blocks, so use the executor.
+    """
+    seen = set()
+    signatures = []
+    with scandir(dirname(config_dir.__file__)) as entries:
+        files = sorted(
+            (e.name, e.stat().st_mtime) for e in entries if e.name.endswith(".yaml")
+        )
+    for order, (fname, mtime) in enumerate(files):
+        seen.add(fname)
+        cached = _SIGNATURES.get(fname)
+        if cached is None or cached[0] != mtime:
+            try:
+                cached = (
+                    mtime,
+                    ConfigSignature.from_config(TuyaDeviceConfig(fname)),
+                )
+            except Exception:
+                _LOGGER.error("Parse error in %s", fname)
+                continue
+            _SIGNATURES[fname] = cached
+        signature = cached[1]
+        signature.order = order
+        signatures.append(signature)
+    for fname in _SIGNATURES.keys() - seen:
+        del _SIGNATURES[fname]
+    return signatures
+
+
+class IncrementalDetector:
+    """Narrow down the configs that match a device as its dps are seen."""
+
+    def __init__(self, signatures):
+        self._index = {}
+        for signature in signatures:
+            for id in signature.dps:
+                self._index.setdefault(id, []).append(signature)
+        self._candidates = set(signatures)
+        # For each candidate, the observed dps it declares, and the number
+        # of required dps not yet observed
+        self._matched = {s: 0 for s in signatures}
+        self._missing = {s: s.required for s in signatures}
+        self._observed = set()
+        self._start = monotonic()
+        self.history = []
+
+    @property
+    def candidates(self):
+        return len(self._candidates)
+
+    def observe(self, dps):
+        """
+        Narrow down the candidates with newly reported dps.
+
+        Returns:
+            True if any of the dps had not been observed before.
+        """
+        new = [id for id in dps if id not in self._observed and id != "updated_at"]
+        for id in new:
+            self._observed.add(id)
+            for signature in self._index.get(id, ()):
+                if signature not in self._candidates:
+                    continue
+                if not signature.accepts(id, dps[id]):
+                    self._candidates.discard(signature)
+                    continue
+                self._matched[signature] += 1
+                if signature.dps[id][1]:
+                    self._missing[signature] -= 1
+        if new:
+            best, quality = self.best()
+            self.history.append(
+                {
+                    "elapsed": round(monotonic() - self._start, 3),
+                    "dps": len(self._observed),
+                    "candidates": len(self._candidates),
+                    "best": best.config_type if best else None,
+                    "quality": quality,
+                    "confident": self.confident,
+                }
+            )
+        return bool(new)
+
+    def matches(self):
+        """Return the candidates that have all their required dps, in order."""
+        return sorted(
+            (s for s in self._candidates if not self._missing[s]),
+            key=lambda s: s.order,
+        )
+
+    def quality(self, signature):
+        """Return the percentage of the observed dps that signature declares."""
+        if not self._observed:
+            return 0
+        return round(self._matched[signature] * 100 / len(self._observed))
+
+    def best(self):
+        """
+        Return the best match so far, the first of any with equal quality.
+
+        Returns:
+            the signature and quality, or None and 0 if nothing matches.
+        """
+        best, best_quality = None, 0
+        for signature in self.matches():
+            quality = self.quality(signature)
+            if quality > best_quality:
+                best, best_quality = signature, quality
+        return best, best_quality
+
+    @property
+    def confident(self):
+        """
+        Whether the best match is certain.
+
+        This requires a single match that declares all the dps observed,
+        with no other candidates that could become equally good matches.
+        """
+        perfect = [
+            s for s in self._candidates if self._matched[s] == len(self._observed)
+        ]
+        return (
+            len(self._observed) > 0
+            and len(perfect) == 1
+            and not self._missing[perfect[0]]
+        )
+
+    def unseen_dps(self, limit=None):
+        """
+        Return the dp ids declared by the best candidates that are not yet
+        observed, most commonly declared first.
+        """
+        counts = {}
+        most = max((self._matched[s] for s in self._candidates), default=0)
+        for signature in self._candidates:
+            if self._matched[signature] < most:
+                continue
+            for id in signature.dps:
+                if id not in self._observed:
+                    counts[id] = counts.get(id, 0) + 1
+        ids = sorted(counts, key=lambda id: (-counts[id], len(id), id))
+        return ids[:limit] if limit else ids
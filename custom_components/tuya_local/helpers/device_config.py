@@ -5,18 +5,27 @@ from base64 import b64decode, b64encode
 
 from collections.abc import Sequence
 from fnmatch import fnmatch
+import json
 import logging
 from numbers import Number
 from os import walk
-from os.path import join, dirname, splitext, exists
+from os.path import join, dirname, splitext, exists, getmtime
+from time import monotonic
 
+from homeassistant.exceptions import HomeAssistantError
 from homeassistant.util import slugify
 from homeassistant.util.yaml import load_yaml
 
 import custom_components.tuya_local.devices as config_dir
 
+from .extrapolate import LinearExtrapolation, extrapolate, next_change
+
 _LOGGER = logging.getLogger(__name__)
 
+# Configs in use, with the modification time of their file when parsed, so
+# they are only parsed again when the file changes.
+_CONFIG_CACHE = {}
+
 
 def _typematch(type, value):
     # Workaround annoying legacy of bool being a subclass of int in Python
@@ -92,15 +101,13 @@ def _remove_duplicates(seq):
 class TuyaDeviceConfig:
     """Representation of a device config for Tuya Local devices."""
 
-    def __init__(self, fname):
+    def __init__(self, fname, cache=False):
         """Initialize the device config.
         Args:
-            fname (string): The filename of the yaml config to load."""
-        _CONFIG_DIR = dirname(config_dir.__file__)
+            fname (string): The filename of the yaml config to load.
+            cache (bool): Whether to keep the parsed config for reuse."""
         self._fname = fname
-        filename = join(_CONFIG_DIR, fname)
-        self._config = load_yaml(filename)
-        _LOGGER.debug("Loaded device config %s", fname)
+        self._config = _load_config(fname, cache)
 
     @property
     def name(self):
@@ -136,6 +143,15 @@ class TuyaDeviceConfig:
         for conf in self._config.get("secondary_entities", {}):
             yield TuyaEntityConfig(self, conf)
 
+    def find_entity(self, config_id):
+        """Find the entity with the specified config id."""
+        if self.primary_entity.config_id == config_id:
+            return self.primary_entity
+        for e in self.secondary_entities():
+            if e.config_id == config_id:
+                return e
+        return None
+
     def matches(self, dps):
         required_dps = self._get_required_dps()
 
@@ -289,6 +305,11 @@ class TuyaEntityConfig:
                 priority = rule["priority"]
         return icon
 
+    @property
+    def aggregates(self):
+        """Return the aggregates to calculate (used by Sensor entities)."""
+        return self._config.get("aggregates", [])
+
     @property
     def mode(self):
         """Return the mode (used by Number entities)."""
@@ -354,6 +375,27 @@ class TuyaDpsConfig:
     def force(self):
         return self._config.get("force", False)
 
+    @property
+    def min_interval(self):
+        """The minimum seconds between state writes caused by this dp."""
+        return self._config.get("min_interval", 0)
+
+    @property
+    def deadband(self):
+        """Changes smaller than this are not written, may be a percentage."""
+        return self._config.get("deadband")
+
+    @property
+    def extrapolation(self):
+        """How the value changes between reports, if it changes steadily."""
+        config = self._config.get("extrapolate")
+        return None if config is None else LinearExtrapolation.from_config(config)
+
+    @property
+    def field(self):
+        """The field within a json dp that this config refers to."""
+        return self._config.get("field")
+
     @property
     def format(self):
         fmt = self._config.get("format")
@@ -381,7 +423,7 @@ class TuyaDpsConfig:
         return None
 
     def mask(self, device):
-        mapping = self._find_map_for_dps(device.get_property(self.id))
+        mapping = self._find_map_for_dps(self._raw_value(device))
         if mapping:
             mask = mapping.get("mask")
             if mask:
@@ -397,11 +439,88 @@ class TuyaDpsConfig:
             map_scale = self.scale(device)
             return ((value & mask) // scale) / map_scale
         else:
-            return self._map_from_dps(device.get_property(self.id), device)
+            value = self._raw_value(device)
+            if "extrapolate" in self._config:
+                value = self.extrapolate(device, value)[0]
+            return self._map_from_dps(value, device)
+
+    def extrapolate(self, device, value):
+        """
+        Extrapolate the raw value from the time it was last reported.
+
+        Returns:
+            a tuple of the current value, and the seconds until it next
+            changes, or None if it is not changing.
+        """
+        model = self.extrapolation
+        if model is None or not isinstance(value, Number) or isinstance(value, bool):
+            return value, None
+        ids = [self.id]
+        target = None
+        if model.toward is not None:
+            toward = self._entity.find_dps(model.toward)
+            if toward is None:
+                return value, None
+            ids.append(toward.id)
+            target = toward._raw_value(device)
+        since = device.reported_at(*ids)
+        if since is None:
+            return value, None
+        r = self.range(device, scaled=False) or {}
+        rate, limit = model.rate_and_limit(value, target, r.get("min"), r.get("max"))
+        elapsed = monotonic() - since
+        return (
+            extrapolate(value, rate, limit, elapsed),
+            next_change(value, rate, limit, elapsed),
+        )
+
+    def _raw_value(self, device):
+        """Return the raw value, or the raw field value within a json dp."""
+        if self.field is None:
+            return device.get_property(self.id)
+        parsed = self.decoded_value(device)
+        return parsed.get(self.field) if isinstance(parsed, dict) else None
 
     def decoded_value(self, device):
-        v = self._map_from_dps(device.get_property(self.id), device)
-        if self.rawtype == "hex" and isinstance(v, str):
+        if self.rawtype == "json":
+            # mappings apply to the fields within json, not the whole string
+            v = device.get_property(self.id)
+        else:
+            v = self._map_from_dps(device.get_property(self.id), device)
+        if self.rawtype in ["hex", "base64", "json"] and isinstance(v, str):
+            # Encoded values such as camera snapshots can be large, and
+            # json dps are read by every field and condition that refers to
+            # them, so the last decoding of each dp is kept on the device.
+            # Dp configs are created on demand, so cannot hold it themselves.
+            key = (self.id, self.rawtype)
+            cached = device.decoded_dps.get(key)
+            # Binary values are checked by length and hash, so the cache
+            # does not keep the raw string alive once the device state has
+            # moved on.  Python caches string hashes, so this is cheap.
+            # Json is small, and compared exactly, usually by identity.
+            raw = v if self.rawtype == "json" else (len(v), hash(v))
+            if cached is not None and cached[0] == raw:
+                return cached[1]
+            decoded = self._decode(v, device)
+            device.decoded_dps[key] = (raw, decoded)
+            return decoded
+        else:
+            return v
+
+    def _decode(self, v, device):
+        """Decode a hex, base64 or json encoded string."""
+        if self.rawtype == "json":
+            try:
+                return json.loads(v)
+            except ValueError:
+                _LOGGER.warning(
+                    "%s sent invalid json '%s' for %s",
+                    device.name,
+                    v,
+                    self.name,
+                )
+                return None
+        elif self.rawtype == "hex":
             try:
                 return bytes.fromhex(v)
             except ValueError:
@@ -412,8 +531,7 @@ class TuyaDpsConfig:
                     self.name,
                 )
                 return None
-
-        elif self.rawtype == "base64" and isinstance(v, str):
+        else:
             try:
                 return b64decode(v)
             except ValueError:
@@ -424,14 +542,14 @@ class TuyaDpsConfig:
                     self.name,
                 )
                 return None
-        else:
-            return v
 
     def encode_value(self, v):
         if self.rawtype == "hex":
             return v.hex()
         elif self.rawtype == "base64":
             return b64encode(v).decode("utf-8")
+        elif self.rawtype == "json":
+            return json.dumps(v, separators=(",", ":"))
         else:
             return v
 
@@ -520,7 +638,7 @@ class TuyaDpsConfig:
     def range(self, device, scaled=True):
         """Return the range for this dps if configured."""
         scale = self.scale(device) if scaled else 1
-        mapping = self._find_map_for_dps(device.get_property(self.id))
+        mapping = self._find_map_for_dps(self._raw_value(device))
         r = self._config.get("range")
         if mapping:
             _LOGGER.debug("Considering mapping for range of %s", self.name)
@@ -535,7 +653,7 @@ class TuyaDpsConfig:
 
     def scale(self, device):
         scale = 1
-        mapping = self._find_map_for_dps(device.get_property(self.id))
+        mapping = self._find_map_for_dps(self._raw_value(device))
         if mapping:
             scale = mapping.get("scale", 1)
             cond = self._active_condition(mapping, device)
@@ -559,7 +677,7 @@ class TuyaDpsConfig:
     def step(self, device, scaled=True):
         step = 1
         scale = self.scale(device) if scaled else 1
-        mapping = self._find_map_for_dps(device.get_property(self.id))
+        mapping = self._find_map_for_dps(self._raw_value(device))
         if mapping:
             _LOGGER.debug("Considering mapping for step of %s", self.name)
             step = mapping.get("step", 1)
@@ -728,7 +846,7 @@ class TuyaDpsConfig:
                     # the dp to match, or it already matches
                     if (c_dp.id != self.id and not c_dp.readonly) or (
                         _equal_or_in(
-                            device.get_property(c_dp.id),
+                            c_dp._raw_value(device),
                             c.get("dps_val"),
                         )
                     ):
@@ -747,7 +865,7 @@ class TuyaDpsConfig:
         c_match = None
         if constraint and conditions:
             c_dps = self._entity.find_dps(constraint)
-            c_val = None if c_dps is None else device.get_property(c_dps.id)
+            c_val = None if c_dps is None else c_dps._raw_value(device)
             for cond in conditions:
                 if c_val is not None and (_equal_or_in(c_val, cond.get("dps_val"))):
                     c_match = cond
@@ -767,8 +885,14 @@ class TuyaDpsConfig:
 
         return c_match
 
-    def get_values_to_set(self, device, value):
-        """Return the dps values that would be set when setting to value"""
+    def get_values_to_set(self, device, value, pending=None):
+        """
+        Return the dps values that would be set when setting to value.
+
+        Args:
+            pending: dps values already being set along with this one, so
+                that changes to other fields of the same json dp are kept.
+        """
         result = value
         dps_map = {}
         if self.readonly:
@@ -805,7 +929,7 @@ class TuyaDpsConfig:
                     )
                     if c_dps.id != self.id and single_match:
                         c_val = c_dps._map_from_dps(
-                            cond.get("dps_val", device.get_property(c_dps.id)),
+                            cond.get("dps_val", c_dps._raw_value(device)),
                             device,
                         )
                         dps_map.update(c_dps.get_values_to_set(device, c_val))
@@ -821,7 +945,7 @@ class TuyaDpsConfig:
             if redirect:
                 _LOGGER.debug("Redirecting %s to %s", self.name, redirect)
                 r_dps = self._entity.find_dps(redirect)
-                return r_dps.get_values_to_set(device, value)
+                return r_dps.get_values_to_set(device, value, pending)
 
             if scale != 1 and isinstance(result, Number):
                 _LOGGER.debug("Scaling %s by %s", result, scale)
@@ -874,11 +998,43 @@ class TuyaDpsConfig:
             result = (current_value & ~mask) | (mask & (result * mask_scale))
             result = self.encode_value(result.to_bytes(length, "big"))
 
+        if self.field is not None:
+            changed = dps_map.get(self.id)
+            if changed is None and pending is not None:
+                changed = pending.get(self.id)
+            result = self._encode_field(device, result, changed)
+
         dps_map[self.id] = self._correct_type(result)
         return dps_map
 
+    def _encode_field(self, device, value, pending=None):
+        """
+        Return the json dp value with this field changed to value.
+
+        Args:
+            pending: the json dp value already being set with other fields
+                changed, to change along with this field.
+        """
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        key = (self.id, self.rawtype)
+        if isinstance(pending, str):
+            cached = device.decoded_dps.get(key)
+            if cached is not None and cached[0] == pending:
+                current = cached[1]
+            else:
+                current = self._decode(pending, device)
+        else:
+            current = self.decoded_value(device)
+        parsed = dict(current) if isinstance(current, dict) else {}
+        parsed[self.field] = value
+        encoded = self.encode_value(parsed)
+        # Prime the cache, so the pending value is not parsed again
+        device.decoded_dps[key] = (encoded, parsed)
+        return encoded
+
     def icon_rule(self, device):
-        mapping = self._find_map_for_dps(device.get_property(self.id))
+        mapping = self._find_map_for_dps(self._raw_value(device))
         icon = None
         priority = 100
         if mapping:
@@ -892,6 +1048,42 @@ class TuyaDpsConfig:
         return {"priority": priority, "icon": icon}
 
 
+def _load_config(fname, cache=False):
+    """Parse a config file, unless an unchanged parse is cached."""
+    filename = join(dirname(config_dir.__file__), fname)
+    mtime = getmtime(filename)
+    cached = _CONFIG_CACHE.get(fname)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    config = load_yaml(filename)
+    _LOGGER.debug("Loaded device config %s", fname)
+    if cache:
+        _CONFIG_CACHE[fname] = (mtime, config)
+    return config
+
+
+def reload_changed_configs():
+    """
+    Parse the cached configs again if their files have changed.  This blocks.
+
+    Returns:
+        the config types that changed.
+    """
+    changed = []
+    for fname, (mtime, _) in list(_CONFIG_CACHE.items()):
+        filename = join(dirname(config_dir.__file__), fname)
+        if not exists(filename):
+            del _CONFIG_CACHE[fname]
+        elif getmtime(filename) != mtime:
+            try:
+                _load_config(fname, cache=True)
+            except HomeAssistantError as e:
+                _LOGGER.error("Keeping previous %s, as it failed to load: %s", fname, e)
+                continue
+            changed.append(splitext(fname)[0])
+    return changed
+
+
 def available_configs():
     """List the available config files."""
     _CONFIG_DIR = dirname(config_dir.__file__)
@@ -921,7 +1113,7 @@ def get_config(conf_type):
     fname = conf_type + ".yaml"
     fpath = join(_CONFIG_DIR, fname)
     if exists(fpath):
-        return TuyaDeviceConfig(fname)
+        return TuyaDeviceConfig(fname, cache=True)
     else:
         return config_for_legacy_use(conf_type)
 
@@ -0,0 +1,88 @@
+"""
+Extrapolation of dps that change steadily between reports.
+
+Countdown timers, and covers moving to a position, only report their
+progress occasionally.  Dps can declare the rate at which they change, so
+that their current value is calculated from the last report and the time
+elapsed since, in whole steps of the raw value.  The device then only needs
+to be asked for the real value once the change is predicted to end.
+"""
+
+
+def _steps(rate, elapsed):
+    # Round away float error first, so a step is not missed at its boundary
+    return int(round(rate * elapsed, 9))
+
+
+def extrapolate(value, rate, limit, elapsed):
+    """Return the value after changing at rate per second for elapsed seconds."""
+    value = value + _steps(rate, elapsed)
+    if limit is None:
+        return value
+    return max(value, limit) if rate < 0 else min(value, limit)
+
+
+def next_change(value, rate, limit, elapsed):
+    """
+    Return the seconds until the extrapolated value next changes.
+
+    Returns None if the value is not changing, or has reached the limit.
+    """
+    if not rate:
+        return None
+    if limit is not None and extrapolate(value, rate, limit, elapsed) == limit:
+        return None
+    step = abs(_steps(rate, elapsed)) + 1
+    return max(step / abs(rate) - elapsed, 0)
+
+
+class LinearExtrapolation:
+    """The extrapolation declared for a dp."""
+
+    __slots__ = ("rate", "travel_time", "toward")
+
+    def __init__(self, rate=None, travel_time=None, toward=None):
+        """
+        Args:
+            rate (float): the change in the raw value per second, negative
+                for countdowns.
+            travel_time (float): the seconds to change across the whole
+                range, as an alternative to rate.
+            toward (str): the name of a dp in the same entity whose value
+                this changes toward, such as the target of a cover.
+        """
+        self.rate = rate
+        self.travel_time = travel_time
+        self.toward = toward
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config.get("rate"),
+            config.get("travel_time"),
+            config.get("toward"),
+        )
+
+    def rate_and_limit(self, value, target, low, high):
+        """
+        Return the signed rate and the limit for extrapolating value.
+
+        Args:
+            value: the last reported raw value.
+            target: the raw value of the toward dp, if configured.
+            low, high: the raw range of the dp, if known.
+
+        Without toward, the range is needed to know where the change ends,
+        so without either the value is not extrapolated.
+        """
+        if self.travel_time:
+            rate = ((high or 100) - (low or 0)) / self.travel_time
+        else:
+            rate = self.rate or 0
+        if self.toward is None:
+            if low is None or high is None:
+                return 0, None
+            return rate, low if rate < 0 else high
+        if target is None or target == value:
+            return 0, target
+        return (abs(rate) if target > value else -abs(rate)), target
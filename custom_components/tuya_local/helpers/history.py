@@ -0,0 +1,50 @@
+"""
+History of the recent messages exchanged with a device, for diagnostics.
+"""
+from threading import Lock
+from time import time
+
+DEFAULT_HISTORY_SIZE = 20
+
+
+class MessageHistory:
+    """A fixed size ring buffer of the messages received and sent."""
+
+    def __init__(self, size=DEFAULT_HISTORY_SIZE):
+        self.size = size
+        self._entries = [None] * size
+        self._next = 0
+        self._lock = Lock()
+
+    def record(self, direction, call, latency, data):
+        """Add a message, overwriting the oldest once full."""
+        if not self.size:
+            return
+        entry = (time(), direction, call, latency, data)
+        with self._lock:
+            self._entries[self._next % self.size] = entry
+            self._next += 1
+
+    def record_call(self, name, args, result, latency):
+        """Record the message exchanged by a call to the api, if any."""
+        if name == "set":
+            self.record("sent", name, latency, args[0])
+        elif type(result) is dict:
+            self.record("received", name, latency, result.get("dps", result))
+
+    def as_list(self):
+        """Return the messages, oldest first."""
+        with self._lock:
+            count = min(self._next, self.size)
+            start = self._next - count
+            entries = [self._entries[i % self.size] for i in range(start, self._next)]
+        return [
+            {
+                "time": t,
+                "direction": direction,
+                "call": call,
+                "latency_ms": round(latency * 1000, 1),
+                "data": data,
+            }
+            for t, direction, call, latency, data in entries
+        ]
@@ -0,0 +1,147 @@
+"""
+Performance metrics for Tuya Local devices.
+"""
+from bisect import bisect_left
+from time import monotonic
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Calls to the device that are measured
+CALLS = ("status", "updatedps", "set", "heartbeat", "receive")
+# Calls that wait for the device to respond, so measure the response time
+RESPONSE_CALLS = ("status", "updatedps")
+# Weight of the latest call in the average response time
+_RESPONSE_WEIGHT = 0.2
+
+
+class LatencyHistogram:
+    """A fixed bucket histogram of call durations."""
+
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """Return the upper bound of the bucket containing the percentile."""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 1)
+
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count) if self.count else None,
+            "p50_ms": ms(self.percentile(0.5)),
+            "p95_ms": ms(self.percentile(0.95)),
+            "max_ms": ms(self.max),
+            "buckets": {
+                f"{ms(b):g}ms": n for b, n in zip(LATENCY_BUCKETS, self.buckets)
+            }
+            | {"more": self.buckets[-1]},
+        }
+
+
+class DeviceMetrics:
+    """Counters and latency histograms for the calls made to a device."""
+
+    def __init__(self):
+        self.started = monotonic()
+        self.latency = {c: LatencyHistogram() for c in CALLS}
+        self.failures = {c: 0 for c in CALLS}
+        # Time from commands being ready to send until they are sent
+        self.command_wait = LatencyHistogram()
+        self.response_time = None
+        self.retries = 0
+        self.connection_failures = 0
+        self.reconnects = 0
+        self.protocol_rotations = 0
+        self.messages_received = 0
+        self.receive_errors = 0
+        self.detection_time = None
+        # How the candidate types narrowed as dps were seen during detection
+        self.detection_history = []
+        self.stalls = {}
+
+    def call(self, name, func, *args, **kwargs):
+        """Call func, recording how long it took and whether it failed."""
+        start = monotonic()
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = isinstance(result, dict) and "Error" in result
+            return result
+        finally:
+            self.observe(name, monotonic() - start, failed)
+
+    async def async_call(self, name, coro):
+        """Await coro, recording how long it took and whether it failed."""
+        start = monotonic()
+        failed = True
+        try:
+            result = await coro
+            failed = isinstance(result, dict) and "Error" in result
+            return result
+        finally:
+            self.observe(name, monotonic() - start, failed)
+
+    def observe(self, name, elapsed, failed=False):
+        """Record a call that took elapsed seconds."""
+        self.latency[name].observe(elapsed)
+        if failed:
+            self.failures[name] += 1
+        elif name in RESPONSE_CALLS:
+            ms = elapsed * 1000
+            if self.response_time is None:
+                self.response_time = ms
+            else:
+                self.response_time += _RESPONSE_WEIGHT * (ms - self.response_time)
+
+    def record_stall(self, source):
+        """Count a callback that blocked the event loop for too long."""
+        self.stalls[source] = self.stalls.get(source, 0) + 1
+
+    @property
+    def message_rate(self):
+        """Messages received per minute since the metrics started."""
+        minutes = (monotonic() - self.started) / 60
+        return round(self.messages_received / minutes, 2) if minutes else 0.0
+
+    def as_dict(self):
+        return {
+            "calls": {c: h.as_dict() for c, h in self.latency.items()},
+            "failures": dict(self.failures),
+            "command_wait": self.command_wait.as_dict(),
+            "response_time_ms": (
+                None if self.response_time is None else round(self.response_time, 1)
+            ),
+            "retries": self.retries,
+            "connection_failures": self.connection_failures,
+            "reconnects": self.reconnects,
+            "protocol_rotations": self.protocol_rotations,
+            "messages_received": self.messages_received,
+            "messages_per_minute": self.message_rate,
+            "receive_errors": self.receive_errors,
+            "detection_time": self.detection_time,
+            "detection_history": self.detection_history,
+            "event_loop_stalls": dict(self.stalls),
+        }
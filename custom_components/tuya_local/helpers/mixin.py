@@ -26,6 +26,35 @@ class TuyaLocalEntity:
             if not d.hidden:
                 self._attr_dps.append(d)
 
+    def reload_config(self, config):
+        """
+        Switch to a changed config, without recreating the entity.
+
+        The platform's initialisation is run again with the new config, so
+        the dps and the features derived from them are refreshed.
+
+        Returns:
+            False if the entity needs to be recreated to use the config.
+        """
+        if config.aggregates != self._config.aggregates:
+            # Aggregates are separate entities, added with the platform
+            return False
+        saved = vars(self).copy()
+        # Let features built up during initialisation start from the defaults
+        for attr in [a for a in saved if a.startswith("_attr_")]:
+            delattr(self, attr)
+        try:
+            self._reinit(config)
+        except Exception as e:
+            _LOGGER.warning("%s cannot use the changed config: %s", config.config_id, e)
+            vars(self).clear()
+            vars(self).update(saved)
+            return False
+        return True
+
+    def _reinit(self, config):
+        self.__init__(self._device, config)
+
     @property
     def should_poll(self):
         return False
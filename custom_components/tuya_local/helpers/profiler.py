@@ -0,0 +1,144 @@
+"""
+Sampling profiler for Tuya Local code.
+
+A background thread periodically samples the stacks of all threads, and
+counts the Tuya Local functions found on them.  This works across the event
+loop and executor threads without needing a restart, and the overhead is
+low enough to run on a production instance for a few minutes.
+
+Time spent inside tinytuya (communicating with devices, including waiting
+for them to respond) is counted separately, so that the functions reported
+are those where Tuya Local itself is busy.
+"""
+from os.path import dirname, relpath
+import sys
+from threading import Event, Thread, get_ident
+from time import monotonic
+
+DEFAULT_INTERVAL = 0.005
+
+_SCOPE = dirname(dirname(__file__))
+
+
+def _in_scope(filename):
+    return filename.startswith(_SCOPE)
+
+
+def _is_tinytuya(filename):
+    return "tinytuya" in filename
+
+
+class SamplingProfiler:
+    """Count the Tuya Local functions on the stack of every thread."""
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.io_samples = 0
+        self.own = {}
+        self.total = {}
+        self.duration = 0.0
+        self._stop = Event()
+        self._thread = None
+        self._started = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        self._stop.clear()
+        self._started = monotonic()
+        self._thread = Thread(
+            target=self._run,
+            name="tuya_local_profiler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling.  This waits for the sampling thread to exit."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.duration = monotonic() - self._started
+
+    def _run(self):
+        me = get_ident()
+        while not self._stop.wait(self.interval):
+            for thread, frame in sys._current_frames().items():
+                if thread != me:
+                    self.sample(frame)
+
+    def sample(self, frame):
+        """Record the Tuya Local functions on the stack ending with frame."""
+        functions = []
+        io = False
+        while frame is not None:
+            code = frame.f_code
+            if _in_scope(code.co_filename):
+                functions.append(
+                    (code.co_filename, code.co_firstlineno, code.co_qualname)
+                )
+            elif not functions and _is_tinytuya(code.co_filename):
+                io = True
+            frame = frame.f_back
+        if not functions:
+            return
+        self.samples += 1
+        if io:
+            self.io_samples += 1
+            return
+        self.own[functions[0]] = self.own.get(functions[0], 0) + 1
+        for function in set(functions):
+            self.total[function] = self.total.get(function, 0) + 1
+
+    @staticmethod
+    def describe(function):
+        filename, line, name = function
+        return f"{relpath(filename, _SCOPE)}:{line}({name})"
+
+    def ranked(self, module=None):
+        """Return the functions, optionally only from module, busiest first."""
+        functions = [
+            f for f in self.own if module is None or relpath(f[0], _SCOPE) == module
+        ]
+        return sorted(functions, key=lambda f: (-self.own[f], -self.total[f]))
+
+    def summary(self, limit=40):
+        """Return a text report of where the time was spent."""
+        busy = self.samples - self.io_samples
+
+        def pct(count):
+            return f"{count * 100 / self.samples:6.2f}%" if self.samples else "     -"
+
+        modules = {}
+        for function, count in self.own.items():
+            module = relpath(function[0], _SCOPE)
+            modules[module] = modules.get(module, 0) + count
+
+        lines = [
+            f"Sampled every {self.interval * 1000:g}ms for {self.duration:.1f}s",
+            f"{self.samples} samples in Tuya Local code, "
+            f"{self.io_samples} of them communicating with devices, "
+            f"{busy} busy in Tuya Local itself",
+            "",
+            "By module:",
+            "    own  module",
+        ]
+        for module, count in sorted(modules.items(), key=lambda m: -m[1]):
+            lines.append(f"{pct(count)}  {module}")
+        lines += ["", "By function:", "    own   cumulative  function"]
+        for function in self.ranked()[:limit]:
+            lines.append(
+                f"{pct(self.own[function])}  {pct(self.total[function])}  "
+                f"{self.describe(function)}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """Write the summary to a file.  This blocks, so use the executor."""
+        with open(path, "w") as f:
+            f.write(self.summary(limit=None))
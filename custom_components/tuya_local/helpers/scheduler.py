@@ -0,0 +1,60 @@
+"""
+Scheduling of device I/O, so that commands are not held up by polling.
+
+Receiving from devices with persistent connections blocks an executor
+thread until a message arrives or the socket times out, so with many
+devices the Home Assistant executor can be fully occupied by receives.
+Commands are run in a separate executor reserved for them, and each device
+defers its polls while any of its commands are in flight.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE
+from homeassistant.core import HomeAssistant
+
+DATA_COMMAND_EXECUTOR = "tuya_local_command_executor"
+
+# Threads are only started when needed, so this is the most commands that
+# can be sent at once, across all devices.
+COMMAND_THREADS = 32
+
+
+class CommandTracker:
+    """Track the commands in flight for a device, so polls can wait."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def start(self):
+        self.in_flight += 1
+        self._idle.clear()
+
+    def done(self):
+        self.in_flight -= 1
+        if not self.in_flight:
+            self._idle.set()
+
+    async def async_wait_idle(self):
+        """Wait until there are no commands in flight."""
+        await self._idle.wait()
+
+
+def get_command_executor(hass: HomeAssistant):
+    """Return the executor reserved for commands, if it is running."""
+    return hass.data.get(DATA_COMMAND_EXECUTOR)
+
+
+def start_command_executor(hass: HomeAssistant):
+    """Start the executor for commands, shutting it down with Home Assistant."""
+    executor = ThreadPoolExecutor(COMMAND_THREADS, "tuya_local_command")
+
+    async def async_stop_executor(event):
+        hass.data.pop(DATA_COMMAND_EXECUTOR, None)
+        await hass.async_add_executor_job(executor.shutdown)
+
+    hass.data[DATA_COMMAND_EXECUTOR] = executor
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, async_stop_executor)
+    return executor
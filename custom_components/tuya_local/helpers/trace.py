@@ -0,0 +1,122 @@
+"""
+Tracing of device communication, for export as a Chrome trace.
+
+Tracing is off unless started, and then records at most a fixed number of
+events, discarding the oldest.  The result can be loaded into
+chrome://tracing or https://ui.perfetto.dev to see a timeline of where the
+time goes for each device.
+"""
+from collections import deque
+from contextlib import contextmanager, nullcontext
+import json
+from threading import get_ident
+from time import perf_counter
+
+DEFAULT_MAX_EVENTS = 100000
+
+# Tracks for spans that cross awaits, so they do not overlap with the
+# spans recorded for the threads.
+RECEIVE_TRACK = 1
+COMMAND_TRACK = 2
+QUEUE_TRACK = 3
+_TRACK_NAMES = {
+    RECEIVE_TRACK: "receive",
+    COMMAND_TRACK: "commands",
+    QUEUE_TRACK: "executor queue",
+}
+
+_tracer = None
+
+
+class Tracer:
+    """A bounded recorder of spans in Chrome trace event format."""
+
+    def __init__(self, max_events=DEFAULT_MAX_EVENTS):
+        self._events = deque(maxlen=max_events)
+        self._processes = {}
+
+    @staticmethod
+    def now():
+        return perf_counter()
+
+    def _pid(self, device):
+        pid = self._processes.get(device)
+        if pid is None:
+            pid = self._processes.setdefault(device, len(self._processes) + 1)
+        return pid
+
+    def add(self, name, category, device, start, end, args=None, track=None):
+        """Record a span that has completed, on track or the current thread."""
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": self._pid(device),
+            "tid": track or get_ident(),
+        }
+        if args:
+            event["args"] = args
+        self._events.append(event)
+
+    @contextmanager
+    def span(self, name, category, device, args=None, track=None):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, category, device, start, perf_counter(), args, track)
+
+    def as_dict(self):
+        metadata = []
+        for device, pid in list(self._processes.items()):
+            metadata.append(
+                {
+                    "name": "process_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "args": {"name": device},
+                }
+            )
+            for tid, name in _TRACK_NAMES.items():
+                metadata.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "tid": tid,
+                        "args": {"name": name},
+                    }
+                )
+        return {"traceEvents": metadata + list(self._events)}
+
+    def export(self, path):
+        """Write the trace to a file.  This blocks, so use the executor."""
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f)
+
+
+def get_tracer():
+    """Return the active tracer, or None if tracing is not running."""
+    return _tracer
+
+
+def start_tracing(max_events=DEFAULT_MAX_EVENTS):
+    global _tracer
+    _tracer = Tracer(max_events)
+    return _tracer
+
+
+def stop_tracing():
+    """Stop tracing, returning the tracer with what was recorded."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def trace_span(name, category, device, args=None, track=None):
+    """Return a context manager recording a span, if tracing is running."""
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.span(name, category, device, args, track)
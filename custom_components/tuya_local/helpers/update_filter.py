@@ -0,0 +1,94 @@
+"""
+Filtering of entity state writes for frequently changing dps.
+
+Dps can declare a minimum interval between the state writes their changes
+cause, and a deadband within which changes are not worth writing.  Changes
+within the deadband are not written, while other changes that arrive too
+soon after the last write are delayed, so that the latest value is written
+once the interval has elapsed.
+"""
+
+
+def parse_deadband(deadband):
+    """
+    Parse a deadband, which is absolute, or relative if given as a percentage.
+
+    Returns:
+        a tuple of the amount, and whether it is relative.
+    """
+    if deadband is None:
+        return None, False
+    if isinstance(deadband, str) and deadband.strip().endswith("%"):
+        return float(deadband.strip()[:-1]) / 100, True
+    return float(deadband), False
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class DpFilter:
+    """The update filter for a single dp."""
+
+    __slots__ = ("dp", "min_interval", "deadband", "relative")
+
+    def __init__(self, dp, min_interval=0, deadband=None):
+        self.dp = dp
+        self.min_interval = min_interval or 0
+        self.deadband, self.relative = parse_deadband(deadband)
+
+    def within_deadband(self, value, published):
+        """Return True if the change from published is too small to write."""
+        if value == published:
+            return True
+        if self.deadband is None or not (_is_number(value) and _is_number(published)):
+            return False
+        band = self.deadband * abs(published) if self.relative else self.deadband
+        return abs(value - published) <= band
+
+
+class EntityUpdateFilter:
+    """Decide which state writes for an entity can be skipped."""
+
+    def __init__(self, filters):
+        self._filters = {f.dp.id: f for f in filters}
+        self._published = {}
+        self._last_write = None
+        self.timer = None
+
+    def delay(self, device, changed_dps, now):
+        """
+        Return how long to wait before writing changes to changed_dps.
+
+        Returns 0 if the state should be written now, or None if the changes
+        are all within the deadband so need not be written at all.
+        """
+        if self._last_write is None:
+            return 0
+        delays = []
+        for id in changed_dps:
+            filter = self._filters.get(id)
+            if filter is None:
+                return 0
+            if filter.within_deadband(
+                filter.dp.get_value(device),
+                self._published.get(id),
+            ):
+                continue
+            wait = self._last_write + filter.min_interval - now
+            if wait <= 0:
+                return 0
+            delays.append(wait)
+        return min(delays) if delays else None
+
+    def written(self, device, now):
+        """Record that the entity state was written."""
+        self.cancel()
+        self._last_write = now
+        for id, filter in self._filters.items():
+            self._published[id] = filter.dp.get_value(device)
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
@@ -0,0 +1,56 @@
+"""
+Detection of Tuya Local callbacks that stall the event loop.
+"""
+from contextlib import contextmanager, nullcontext
+import logging
+from time import perf_counter
+
+_LOGGER = logging.getLogger(__name__)
+
+_threshold = None
+
+
+def set_stall_threshold(seconds):
+    """Set the time a callback can take before it is reported, or None."""
+    global _threshold
+    _threshold = seconds
+
+
+def get_stall_threshold():
+    return _threshold
+
+
+@contextmanager
+def _watch(threshold, device, task, entity, dps):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        if elapsed > threshold:
+            device.metrics.record_stall(entity or task)
+            _LOGGER.warning(
+                "%s blocked the event loop for %.0fms in %s%s with dps %s",
+                device.name,
+                elapsed * 1000,
+                task,
+                f" of {entity}" if entity else "",
+                ", ".join(sorted(map(str, dps), key=lambda d: (len(d), d)))
+                if dps
+                else "none",
+            )
+
+
+def watch_stall(device, task, entity=None, dps=None):
+    """
+    Return a context manager that reports if its body takes too long.
+
+    Args:
+        device (TuyaLocalDevice): the device being processed.
+        task (str): a description of what is being done.
+        entity (str): the config id of the entity involved, if any.
+        dps (iterable): the ids of the dps involved.
+    """
+    if _threshold is None:
+        return nullcontext()
+    return _watch(_threshold, device, task, entity, dps)
@@ -0,0 +1,155 @@
+"""
+Prometheus / OpenMetrics export of Tuya Local statistics.
+
+When enabled, the metrics of every device are aggregated and served in
+OpenMetrics text format at /api/tuya_local/metrics.
+"""
+from homeassistant.components.http import HomeAssistantView
+from homeassistant.core import HomeAssistant
+from aiohttp import web
+
+from .const import DOMAIN
+from .helpers.metrics import CALLS, LATENCY_BUCKETS
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# DeviceMetrics counters, with their help text
+_COUNTERS = {
+    "retries": "Calls retried after a failure",
+    "connection_failures": "Calls that failed after all retries",
+    "reconnects": "Persistent connections that dropped and were reconnected",
+    "protocol_rotations": "Changes of protocol version while detecting it",
+    "messages_received": "Messages received from devices",
+    "receive_errors": "Errors while receiving from devices",
+}
+
+
+def _devices(hass: HomeAssistant):
+    for data in hass.data.get(DOMAIN, {}).values():
+        device = data.get("device")
+        if device is not None:
+            yield device
+
+
+def _device_state(device):
+    if not device._running:
+        return "stopped"
+    if device.has_returned_state:
+        return "available"
+    return "unavailable"
+
+
+def _executor_queue_depth(hass: HomeAssistant):
+    executor = getattr(hass.loop, "_default_executor", None)
+    queue = getattr(executor, "_work_queue", None)
+    return None if queue is None else queue.qsize()
+
+
+def _family(lines, name, kind, help):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def render_metrics(hass: HomeAssistant):
+    """Return the aggregated metrics for all devices, as OpenMetrics text."""
+    devices = list(_devices(hass))
+    states = {"available": 0, "unavailable": 0, "stopped": 0}
+    counters = {c: 0 for c in _COUNTERS}
+    calls = {c: [0] * (len(LATENCY_BUCKETS) + 1) for c in CALLS}
+    durations = {c: 0.0 for c in CALLS}
+    failures = {c: 0 for c in CALLS}
+    command_wait = [0] * (len(LATENCY_BUCKETS) + 1)
+    command_wait_total = 0.0
+    detections = []
+    stalls = 0
+
+    for device in devices:
+        metrics = device.metrics
+        states[_device_state(device)] += 1
+        for c in counters:
+            counters[c] += getattr(metrics, c)
+        for c, histogram in metrics.latency.items():
+            calls[c] = [a + b for a, b in zip(calls[c], histogram.buckets)]
+            durations[c] += histogram.total
+            failures[c] += metrics.failures[c]
+        command_wait = [
+            a + b for a, b in zip(command_wait, metrics.command_wait.buckets)
+        ]
+        command_wait_total += metrics.command_wait.total
+        if metrics.detection_time is not None:
+            detections.append(metrics.detection_time)
+        stalls += sum(metrics.stalls.values())
+
+    lines = []
+    _family(lines, "tuya_local_devices", "gauge", "Devices in each state")
+    for state, count in states.items():
+        lines.append(f'tuya_local_devices{{state="{state}"}} {count}')
+
+    depth = _executor_queue_depth(hass)
+    if depth is not None:
+        _family(
+            lines,
+            "tuya_local_executor_queue_depth",
+            "gauge",
+            "Jobs waiting for a Home Assistant executor thread",
+        )
+        lines.append(f"tuya_local_executor_queue_depth {depth}")
+
+    name = "tuya_local_call_duration_seconds"
+    _family(lines, name, "histogram", "Duration of calls to devices")
+    for c, buckets in calls.items():
+        total = 0
+        for bound, count in zip(LATENCY_BUCKETS, buckets):
+            total += count
+            lines.append(f'{name}_bucket{{call="{c}",le="{bound}"}} {total}')
+        total += buckets[-1]
+        lines.append(f'{name}_bucket{{call="{c}",le="+Inf"}} {total}')
+        lines.append(f'{name}_count{{call="{c}"}} {total}')
+        lines.append(f'{name}_sum{{call="{c}"}} {durations[c]:.6f}')
+
+    name = "tuya_local_command_wait_seconds"
+    _family(lines, name, "histogram", "Time commands waited to be sent")
+    total = 0
+    for bound, count in zip(LATENCY_BUCKETS, command_wait):
+        total += count
+        lines.append(f'{name}_bucket{{le="{bound}"}} {total}')
+    total += command_wait[-1]
+    lines.append(f'{name}_bucket{{le="+Inf"}} {total}')
+    lines.append(f"{name}_count {total}")
+    lines.append(f"{name}_sum {command_wait_total:.6f}")
+
+    name = "tuya_local_call_failures"
+    _family(lines, name, "counter", "Calls to devices that failed")
+    for c, count in failures.items():
+        lines.append(f'{name}_total{{call="{c}"}} {count}')
+
+    for counter, help in _COUNTERS.items():
+        name = f"tuya_local_{counter}"
+        _family(lines, name, "counter", help)
+        lines.append(f"{name}_total {counters[counter]}")
+
+    name = "tuya_local_event_loop_stalls"
+    _family(lines, name, "counter", "Callbacks that blocked the event loop")
+    lines.append(f"{name}_total {stalls}")
+
+    name = "tuya_local_detection_seconds"
+    _family(lines, name, "summary", "Time taken to detect device types")
+    lines.append(f"{name}_count {len(detections)}")
+    lines.append(f"{name}_sum {sum(detections):.6f}")
+
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+class TuyaLocalMetricsView(HomeAssistantView):
+    """Serve Tuya Local metrics to Prometheus."""
+
+    url = "/api/tuya_local/metrics"
+    name = "api:tuya_local:metrics"
+
+    async def get(self, request):
+        hass = request.app["hass"]
+        return web.Response(
+            body=render_metrics(hass).encode(),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
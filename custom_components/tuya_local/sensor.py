@@ -1,23 +1,76 @@
 """
 Setup for different kinds of Tuya sensors
 """
+from datetime import timedelta
+from time import monotonic
+
 from homeassistant.components.sensor import (
+    RestoreSensor,
     SensorDeviceClass,
     SensorEntity,
+    SensorStateClass,
     STATE_CLASSES,
 )
+from homeassistant.const import UnitOfEnergy, UnitOfPower, UnitOfTime
+from homeassistant.core import callback
+from homeassistant.helpers.entity import EntityCategory
+from homeassistant.helpers.event import async_track_time_interval
 import logging
 
+from .const import CONF_METRIC_SENSORS, CONF_TYPE, DATA_OPTIONS, DOMAIN
 from .device import TuyaLocalDevice
-from .helpers.config import async_tuya_setup_platform
-from .helpers.device_config import TuyaEntityConfig
+from .helpers.aggregate import AGGREGATE_TYPES, EnergyIntegral, WindowedAggregate
+from .helpers.config import async_tuya_setup_platform, get_device_id
+from .helpers.device_config import TuyaEntityConfig, get_config
 from .helpers.mixin import TuyaLocalEntity, unit_from_ascii
 
 _LOGGER = logging.getLogger(__name__)
 
+# Diagnostic sensors for DeviceMetrics attributes, when enabled
+METRIC_SENSORS = {
+    "response_time": (
+        "Response time",
+        UnitOfTime.MILLISECONDS,
+        SensorStateClass.MEASUREMENT,
+    ),
+    "messages_received": (
+        "Messages received",
+        None,
+        SensorStateClass.TOTAL_INCREASING,
+    ),
+    "connection_failures": (
+        "Connection failures",
+        None,
+        SensorStateClass.TOTAL_INCREASING,
+    ),
+}
+
+# Names of aggregate sensors, added to the name of the sensor they aggregate
+AGGREGATE_NAMES = {
+    "mean": "average",
+    "min": "minimum",
+    "max": "maximum",
+    "energy": "energy",
+}
+DEFAULT_AGGREGATE_WINDOW = 300
+DEFAULT_AGGREGATE_INTERVAL = 60
+
 
 async def async_setup_entry(hass, config_entry, async_add_entities):
     config = {**config_entry.data, **config_entry.options}
+    data = hass.data[DOMAIN][get_device_id(config)]
+    cfg = get_config(config[CONF_TYPE])
+    if hass.data.get(DATA_OPTIONS, {}).get(CONF_METRIC_SENSORS):
+        data["metric_sensors"] = [
+            TuyaLocalMetricSensor(data["device"], key) for key in METRIC_SENSORS
+        ]
+        async_add_entities(data["metric_sensors"])
+        if cfg and not any(
+            e.entity == "sensor"
+            for e in [cfg.primary_entity, *cfg.secondary_entities()]
+        ):
+            return
+
     await async_tuya_setup_platform(
         hass,
         async_add_entities,
@@ -26,6 +79,16 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
         TuyaLocalSensor,
     )
 
+    aggregates = []
+    for e in [cfg.primary_entity, *cfg.secondary_entities()]:
+        if e.entity == "sensor" and e.config_id in data:
+            for aggregate in e.aggregates:
+                aggregates.append(
+                    TuyaLocalAggregateSensor(data["device"], e, aggregate)
+                )
+    if aggregates:
+        async_add_entities(aggregates)
+
 
 class TuyaLocalSensor(TuyaLocalEntity, SensorEntity):
     """Representation of a Tuya Sensor"""
@@ -101,3 +164,178 @@ class TuyaLocalSensor(TuyaLocalEntity, SensorEntity):
             for val in values:
                 if isinstance(val, str):
                     return values
+
+
+class TuyaLocalAggregateSensor(TuyaLocalSensor, RestoreSensor):
+    """A sensor aggregating the values of another sensor over time"""
+
+    # Every sample is needed, but the state is only written periodically
+    filter_updates = False
+
+    def __init__(self, device, config, aggregate):
+        """
+        Initialise the sensor.
+        Args:
+            device (TuyaLocalDevice): the device API instance.
+            config (TuyaEntityConfig): the configuration for the sensor
+                being aggregated.
+            aggregate (dict): the configuration of the aggregate.
+        """
+        super().__init__(device, config)
+        self._aggregate = aggregate
+        self._type = aggregate.get("type")
+        if self._type not in AGGREGATE_TYPES:
+            raise AttributeError(
+                f"{config.name} has unknown aggregate type {self._type}"
+            )
+        self._window = aggregate.get("window", DEFAULT_AGGREGATE_WINDOW)
+        self._interval = aggregate.get("interval", DEFAULT_AGGREGATE_INTERVAL)
+        self._aggregate_name = aggregate.get("name")
+        self._published = None
+        self._unsubscribe = None
+        if self._type == "energy":
+            unit = super().native_unit_of_measurement
+            self._accumulator = EnergyIntegral(
+                scale=1 if unit == UnitOfPower.KILO_WATT else 1 / 1000
+            )
+        else:
+            self._accumulator = WindowedAggregate(self._window)
+
+    def _reinit(self, config):
+        # Keep the samples collected so far, and the publishing schedule
+        kept = (self._accumulator, self._published, self._unsubscribe)
+        self.__init__(self._device, config, self._aggregate)
+        self._accumulator, self._published, self._unsubscribe = kept
+
+    @property
+    def name(self):
+        """Return the name for the UI."""
+        if self._aggregate_name:
+            return self._aggregate_name
+        if self._type == "energy":
+            return "Energy"
+        base = self._config.name
+        name = AGGREGATE_NAMES[self._type]
+        return f"{base} {name}" if base else name.capitalize()
+
+    @property
+    def translation_key(self):
+        return None
+
+    @property
+    def unique_id(self):
+        """Return the unique id for this entity."""
+        suffix = self._type
+        if self._type != "energy":
+            suffix = f"{suffix}_{self._window}"
+        return f"{super().unique_id}-{suffix}"
+
+    @property
+    def device_class(self):
+        if self._type == "energy":
+            return SensorDeviceClass.ENERGY
+        return super().device_class
+
+    @property
+    def state_class(self):
+        if self._type == "energy":
+            return SensorStateClass.TOTAL_INCREASING
+        return SensorStateClass.MEASUREMENT
+
+    @property
+    def native_unit_of_measurement(self):
+        if self._type == "energy":
+            return UnitOfEnergy.KILO_WATT_HOUR
+        return super().native_unit_of_measurement
+
+    @property
+    def options(self):
+        return None
+
+    @property
+    def extra_state_attributes(self):
+        if self._type == "energy":
+            return {}
+        return {"window": self._window}
+
+    @property
+    def native_value(self):
+        """Return the aggregated value"""
+        now = monotonic()
+        if self._type == "energy":
+            value = self._accumulator.value(now)
+        else:
+            value = getattr(self._accumulator, self._type)(now)
+        return None if value is None else round(value, 3)
+
+    def _sample(self):
+        value = self._sensor_dps.get_value(self._device)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            value = None
+        if value is not None or self._type == "energy":
+            self._accumulator.add(monotonic(), value)
+
+    @callback
+    def async_write_ha_state(self):
+        """Sample the sensor, and write the state if the interval is over."""
+        self._sample()
+        now = monotonic()
+        if self._published is None or now - self._published >= self._interval:
+            self._async_publish()
+
+    @callback
+    def _async_publish(self, now=None):
+        self._published = monotonic()
+        super().async_write_ha_state()
+
+    async def async_added_to_hass(self):
+        if self._type == "energy":
+            last = await self.async_get_last_sensor_data()
+            if last and last.native_value is not None:
+                self._accumulator.total = float(last.native_value)
+        self._unsubscribe = async_track_time_interval(
+            self.hass,
+            self._async_publish,
+            timedelta(seconds=self._interval),
+        )
+        await super().async_added_to_hass()
+
+    async def async_will_remove_from_hass(self):
+        if self._unsubscribe:
+            self._unsubscribe()
+            self._unsubscribe = None
+        await super().async_will_remove_from_hass()
+
+
+class TuyaLocalMetricSensor(SensorEntity):
+    """A diagnostic sensor for the performance of the connection to a device"""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False
+    _attr_has_entity_name = True
+
+    def __init__(self, device: TuyaLocalDevice, key: str):
+        """
+        Initialise the sensor.
+        Args:
+            device (TuyaLocalDevice): the device API instance.
+            key (str): the DeviceMetrics attribute to report.
+        """
+        self._device = device
+        self._key = key
+        name, unit, state_class = METRIC_SENSORS[key]
+        self._attr_name = name
+        self._attr_native_unit_of_measurement = unit
+        self._attr_state_class = state_class
+        self._attr_unique_id = f"{device.unique_id}-metric-{key}"
+
+    @property
+    def device_info(self):
+        """Return the device's information."""
+        return self._device.device_info
+
+    @property
+    def native_value(self):
+        """Return the current value of the metric"""
+        value = getattr(self._device.metrics, self._key)
+        return round(value, 1) if isinstance(value, float) else value
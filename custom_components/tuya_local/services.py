@@ -0,0 +1,343 @@
+"""
+Services for Tuya Local.
+"""
+import asyncio
+from datetime import datetime
+import json
+import logging
+from time import monotonic
+
+import voluptuous as vol
+from homeassistant.components import persistent_notification
+from homeassistant.core import HomeAssistant, ServiceCall
+import homeassistant.helpers.config_validation as cv
+
+from .bulk_import import (
+    DEFAULT_CONCURRENCY,
+    NOTIFICATION_ID,
+    async_import_devices,
+    load_devices,
+    summary,
+)
+from .const import CONF_DEVICE_ID, DOMAIN
+from .helpers.capture import DEFAULT_MAX_BYTES
+from .helpers.config import get_device_id
+from .helpers.device_config import get_config, reload_changed_configs
+from .helpers.profiler import SamplingProfiler
+from .helpers.trace import DEFAULT_MAX_EVENTS, start_tracing, stop_tracing
+
+_LOGGER = logging.getLogger(__name__)
+
+SERVICE_START_TRACE = "start_trace"
+SERVICE_STOP_TRACE = "stop_trace"
+SERVICE_PROFILE = "profile"
+SERVICE_START_CAPTURE = "start_capture"
+SERVICE_STOP_CAPTURE = "stop_capture"
+SERVICE_IMPORT_DEVICES = "import_devices"
+SERVICE_RELOAD_DEVICE_CONFIGS = "reload_device_configs"
+SERVICE_SET_DPS = "set_dps"
+EVENT_SET_DPS_RESULT = "tuya_local_set_dps_result"
+ATTR_MAX_SIZE = "max_size"
+ATTR_PATH = "path"
+ATTR_CONCURRENCY = "concurrency"
+ATTR_MAX_EVENTS = "max_events"
+ATTR_DURATION = "duration"
+ATTR_COMMANDS = "commands"
+ATTR_DPS = "dps"
+ATTR_PARALLELISM = "parallelism"
+DEFAULT_PARALLELISM = 20
+
+# Modules to report the busiest functions of when profiling completes
+PROFILE_HIGHLIGHTS = ("device.py", "helpers/device_config.py")
+
+START_TRACE_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_MAX_EVENTS, default=DEFAULT_MAX_EVENTS): vol.All(
+            vol.Coerce(int), vol.Range(min=100, max=10000000)
+        ),
+    }
+)
+
+PROFILE_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_DURATION, default=60): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=3600)
+        ),
+    }
+)
+
+START_CAPTURE_SCHEMA = vol.Schema(
+    {
+        vol.Optional(CONF_DEVICE_ID): cv.string,
+        vol.Optional(ATTR_MAX_SIZE, default=DEFAULT_MAX_BYTES // 1024): vol.All(
+            vol.Coerce(int), vol.Range(min=1)
+        ),
+    }
+)
+
+IMPORT_DEVICES_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_PATH, default="devices.json"): cv.string,
+        vol.Optional(ATTR_CONCURRENCY, default=DEFAULT_CONCURRENCY): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=100)
+        ),
+    }
+)
+
+
+SET_DPS_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_COMMANDS): vol.All(
+            cv.ensure_list,
+            [
+                vol.Schema(
+                    {
+                        vol.Required(CONF_DEVICE_ID): cv.string,
+                        vol.Required(ATTR_DPS): {cv.string: object},
+                    }
+                )
+            ],
+        ),
+        vol.Optional(ATTR_PARALLELISM, default=DEFAULT_PARALLELISM): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=100)
+        ),
+    }
+)
+
+
+def _output_path(hass: HomeAssistant, prefix, extension):
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return hass.config.path(f"{prefix}_{timestamp}.{extension}")
+
+
+def _write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+async def async_set_dps(hass: HomeAssistant, commands, parallelism):
+    """
+    Send dps to many devices at once.
+
+    Commands for the same device are combined into one, with later values
+    taking priority, and up to parallelism devices are sent to at a time.
+
+    Returns:
+        a list of results for each device, with whether the command was
+        sent and how long it took in milliseconds.
+    """
+    combined = {}
+    for command in commands:
+        dps = combined.setdefault(command[CONF_DEVICE_ID], {})
+        dps.update(command[ATTR_DPS])
+    limit = asyncio.Semaphore(parallelism)
+    domain_data = hass.data.get(DOMAIN, {})
+
+    async def send(device_id, dps):
+        result = {"device_id": device_id, "success": False}
+        device = domain_data.get(device_id, {}).get("device")
+        if device is None:
+            result["error"] = "unknown device"
+            return result
+        async with limit:
+            start = monotonic()
+            result["success"] = await device.async_send_properties(dps)
+            result["latency_ms"] = round((monotonic() - start) * 1000, 1)
+        if not result["success"]:
+            result["error"] = "not sent"
+        return result
+
+    return await asyncio.gather(*(send(id, dps) for id, dps in combined.items()))
+
+
+async def async_setup_services(hass: HomeAssistant):
+    """Register the Tuya Local services."""
+
+    async def async_start_trace(call: ServiceCall):
+        start_tracing(call.data[ATTR_MAX_EVENTS])
+        _LOGGER.info("Tracing of Tuya Local devices started")
+
+    async def async_stop_trace(call: ServiceCall):
+        tracer = stop_tracing()
+        if tracer is None:
+            _LOGGER.warning("Tuya Local tracing was not started")
+            return
+        path = _output_path(hass, "tuya_local_trace", "json")
+        await hass.async_add_executor_job(tracer.export, path)
+        _LOGGER.info("Tuya Local trace written to %s", path)
+        persistent_notification.async_create(
+            hass,
+            f"Trace written to `{path}`.  Load it in chrome://tracing or "
+            "https://ui.perfetto.dev to view it.",
+            title="Tuya Local",
+        )
+
+    profiling = False
+
+    async def async_profile(call: ServiceCall):
+        nonlocal profiling
+        if profiling:
+            _LOGGER.warning("Tuya Local profiling is already running")
+            return
+        profiling = True
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            await asyncio.sleep(call.data[ATTR_DURATION])
+        finally:
+            await hass.async_add_executor_job(profiler.stop)
+            profiling = False
+        path = _output_path(hass, "tuya_local_profile", "txt")
+        await hass.async_add_executor_job(profiler.export, path)
+        _LOGGER.info("Tuya Local profile written to %s", path)
+
+        message = [f"Profile written to `{path}`."]
+        for module in PROFILE_HIGHLIGHTS:
+            top = profiler.ranked(module)[:5]
+            if top:
+                message.append(f"\nBusiest functions in {module}:")
+                message += [f"- `{profiler.describe(f)}`" for f in top]
+        persistent_notification.async_create(
+            hass,
+            "\n".join(message),
+            title="Tuya Local",
+        )
+
+    def devices(device_id=None):
+        for id, data in hass.data.get(DOMAIN, {}).items():
+            device = data.get("device")
+            if device is not None and device_id in (None, id):
+                yield id, device
+
+    async def async_start_capture(call: ServiceCall):
+        device_id = call.data.get(CONF_DEVICE_ID)
+        found = False
+        for id, device in devices(device_id):
+            found = True
+            path = _output_path(hass, f"tuya_local_capture_{id}", "jsonl")
+            await device.async_start_capture(path, call.data[ATTR_MAX_SIZE] * 1024)
+            _LOGGER.info("Capturing traffic of %s to %s", device.name, path)
+        if not found:
+            _LOGGER.warning("No Tuya Local device %s to capture", device_id)
+
+    async def async_stop_capture(call: ServiceCall):
+        paths = []
+        for _, device in devices():
+            capture = await device.async_stop_capture()
+            if capture is not None:
+                paths.append(capture.path)
+        if paths:
+            persistent_notification.async_create(
+                hass,
+                "Traffic captured to:\n" + "\n".join(f"- `{p}`" for p in paths),
+                title="Tuya Local",
+            )
+
+    async def async_import(call: ServiceCall):
+        path = hass.config.path(call.data[ATTR_PATH])
+        try:
+            devices = await hass.async_add_executor_job(load_devices, path)
+        except (OSError, ValueError) as e:
+            _LOGGER.error("Unable to read devices from %s: %s", path, e)
+            return
+        results = await async_import_devices(
+            hass,
+            devices,
+            call.data[ATTR_CONCURRENCY],
+        )
+        report = _output_path(hass, "tuya_local_import", "json")
+        await hass.async_add_executor_job(_write_json, report, results)
+        persistent_notification.async_create(
+            hass,
+            f"{summary(results)}\n\nFull results are in `{report}`.",
+            title="Tuya Local import",
+            notification_id=NOTIFICATION_ID,
+        )
+
+    def reload_configs():
+        return {t: get_config(t) for t in reload_changed_configs()}
+
+    async def async_reload_device_configs(call: ServiceCall):
+        configs = await hass.async_add_executor_job(reload_configs)
+        reloaded = 0
+        recreate = set()
+        for id, device in devices():
+            count, changed = device.reload_entity_configs(configs)
+            reloaded += count
+            if changed:
+                recreate.add(id)
+        _LOGGER.info(
+            "Reloaded device configs %s, updating %d entities",
+            ", ".join(configs) or "(none changed)",
+            reloaded,
+        )
+        # Changes the entities cannot take on in place need their config
+        # entries reloaded, to recreate the entities.
+        for entry in hass.config_entries.async_entries(DOMAIN):
+            if get_device_id({**entry.data, **entry.options}) in recreate:
+                _LOGGER.info("Reloading %s for its changed config", entry.title)
+                await hass.config_entries.async_reload(entry.entry_id)
+
+    async def async_set_dps_service(call: ServiceCall):
+        results = await async_set_dps(
+            hass,
+            call.data[ATTR_COMMANDS],
+            call.data[ATTR_PARALLELISM],
+        )
+        for result in results:
+            if not result["success"]:
+                _LOGGER.warning(
+                    "Failed to set dps of %s: %s",
+                    result["device_id"],
+                    result["error"],
+                )
+        hass.bus.async_fire(EVENT_SET_DPS_RESULT, {"results": results})
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_START_TRACE,
+        async_start_trace,
+        schema=START_TRACE_SCHEMA,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_STOP_TRACE,
+        async_stop_trace,
+        schema=vol.Schema({}),
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_PROFILE,
+        async_profile,
+        schema=PROFILE_SCHEMA,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_START_CAPTURE,
+        async_start_capture,
+        schema=START_CAPTURE_SCHEMA,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_STOP_CAPTURE,
+        async_stop_capture,
+        schema=vol.Schema({}),
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_IMPORT_DEVICES,
+        async_import,
+        schema=IMPORT_DEVICES_SCHEMA,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_RELOAD_DEVICE_CONFIGS,
+        async_reload_device_configs,
+        schema=vol.Schema({}),
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_SET_DPS,
+        async_set_dps_service,
+        schema=SET_DPS_SCHEMA,
+    )
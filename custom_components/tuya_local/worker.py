@@ -0,0 +1,575 @@
+"""
+Worker process for Tuya Local device connections.
+
+When enabled, a single worker process owns the tinytuya connections for all
+devices, so socket I/O, encryption and message decoding happen outside of
+the Home Assistant process.  TuyaLocalDevice talks to it through WorkerApi,
+a proxy offering the parts of the tinytuya.Device interface that it uses.
+
+Responses from the worker are read by the Home Assistant event loop, so
+calls can be awaited without tying up an executor thread each.  For devices
+with persistent connections, the worker also runs the receive loop, and
+pushes the dps reported by the device back as they arrive.
+
+If the worker is not running, WorkerApi falls back to connecting from the
+Home Assistant process.
+"""
+import asyncio
+from itertools import count
+import logging
+import multiprocessing
+from queue import SimpleQueue
+from threading import Event, Lock, Semaphore, Thread
+
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE
+from homeassistant.core import HomeAssistant
+import tinytuya
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_WORKER = "tuya_local_worker"
+
+# Longer than tinytuya's own timeouts, so this only triggers if the worker
+# has stopped responding.
+_CALL_TIMEOUT = 60
+# The pause between receives, so calls waiting for the device get a turn.
+_RECEIVE_INTERVAL = 0.1
+# The longest wait between attempts to receive after errors.
+_MAX_RECEIVE_DELAY = 30
+
+
+class WorkerError(Exception):
+    """An error communicating with, or reported by, the worker process."""
+
+
+def _state(api):
+    """Device attributes that change as a side effect of calls."""
+    return {"dev_type": api.dev_type, "dps_cache": api.dps_cache}
+
+
+def _error(e):
+    return f"{type(e).__name__}: {e}"
+
+
+class _CallPool:
+    """
+    Threads for making calls in the worker process.
+
+    Calls block until the device responds or times out, so instead of a
+    fixed number of threads, one is started whenever a call arrives with
+    none idle.  The pool grows to the number of devices being called at
+    once, and no call waits behind another device's.
+    """
+
+    def __init__(self):
+        self._calls = SimpleQueue()
+        self._idle = Semaphore(0)
+        self._threads = 0
+
+    def submit(self, func, *args):
+        self._calls.put((func, args))
+        if not self._idle.acquire(blocking=False):
+            self._threads += 1
+            Thread(
+                target=self._run,
+                name="tuya_local_worker_call",
+                daemon=True,
+            ).start()
+
+    def _run(self):
+        while True:
+            call = self._calls.get()
+            if call is None:
+                break
+            func, args = call
+            func(*args)
+            self._idle.release()
+
+    def shutdown(self):
+        for _ in range(self._threads):
+            self._calls.put(None)
+
+
+def serve(requests, responses):
+    """
+    Main loop of the worker process.
+
+    Args:
+        requests (Connection): where requests from Home Assistant arrive.
+        responses (Connection): where responses and pushed messages are sent.
+    """
+    # Each device, with the lock held while waiting for its response, so
+    # the receive loop does not take responses meant for calls.
+    devices = {}
+    listeners = {}
+    send_lock = Lock()
+    pool = _CallPool()
+
+    def send(msg):
+        with send_lock:
+            responses.send(msg)
+
+    def call(req_id, handle, method, args, kwargs):
+        try:
+            api, lock = devices[handle]
+            if kwargs.get("nowait"):
+                result = getattr(api, method)(*args, **kwargs)
+            else:
+                with lock:
+                    result = getattr(api, method)(*args, **kwargs)
+            send(("result", req_id, True, result, _state(api)))
+        except Exception as e:
+            send(("result", req_id, False, _error(e), None))
+
+    def listen(handle, stop):
+        api, lock = devices[handle]
+        failures = 0
+        while not stop.is_set():
+            try:
+                with lock:
+                    api.heartbeat(nowait=True)
+                    result = api.receive()
+                ok = True
+            except Exception as e:
+                ok, result = False, _error(e)
+            if stop.is_set():
+                break
+            if result or not ok:
+                try:
+                    send(("push", handle, ok, result, _state(api) if ok else None))
+                except (OSError, ValueError):
+                    break
+            if not ok or (isinstance(result, dict) and "Error" in result):
+                failures += 1
+                stop.wait(min(2 ** (failures - 1), _MAX_RECEIVE_DELAY))
+            else:
+                failures = 0
+                stop.wait(_RECEIVE_INTERVAL)
+
+    def release(handle):
+        if handle not in devices:
+            return
+        # Wait for any call in progress, so its socket is not closed under it
+        api, lock = devices[handle]
+        with lock:
+            api.close()
+        del devices[handle]
+
+    while True:
+        try:
+            msg = requests.recv()
+        except (EOFError, OSError):
+            break
+        if msg is None:
+            break
+        try:
+            if msg[0] == "create":
+                _, handle, dev_id, address, local_key, cid, parent = msg
+                if parent is None:
+                    api = tinytuya.Device(dev_id, address, local_key)
+                else:
+                    api = tinytuya.Device(
+                        dev_id,
+                        cid=cid,
+                        parent=devices[parent][0],
+                    )
+                devices[handle] = (api, Lock())
+            elif msg[0] == "release":
+                _, handle = msg
+                if handle in listeners:
+                    listeners.pop(handle).set()
+                pool.submit(release, handle)
+            elif msg[0] == "notify":
+                _, handle, method, args = msg
+                getattr(devices[handle][0], method)(*args)
+            elif msg[0] == "call":
+                pool.submit(call, *msg[1:])
+            elif msg[0] == "listen":
+                _, handle, enable = msg
+                if enable and handle not in listeners:
+                    listeners[handle] = Event()
+                    Thread(
+                        target=listen,
+                        args=(handle, listeners[handle]),
+                        name="tuya_local_worker_receive",
+                        daemon=True,
+                    ).start()
+                elif not enable and handle in listeners:
+                    listeners.pop(handle).set()
+        except Exception as e:
+            _LOGGER.error("Tuya Local worker failed to handle %s: %s", msg[0], e)
+
+    for stop in listeners.values():
+        stop.set()
+    pool.shutdown()
+    for api, _ in devices.values():
+        api.set_socketPersistent(False)
+    with send_lock:
+        responses.close()
+
+
+class Worker:
+    """Home Assistant side of the connection to the worker process."""
+
+    def __init__(self):
+        self._process = None
+        self._loop = None
+        self._requests = None
+        self._responses = None
+        self._pending = {}
+        self._listeners = {}
+        self._request_ids = count()
+        self._handles = count()
+        self._send_lock = Lock()
+
+    @property
+    def running(self):
+        return (
+            self._loop is not None
+            and self._process is not None
+            and self._process.is_alive()
+        )
+
+    def start(self):
+        """Start the worker process.  This blocks, so use the executor."""
+        # Forking a multi-threaded process is not safe, so spawn a new one.
+        # Pipes are used rather than sockets so the connection stays local.
+        ctx = multiprocessing.get_context("spawn")
+        req_recv, self._requests = ctx.Pipe(duplex=False)
+        self._responses, resp_send = ctx.Pipe(duplex=False)
+        self._process = ctx.Process(
+            target=serve,
+            args=(req_recv, resp_send),
+            name="tuya_local_worker",
+            daemon=True,
+        )
+        self._process.start()
+        req_recv.close()
+        resp_send.close()
+
+    def attach(self, loop):
+        """Read responses from the worker in the event loop."""
+        self._loop = loop
+        loop.add_reader(self._responses.fileno(), self._read_responses)
+
+    def detach(self):
+        """Stop reading responses, failing anything still waiting for them."""
+        if self._loop is None:
+            return
+        self._loop.remove_reader(self._responses.fileno())
+        self._loop = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_result((False, "worker process stopped", None))
+        self._pending.clear()
+        for listener in self._listeners.values():
+            listener(False, "worker process stopped", None)
+        self._listeners.clear()
+
+    def stop(self):
+        """
+        Stop the worker process, after detaching it from the event loop.
+        This blocks, so use the executor.
+        """
+        if self._process is None:
+            return
+        try:
+            self._send(None)
+        except WorkerError:
+            pass
+        self._process.join(5)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._requests.close()
+        self._responses.close()
+        self._process = None
+
+    def _read_responses(self):
+        try:
+            while self._responses.poll():
+                msg = self._responses.recv()
+                if msg[0] == "result":
+                    _, req_id, ok, result, state = msg
+                    future = self._pending.pop(req_id, None)
+                    if future is not None and not future.done():
+                        future.set_result((ok, result, state))
+                else:
+                    _, handle, ok, result, state = msg
+                    listener = self._listeners.get(handle)
+                    if listener is not None:
+                        listener(ok, result, state)
+        except (EOFError, OSError):
+            # The worker has gone
+            self.detach()
+
+    def _send(self, msg):
+        try:
+            with self._send_lock:
+                self._requests.send(msg)
+        except (AttributeError, OSError, ValueError) as e:
+            raise WorkerError(f"worker process not available: {e}") from e
+
+    def create(self, dev_id, address, local_key, cid=None, parent=None):
+        """Create a device in the worker, returning its handle."""
+        handle = next(self._handles)
+        self._send(("create", handle, dev_id, address, local_key, cid, parent))
+        return handle
+
+    def notify(self, handle, method, *args):
+        """Call a device method in the worker without waiting for a result."""
+        self._send(("notify", handle, method, args))
+
+    def release(self, handle):
+        """Remove a device from the worker, closing its connection."""
+        self._listeners.pop(handle, None)
+        self._send(("release", handle))
+
+    def listen(self, handle, listener):
+        """
+        Receive messages from a device in the worker, passing them to
+        listener in the event loop as they arrive.
+        """
+        self._listeners[handle] = listener
+        self._send(("listen", handle, True))
+
+    def unlisten(self, handle):
+        """Stop receiving messages from a device in the worker."""
+        if self._listeners.pop(handle, None) is not None:
+            self._send(("listen", handle, False))
+
+    async def async_call(self, handle, method, *args, **kwargs):
+        """Call a device method in the worker, and return the result."""
+        if self._loop is None:
+            raise WorkerError("worker process not available")
+        req_id = next(self._request_ids)
+        future = self._loop.create_future()
+        self._pending[req_id] = future
+        try:
+            self._send(("call", req_id, handle, method, args, kwargs))
+            ok, result, state = await asyncio.wait_for(future, _CALL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise WorkerError(f"timed out waiting for {method}") from None
+        finally:
+            self._pending.pop(req_id, None)
+        if not ok:
+            raise WorkerError(result)
+        return result, state
+
+    def call(self, handle, method, *args, **kwargs):
+        """Call a device method in the worker from outside the event loop."""
+        loop = self._loop
+        if loop is None:
+            raise WorkerError("worker process not available")
+        return asyncio.run_coroutine_threadsafe(
+            self.async_call(handle, method, *args, **kwargs),
+            loop,
+        ).result()
+
+
+class WorkerApi:
+    """
+    Proxy for a tinytuya.Device that is owned by the worker process.
+
+    Settings are remembered, so that if the worker process stops, a local
+    tinytuya.Device can be created in its place with the same settings.
+    """
+
+    def __init__(self, worker, dev_id, address, local_key, cid=None, parent=None):
+        self._worker = worker
+        self._address = address
+        self._local_key = local_key
+        self._local = None
+        self._settings = {}
+        self._handle = None
+        self._listening = False
+        self._received = asyncio.Queue()
+        self.id = dev_id
+        self.cid = cid
+        self.parent = parent
+        self.version = 3.1
+        self.dev_type = "default"
+        self.dps_cache = {}
+        try:
+            self._handle = worker.create(
+                dev_id,
+                address,
+                local_key,
+                cid,
+                None if parent is None else parent._handle,
+            )
+        except WorkerError as e:
+            _LOGGER.warning("Unable to use worker process for %s: %s", dev_id, e)
+
+    @property
+    def _use_worker(self):
+        return (
+            self._local is None
+            and self._handle is not None
+            and (self.parent is None or self.parent._use_worker)
+            and self._worker.running
+        )
+
+    @property
+    def is_async(self):
+        """Whether calls can be awaited, rather than run in the executor."""
+        return self._use_worker
+
+    def _local_api(self):
+        if self._local is None:
+            _LOGGER.warning(
+                "Worker process not available, connecting to %s directly",
+                self.id,
+            )
+            if self.parent is None:
+                self._local = tinytuya.Device(self.id, self._address, self._local_key)
+            else:
+                self._local = tinytuya.Device(
+                    self.id,
+                    cid=self.cid,
+                    parent=self.parent._local_api(),
+                )
+            for method, args in self._settings.items():
+                getattr(self._local, method)(*args)
+        return self._local
+
+    def _update_state(self, state):
+        self.dev_type = state["dev_type"]
+        self.dps_cache = state["dps_cache"]
+
+    def _call(self, method, *args, **kwargs):
+        if self._use_worker:
+            result, state = self._worker.call(self._handle, method, *args, **kwargs)
+        else:
+            api = self._local_api()
+            result = getattr(api, method)(*args, **kwargs)
+            state = _state(api)
+        self._update_state(state)
+        return result
+
+    async def async_call(self, method, *args, **kwargs):
+        """Call a device method in the worker from the event loop."""
+        result, state = await self._worker.async_call(
+            self._handle,
+            method,
+            *args,
+            **kwargs,
+        )
+        self._update_state(state)
+        return result
+
+    def _pushed(self, ok, result, state):
+        self._received.put_nowait((ok, result, state))
+
+    def listen(self):
+        """Have the worker receive messages from the device, for async_receive."""
+        if self._listening or not self._use_worker:
+            return
+        self._worker.listen(self._handle, self._pushed)
+        self._listening = True
+
+    async def async_receive(self, timeout):
+        """
+        Return the next message received by the worker for the device, or
+        None if nothing arrives within timeout seconds.
+        """
+        try:
+            ok, result, state = await asyncio.wait_for(self._received.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if not ok:
+            raise WorkerError(result)
+        self._update_state(state)
+        return result
+
+    def _setting(self, method, *args):
+        """Apply a setting without waiting, as these are called from the loop."""
+        self._settings[method] = args
+        if self._use_worker:
+            try:
+                self._worker.notify(self._handle, method, *args)
+                return
+            except WorkerError:
+                pass
+        getattr(self._local_api(), method)(*args)
+
+    def close(self):
+        """
+        Close the connection to the device, and remove it from the worker.
+        The api is not used again after this.
+        """
+        self._listening = False
+        if self._handle is not None:
+            try:
+                self._worker.release(self._handle)
+            except WorkerError:
+                pass
+            self._handle = None
+        if self._local is not None:
+            self._local.close()
+            self._local = None
+
+    def set_socketPersistent(self, persist):
+        if not persist and self._listening:
+            self._listening = False
+            try:
+                self._worker.unlisten(self._handle)
+            except WorkerError:
+                pass
+        self._setting("set_socketPersistent", persist)
+
+    def set_socketRetryLimit(self, limit):
+        self._setting("set_socketRetryLimit", limit)
+
+    def set_dpsUsed(self, dps_to_request):
+        self._setting("set_dpsUsed", dps_to_request)
+
+    def set_version(self, version):
+        # Version 3.2 may need to detect dps, so wait for it to finish
+        self._settings["set_version"] = (version,)
+        self.version = version
+        self._call("set_version", version)
+
+    def status(self):
+        return self._call("status")
+
+    def updatedps(self, index=None, nowait=False):
+        return self._call("updatedps", index, nowait=nowait)
+
+    def receive(self):
+        return self._call("receive")
+
+    def heartbeat(self, nowait=True):
+        return self._call("heartbeat", nowait=nowait)
+
+    def set_multiple_values(self, data, nowait=False):
+        return self._call("set_multiple_values", data, nowait=nowait)
+
+
+def get_worker(hass: HomeAssistant):
+    """Return the worker, if it is enabled and running."""
+    worker = hass.data.get(DATA_WORKER)
+    return worker if worker and worker.running else None
+
+
+async def async_start_worker(hass: HomeAssistant):
+    """Start the worker process, if possible."""
+    worker = Worker()
+    try:
+        await hass.async_add_executor_job(worker.start)
+        worker.attach(hass.loop)
+    except Exception as e:
+        _LOGGER.warning(
+            "Unable to start worker process, devices will be connected "
+            "from Home Assistant: %s",
+            e,
+        )
+        return None
+
+    async def async_stop_worker(event):
+        hass.data.pop(DATA_WORKER, None)
+        worker.detach()
+        await hass.async_add_executor_job(worker.stop)
+
+    hass.data[DATA_WORKER] = worker
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, async_stop_worker)
+    return worker
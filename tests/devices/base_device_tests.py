@@ -58,6 +58,7 @@ class TuyaDeviceTestCase(IsolatedAsyncioTestCase):
         self.mock_device = device_patcher.start()
         self.dps = payload.copy()
         self.mock_device.get_property.side_effect = lambda id: self.dps.get(id)
+        self.mock_device.decoded_dps = {}
         cfg = TuyaDeviceConfig(config_file)
         self.conf_type = cfg.legacy_type
         type(self.mock_device).has_returned_state = PropertyMock(return_value=True)
@@ -0,0 +1,64 @@
+"""Tests for the streaming aggregation of sensor values"""
+from unittest import TestCase
+
+from custom_components.tuya_local.helpers.aggregate import (
+    EnergyIntegral,
+    WindowedAggregate,
+)
+
+
+class TestWindowedAggregate(TestCase):
+    def test_empty(self):
+        subject = WindowedAggregate(60)
+        self.assertIsNone(subject.mean(0))
+        self.assertIsNone(subject.min(0))
+        self.assertIsNone(subject.max(0))
+
+    def test_mean_is_time_weighted(self):
+        subject = WindowedAggregate(60)
+        subject.add(0, 10)
+        subject.add(10, 40)
+        # 10 for 10s then 40 for 20s
+        self.assertEqual(subject.mean(30), 30)
+
+    def test_values_leave_the_window(self):
+        subject = WindowedAggregate(60)
+        subject.add(0, 100)
+        subject.add(10, 5)
+        subject.add(20, 50)
+        self.assertEqual(subject.max(30), 100)
+        self.assertEqual(subject.min(30), 5)
+
+        # 100 held until 10s, so is still in the window at 69s
+        self.assertEqual(subject.max(69), 100)
+        self.assertEqual(subject.max(71), 50)
+        self.assertEqual(subject.min(71), 5)
+        # 5 for the first 9s of the window, then 50
+        self.assertAlmostEqual(subject.mean(71), (5 * 9 + 50 * 51) / 60)
+        self.assertEqual(subject.min(81), 50)
+
+    def test_samples_are_discarded(self):
+        subject = WindowedAggregate(10)
+        for t in range(1000):
+            subject.add(t, t % 7)
+        self.assertLessEqual(len(subject._samples), 12)
+        self.assertLessEqual(len(subject._mins), 12)
+        self.assertLessEqual(len(subject._maxs), 12)
+        self.assertEqual(subject.max(999), 6)
+        self.assertEqual(subject.min(999), 0)
+
+
+class TestEnergyIntegral(TestCase):
+    def test_power_is_integrated(self):
+        subject = EnergyIntegral(total=1.0)
+        subject.add(0, 1000)
+        subject.add(1800, 2000)
+        self.assertAlmostEqual(subject.total, 1.5)
+        self.assertAlmostEqual(subject.value(3600), 2.5)
+
+    def test_gaps_are_not_integrated(self):
+        subject = EnergyIntegral(scale=1)
+        subject.add(0, 1)
+        subject.add(3600, None)
+        subject.add(7200, 1)
+        self.assertAlmostEqual(subject.value(10800), 2)
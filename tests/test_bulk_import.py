@@ -0,0 +1,165 @@
+"""Tests for bulk import of devices"""
+import asyncio
+
+import pytest
+from unittest.mock import patch
+
+from homeassistant.const import CONF_HOST, CONF_NAME
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.tuya_local.bulk_import import (
+    ADDED,
+    CONFIGURED,
+    FAILED,
+    NO_ADDRESS,
+    NO_RESPONSE,
+    async_import_devices,
+    async_probe,
+    detect_type,
+    parse_devices,
+    summary,
+)
+from custom_components.tuya_local.const import (
+    CONF_DEVICE_CID,
+    CONF_DEVICE_ID,
+    CONF_LOCAL_KEY,
+    CONF_PROTOCOL_VERSION,
+    CONF_TYPE,
+    DOMAIN,
+)
+
+WIZARD_DEVICES = [
+    {
+        "name": "Heater",
+        "id": "heater_id",
+        "key": "heater_key",
+        "ip": "192.168.1.10",
+        "version": "3.3",
+    },
+    {
+        "name": "Gateway",
+        "id": "gateway_id",
+        "key": "gateway_key",
+        "ip": "192.168.1.11",
+        "version": "3.4",
+        "node_id": "gateway_node",
+    },
+    {
+        "name": "Sensor",
+        "id": "sensor_id",
+        "key": "sensor_key",
+        "node_id": "sensor_node",
+        "parent": "gateway_node",
+        "sub": True,
+    },
+    {"name": "No key", "id": "nokey_id", "key": ""},
+]
+
+SNAPSHOT = {
+    "timestamp": 1700000000,
+    "devices": [
+        {
+            "name": "Plug",
+            "id": "plug_id",
+            "key": "plug_key",
+            "ip": "192.168.1.12",
+            "ver": "3.1",
+        },
+        {"name": "Offline", "id": "offline_id", "key": "offline_key", "ip": ""},
+    ],
+}
+
+
+def test_parse_devices_json():
+    devices = parse_devices(WIZARD_DEVICES)
+    assert len(devices) == 3
+    heater, gateway, sensor = devices
+    assert heater[CONF_NAME] == "Heater"
+    assert heater[CONF_PROTOCOL_VERSION] == 3.3
+    assert gateway[CONF_PROTOCOL_VERSION] == 3.4
+    assert sensor[CONF_DEVICE_ID] == "gateway_id"
+    assert sensor[CONF_DEVICE_CID] == "sensor_node"
+    assert sensor[CONF_HOST] == "192.168.1.11"
+    assert sensor[CONF_LOCAL_KEY] == "gateway_key"
+
+
+def test_parse_snapshot_json():
+    plug, offline = parse_devices(SNAPSHOT)
+    assert plug[CONF_PROTOCOL_VERSION] == 3.1
+    assert plug[CONF_HOST] == "192.168.1.12"
+    assert offline[CONF_HOST] == ""
+
+
+def test_detect_type():
+    config_type, quality = detect_type(
+        {"1": True, "2": 20, "3": 18, "4": "comfort", "5": False, "6": False}
+    )
+    assert config_type is not None
+    assert quality > 0
+
+
+@pytest.mark.asyncio
+async def test_import_devices(hass):
+    MockConfigEntry(domain=DOMAIN, unique_id="gateway_id", data={}).add_to_hass(hass)
+    devices = parse_devices(WIZARD_DEVICES) + parse_devices(SNAPSHOT)
+    devices.append({**devices[0], CONF_NAME: "Twin", CONF_DEVICE_ID: "twin_id"})
+    devices.append({**devices[0], CONF_NAME: "Broken", CONF_DEVICE_ID: "broken_id"})
+
+    async def probe(hass, config, limit):
+        if config[CONF_DEVICE_ID] == "plug_id":
+            return NO_RESPONSE, None
+        return "kogan_kahtp_heater", 100
+
+    async def init(domain, context, data):
+        if data[CONF_DEVICE_ID] == "twin_id":
+            # Added by something else since the import started
+            return {"type": "abort", "reason": "already_configured"}
+        if data[CONF_DEVICE_ID] == "broken_id":
+            raise ValueError("Broken")
+        return {"type": "create_entry"}
+
+    with patch(
+        "custom_components.tuya_local.bulk_import.async_probe",
+        side_effect=probe,
+    ), patch.object(
+        hass.config_entries.flow,
+        "async_init",
+        side_effect=init,
+    ) as m_init:
+        results = await async_import_devices(hass, devices, 2)
+
+    assert [r["result"] for r in results] == [
+        ADDED,
+        CONFIGURED,
+        ADDED,
+        NO_RESPONSE,
+        NO_ADDRESS,
+        CONFIGURED,
+        FAILED,
+    ]
+    assert results[6]["reason"] == "Broken"
+    # Probes complete in any order
+    created = {
+        c.kwargs["data"][CONF_DEVICE_ID]: c.kwargs["data"]
+        for c in m_init.call_args_list
+    }
+    assert set(created) == {"heater_id", "gateway_id", "twin_id", "broken_id"}
+    assert created["gateway_id"][CONF_DEVICE_CID] == "sensor_node"
+    assert all(c[CONF_TYPE] == "kogan_kahtp_heater" for c in created.values())
+    report = summary(results)
+    assert "2 added" in report
+    assert "- Offline: no address" in report
+    assert "- Broken: failed, Broken" in report
+
+
+@pytest.mark.asyncio
+async def test_probe_reports_devices_that_cannot_be_created(hass):
+    config = parse_devices(WIZARD_DEVICES)[0]
+    with patch(
+        "custom_components.tuya_local.bulk_import.TuyaLocalDevice",
+        side_effect=ValueError("Bad address"),
+    ):
+        assert await async_probe(hass, config, asyncio.Semaphore(1)) == (
+            NO_RESPONSE,
+            None,
+        )
@@ -11,6 +11,7 @@ from custom_components.tuya_local.const import (
 )
 from custom_components.tuya_local.camera import (
     async_setup_entry,
+    SnapshotAssembler,
     TuyaLocalCamera,
 )
 
@@ -86,3 +87,45 @@ async def test_init_entry_fails_if_config_is_missing(hass):
     except ValueError:
         pass
     m_add_entities.assert_not_called()
+
+
+def test_snapshot_assembler_complete_image():
+    """Test that a snapshot sent in one message is used directly."""
+    subject = SnapshotAssembler()
+    image = b"\xff\xd8image\xff\xd9"
+    subject.add(image)
+    assert subject.image is image
+    subject.add(b"Test")
+    assert subject.image == b"Test"
+    subject.add(None)
+    assert subject.image is None
+
+
+def test_snapshot_assembler_chunks():
+    """Test that a snapshot sent in several messages is reassembled."""
+    subject = SnapshotAssembler()
+    subject.add(b"old")
+    subject.add(b"\xff\xd8first")
+    assert subject.image == b"old"
+    subject.add(b"second")
+    assert subject.image == b"old"
+    subject.add(b"third\xff\xd9")
+    assert subject.image == b"\xff\xd8firstsecondthird\xff\xd9"
+
+
+def test_snapshot_assembler_is_bounded():
+    """Test that oversized partial snapshots are discarded."""
+    subject = SnapshotAssembler(max_size=10)
+    subject.add(b"\xff\xd8first")
+    subject.add(b"second")
+    subject.add(b"third\xff\xd9")
+    assert subject.image is None
+
+
+def test_snapshot_assembler_drops_orphan_chunks():
+    """Test that the end of a snapshot without its start is not used."""
+    subject = SnapshotAssembler()
+    image = b"\xff\xd8image\xff\xd9"
+    subject.add(image)
+    subject.add(b"third\xff\xd9")
+    assert subject.image is image
@@ -1,5 +1,5 @@
 """Tests for the config flow."""
-from unittest.mock import ANY, AsyncMock, MagicMock, patch
+from unittest.mock import ANY, AsyncMock, MagicMock, Mock, patch
 
 from homeassistant.const import CONF_HOST, CONF_NAME
 import pytest
@@ -11,11 +11,14 @@ from custom_components.tuya_local import (
     config_flow,
     async_migrate_entry,
     async_setup_entry,
+    async_update_entry,
 )
 from custom_components.tuya_local.const import (
+    CONF_DEADBAND,
     CONF_DEVICE_ID,
     CONF_DEVICE_CID,
     CONF_LOCAL_KEY,
+    CONF_MIN_UPDATE_INTERVAL,
     CONF_POLL_ONLY,
     CONF_PROTOCOL_VERSION,
     CONF_TYPE,
@@ -71,6 +74,64 @@ async def test_init_entry(hass):
     assert hass.states.get("lock.test_child_lock")
 
 
+@pytest.mark.asyncio
+async def test_update_entry_reconfigures_running_device(hass):
+    """Test that option changes are applied without reloading the entry."""
+    device = AsyncMock()
+    hass.data[DOMAIN] = {"deviceid": {"device": device}}
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        version=12,
+        title="test",
+        data={
+            CONF_DEVICE_ID: "deviceid",
+            CONF_HOST: "hostname",
+            CONF_LOCAL_KEY: "localkey",
+            CONF_POLL_ONLY: False,
+            CONF_PROTOCOL_VERSION: "auto",
+            CONF_TYPE: "kogan_kahtp_heater",
+        },
+        options={CONF_POLL_ONLY: True, CONF_PROTOCOL_VERSION: 3.3},
+    )
+    with patch("custom_components.tuya_local.async_unload_entry") as mock_unload, patch(
+        "custom_components.tuya_local.async_setup_entry"
+    ) as mock_setup:
+        await async_update_entry(hass, entry)
+
+    device.async_reconfigure.assert_awaited_once_with({**entry.data, **entry.options})
+    mock_unload.assert_not_called()
+    mock_setup.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_update_entry_reloads_when_device_id_changes(hass):
+    """Test that the entry is reloaded when the sub device id changes."""
+    device = AsyncMock()
+    hass.data[DOMAIN] = {"deviceid": {"device": device}}
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        version=12,
+        title="test",
+        data={
+            CONF_DEVICE_ID: "deviceid",
+            CONF_HOST: "hostname",
+            CONF_LOCAL_KEY: "localkey",
+            CONF_POLL_ONLY: False,
+            CONF_PROTOCOL_VERSION: "auto",
+            CONF_TYPE: "kogan_kahtp_heater",
+        },
+        options={CONF_DEVICE_CID: "subdeviceid"},
+    )
+    with patch("custom_components.tuya_local.async_unload_entry") as mock_unload, patch(
+        "custom_components.tuya_local.async_setup_entry"
+    ) as mock_setup:
+        await async_update_entry(hass, entry)
+
+    device.async_reconfigure.assert_not_awaited()
+    mock_unload.assert_awaited_once_with(hass, entry)
+    mock_setup.assert_awaited_once_with(hass, entry)
+
+
 @pytest.mark.asyncio
 @patch("custom_components.tuya_local.setup_device")
 async def test_migrate_entry(mock_setup, hass):
@@ -252,6 +313,7 @@ async def test_async_test_connection_valid(mock_device, hass):
     """Test that device is returned when connection is valid."""
     mock_instance = AsyncMock()
     mock_instance.has_returned_state = True
+    mock_instance.connection_matches = Mock(return_value=False)
     mock_device.return_value = mock_instance
     hass.data[DOMAIN] = {"deviceid": {"device": mock_instance}}
 
@@ -275,6 +337,7 @@ async def test_async_test_connection_for_subdevice_valid(mock_device, hass):
     """Test that subdevice is returned when connection is valid."""
     mock_instance = AsyncMock()
     mock_instance.has_returned_state = True
+    mock_instance.connection_matches = Mock(return_value=False)
     mock_device.return_value = mock_instance
     hass.data[DOMAIN] = {"subdeviceid": {"device": mock_instance}}
 
@@ -293,12 +356,62 @@ async def test_async_test_connection_for_subdevice_valid(mock_device, hass):
     mock_instance.resume.assert_called_once()
 
 
+@pytest.mark.asyncio
+@patch("custom_components.tuya_local.config_flow.TuyaLocalDevice")
+async def test_async_test_connection_reuses_working_device(mock_device, hass):
+    """Test that a running device is reused when its connection is unchanged."""
+    existing = AsyncMock()
+    existing.connection_matches = Mock(return_value=True)
+    hass.data[DOMAIN] = {"deviceid": {"device": existing}}
+    config = {
+        CONF_DEVICE_ID: "deviceid",
+        CONF_LOCAL_KEY: "localkey",
+        CONF_HOST: "hostname",
+        CONF_PROTOCOL_VERSION: "auto",
+    }
+
+    device = await config_flow.async_test_connection(config, hass)
+    assert device is existing
+    existing.connection_matches.assert_called_once_with(config)
+    mock_device.assert_not_called()
+    existing.pause.assert_not_called()
+    existing.async_close_connection.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@patch("custom_components.tuya_local.config_flow.TuyaLocalDevice")
+async def test_async_test_connection_releases_existing_connection(mock_device, hass):
+    """Test that the running device's connection is released for the test."""
+    existing = AsyncMock()
+    existing.connection_matches = Mock(return_value=False)
+    existing.address = "hostname"
+    mock_instance = AsyncMock()
+    mock_instance.has_returned_state = True
+    mock_device.return_value = mock_instance
+    hass.data[DOMAIN] = {"deviceid": {"device": existing}}
+
+    device = await config_flow.async_test_connection(
+        {
+            CONF_DEVICE_ID: "deviceid",
+            CONF_LOCAL_KEY: "newkey",
+            CONF_HOST: "hostname",
+            CONF_PROTOCOL_VERSION: "auto",
+        },
+        hass,
+    )
+    assert device is mock_instance
+    existing.pause.assert_called_once()
+    existing.async_close_connection.assert_awaited_once()
+    existing.resume.assert_called_once()
+
+
 @pytest.mark.asyncio
 @patch("custom_components.tuya_local.config_flow.TuyaLocalDevice")
 async def test_async_test_connection_invalid(mock_device, hass):
     """Test that None is returned when connection is invalid."""
     mock_instance = AsyncMock()
     mock_instance.has_returned_state = False
+    mock_instance.release = Mock()
     mock_device.return_value = mock_instance
     device = await config_flow.async_test_connection(
         {
@@ -310,6 +423,8 @@ async def test_async_test_connection_invalid(mock_device, hass):
         hass,
     )
     assert device is None
+    # The failed connection is not left open
+    mock_instance.release.assert_called_once()
 
 
 @pytest.mark.asyncio
@@ -508,6 +623,65 @@ async def test_flow_choose_entities_creates_config_entry(hass, bypass_setup):
         assert expected == result
 
 
+@pytest.mark.asyncio
+@patch("custom_components.tuya_local.config_flow.hand_off_device")
+async def test_flow_choose_entities_hands_off_tested_device(
+    mock_handoff, hass, bypass_setup
+):
+    """Test the tested device is handed off to the new entry's setup."""
+    data = {
+        CONF_DEVICE_ID: "deviceid",
+        CONF_LOCAL_KEY: "localkey",
+        CONF_HOST: "hostname",
+        CONF_POLL_ONLY: False,
+        CONF_PROTOCOL_VERSION: "auto",
+        CONF_TYPE: "kogan_kahtp_heater",
+    }
+    tested = MagicMock()
+    with patch.dict(config_flow.ConfigFlowHandler.data, data), patch.object(
+        config_flow.ConfigFlowHandler, "device", tested
+    ):
+        flow = await hass.config_entries.flow.async_init(
+            DOMAIN, context={"source": "choose_entities"}
+        )
+        result = await hass.config_entries.flow.async_configure(
+            flow["flow_id"],
+            user_input={CONF_NAME: "test"},
+        )
+        assert result["type"] == "create_entry"
+        mock_handoff.assert_called_once_with(hass, data, tested)
+
+
+@pytest.mark.asyncio
+async def test_flow_import_creates_config_entry(hass, bypass_setup):
+    """Test devices from a bulk import are added without user steps."""
+    data = {
+        CONF_DEVICE_ID: "deviceid",
+        CONF_LOCAL_KEY: "localkey",
+        CONF_HOST: "hostname",
+        CONF_POLL_ONLY: False,
+        CONF_PROTOCOL_VERSION: 3.3,
+        CONF_TYPE: "kogan_kahtp_heater",
+    }
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN,
+        context={"source": "import"},
+        data={**data, CONF_NAME: "test"},
+    )
+    assert result["type"] == "create_entry"
+    assert result["title"] == "test"
+    assert result["data"] == data
+
+    # A second import of the same device is not added again
+    result = await hass.config_entries.flow.async_init(
+        DOMAIN,
+        context={"source": "import"},
+        data={**data, CONF_NAME: "test"},
+    )
+    assert result["type"] == "abort"
+    assert result["reason"] == "already_configured"
+
+
 @pytest.mark.asyncio
 async def test_options_flow_init(hass):
     """Test config flow options."""
@@ -580,6 +754,7 @@ async def test_options_flow_modifies_config(mock_test, hass):
             CONF_POLL_ONLY: False,
             CONF_PROTOCOL_VERSION: 3.3,
             CONF_DEVICE_CID: "subdeviceid",
+            CONF_MIN_UPDATE_INTERVAL: 10,
         },
     )
     expected = {
@@ -588,6 +763,8 @@ async def test_options_flow_modifies_config(mock_test, hass):
         CONF_POLL_ONLY: False,
         CONF_PROTOCOL_VERSION: 3.3,
         CONF_DEVICE_CID: "subdeviceid",
+        CONF_MIN_UPDATE_INTERVAL: 10,
+        CONF_DEADBAND: 0,
     }
     assert "create_entry" == result["type"]
     assert "" == result["title"]
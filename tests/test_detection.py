@@ -0,0 +1,89 @@
+"""Tests for incremental detection of device types"""
+from unittest import TestCase
+
+from custom_components.tuya_local.helpers.detection import (
+    ConfigSignature,
+    IncrementalDetector,
+    load_signatures,
+)
+from custom_components.tuya_local.helpers.device_config import possible_matches
+
+from . import const
+
+
+def signature(name, order, dps):
+    return ConfigSignature(f"{name}.yaml", order, dps)
+
+
+class TestIncrementalDetector(TestCase):
+    def setUp(self):
+        self.switch = signature("switch", 0, {"1": ((bool,), True)})
+        self.plug = signature(
+            "plug",
+            1,
+            {"1": ((bool,), True), "19": ((int,), False), "20": ((int,), True)},
+        )
+        self.light = signature(
+            "light",
+            2,
+            {"20": ((bool,), True), "21": ((str,), True)},
+        )
+        self.subject = IncrementalDetector([self.switch, self.plug, self.light])
+
+    def test_candidates_narrow_as_dps_arrive(self):
+        self.assertTrue(self.subject.observe({"1": True, "updated_at": 0}))
+        self.assertEqual(self.subject.matches(), [self.switch])
+        self.assertEqual(self.subject.best(), (self.switch, 100))
+        self.assertFalse(self.subject.confident)
+
+        # The light declares dp 20 as a boolean, so is eliminated
+        self.assertTrue(self.subject.observe({"1": True, "20": 2300}))
+        self.assertEqual(self.subject.candidates, 2)
+        self.assertEqual(self.subject.matches(), [self.switch, self.plug])
+        self.assertEqual(self.subject.best(), (self.plug, 100))
+        self.assertEqual(self.subject.quality(self.switch), 50)
+        self.assertTrue(self.subject.confident)
+
+        # Dps already seen do not change anything
+        self.assertFalse(self.subject.observe({"1": False, "20": "x"}))
+        self.assertEqual(
+            [
+                (h["dps"], h["candidates"], h["best"], h["quality"], h["confident"])
+                for h in self.subject.history
+            ],
+            [(1, 3, "switch", 100, False), (2, 2, "plug", 100, True)],
+        )
+
+    def test_unseen_dps_of_best_candidates(self):
+        self.assertEqual(self.subject.unseen_dps(), ["1", "20", "19", "21"])
+        self.subject.observe({"1": True})
+        self.assertEqual(self.subject.unseen_dps(), ["19", "20"])
+        self.assertEqual(self.subject.unseen_dps(1), ["19"])
+
+    def test_nothing_matches(self):
+        self.subject.observe({"1": "on"})
+        self.assertEqual(self.subject.best(), (None, 0))
+        self.assertFalse(self.subject.confident)
+
+
+class TestDetectionMatchesConfigs(TestCase):
+    def test_same_result_as_full_scan(self):
+        signatures = load_signatures()
+        self.assertIs(load_signatures()[0], signatures[0])
+        for name in (
+            "GPPH_HEATER_PAYLOAD",
+            "EUROM_600_HEATER_PAYLOAD",
+            "KOGAN_SOCKET_PAYLOAD",
+        ):
+            dps = getattr(const, name)
+            detector = IncrementalDetector(signatures)
+            detector.observe(dps)
+
+            configs = list(possible_matches(dps))
+            self.assertEqual(
+                [s.config_type for s in detector.matches()],
+                [c.config_type for c in configs],
+                name,
+            )
+            for s, c in zip(detector.matches(), configs):
+                self.assertEqual(detector.quality(s), c.match_quality(dps))
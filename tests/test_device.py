@@ -1,22 +1,54 @@
+import asyncio
 from datetime import datetime
+import os
+from tempfile import TemporaryDirectory
 from time import time
 from unittest import IsolatedAsyncioTestCase
 from unittest.mock import AsyncMock, Mock, call, patch, ANY
 
 from homeassistant.const import (
+    CONF_HOST,
+    CONF_NAME,
     EVENT_HOMEASSISTANT_STARTED,
     EVENT_HOMEASSISTANT_STOP,
 )
 
-from custom_components.tuya_local.device import TuyaLocalDevice
+from custom_components.tuya_local.const import (
+    CONF_DEVICE_CID,
+    CONF_DEVICE_ID,
+    CONF_LOCAL_KEY,
+    CONF_POLL_ONLY,
+    CONF_PROTOCOL_VERSION,
+    DATA_HANDOFF,
+)
+from custom_components.tuya_local.device import (
+    HANDOFF_TIMEOUT,
+    TuyaLocalDevice,
+    hand_off_device,
+    setup_device,
+)
+from custom_components.tuya_local.helpers.capture import (
+    TrafficCapture,
+    async_replay,
+    read_capture,
+)
 from custom_components.tuya_local.helpers.device_config import TuyaEntityConfig
+from custom_components.tuya_local.helpers.scheduler import DATA_COMMAND_EXECUTOR
+from custom_components.tuya_local.helpers.trace import start_tracing, stop_tracing
+from custom_components.tuya_local.helpers.watchdog import set_stall_threshold
 from custom_components.tuya_local.switch import TuyaLocalSwitch
+from custom_components.tuya_local.worker import WorkerApi
 
 from .const import (
     EUROM_600_HEATER_PAYLOAD,
 )
 
 
+def mock_dp(id, **kwargs):
+    """Return a mock dp config, without any update filtering or extrapolation."""
+    return Mock(id=id, min_interval=0, deadband=None, extrapolation=None, **kwargs)
+
+
 class TestDevice(IsolatedAsyncioTestCase):
     def setUp(self):
         device_patcher = patch("tinytuya.Device")
@@ -28,6 +60,7 @@ class TestDevice(IsolatedAsyncioTestCase):
         self.hass = hass_patcher.start()
         self.hass().is_running = True
         self.hass().is_stopping = False
+        self.hass().data = {}
 
         def job(func, *args):
             return func(*args)
@@ -102,6 +135,55 @@ class TestDevice(IsolatedAsyncioTestCase):
         self.subject._cached_state = {"2": False, "updated_at": datetime.now()}
         self.assertEqual(await self.subject.async_inferred_type(), None)
 
+    async def test_detection_polls_for_dps_that_tell_candidates_apart(self):
+        self.subject._cached_state = {"1": True, "2": 15, "updated_at": time()}
+        self.mock_api().dev_type = "device22"
+        self.mock_api().status.return_value = {"dps": {"5": 18, "6": 0}}
+
+        self.assertEqual(
+            await self.subject.async_inferred_type(),
+            "eurom_600_heater",
+        )
+        # Polling stops once it returns no new dps
+        self.assertEqual(self.mock_api().status.call_count, 2)
+        requested = self.mock_api().set_dpsUsed.call_args[0][0]
+        self.assertIn("1", requested)
+        self.assertIn("5", requested)
+        history = self.subject.metrics.detection_history
+        self.assertEqual(len(history), 2)
+        self.assertGreater(history[0]["candidates"], history[1]["candidates"])
+        self.assertIsNotNone(self.subject.metrics.detection_time)
+
+    async def test_detection_does_not_poll_devices_that_return_all_dps(self):
+        self.subject._cached_state = {"1": True, "2": 15, "updated_at": time()}
+        self.mock_api().dev_type = "default"
+
+        await self.subject.async_inferred_type()
+
+        self.mock_api().status.assert_not_called()
+        self.mock_api().set_dpsUsed.assert_not_called()
+
+    async def test_detection_polls_when_fewer_dps_are_returned_than_requested(
+        self,
+    ):
+        self.subject._cached_state = {"updated_at": 0}
+        self.mock_api().dev_type = "default"
+        self.mock_api().status.side_effect = [
+            {"dps": {"1": True}},
+            {"dps": {"1": True, "2": 15, "5": 18, "6": 0}},
+            {"dps": {"1": True, "2": 15, "5": 18, "6": 0}},
+        ]
+
+        self.assertEqual(
+            await self.subject.async_inferred_type(),
+            "eurom_600_heater",
+        )
+        # Polling stops once it returns no new dps
+        self.assertEqual(self.mock_api().status.call_count, 3)
+        requested = self.mock_api().set_dpsUsed.call_args[0][0]
+        self.assertIn("1", requested)
+        self.assertIn("5", requested)
+
     async def test_refreshes_when_there_is_no_pending_reset(self):
         self.subject._cached_state = {"updated_at": time() - 19}
         self.mock_api().status.return_value = {"dps": {"1": "called"}}
@@ -141,6 +223,30 @@ class TestDevice(IsolatedAsyncioTestCase):
         self.assertEqual(self.mock_api().status.call_count, 11)
         self.assertEqual(self.subject._cached_state["1"], False)
 
+    async def test_refresh_records_metrics(self):
+        self.subject._api_protocol_working = False
+        self.mock_api().status.side_effect = [
+            Exception("Error"),
+            {"dps": {"1": False}},
+        ]
+
+        await self.subject.async_refresh()
+
+        metrics = self.subject.metrics
+        self.assertEqual(metrics.latency["status"].count, 2)
+        self.assertEqual(metrics.failures["status"], 1)
+        self.assertEqual(metrics.retries, 1)
+        self.assertEqual(metrics.connection_failures, 0)
+        self.assertIsNotNone(metrics.response_time)
+
+    async def test_connection_failures_are_counted(self):
+        self.mock_api().status.side_effect = Exception("Error")
+
+        await self.subject.async_refresh()
+
+        self.assertEqual(self.subject.metrics.connection_failures, 1)
+        self.assertEqual(self.subject.metrics.retries, 2)
+
     async def test_refresh_clears_cache_after_allowed_failures(self):
         self.subject._cached_state = {"1": True}
         self.subject._pending_updates = {
@@ -238,6 +344,285 @@ class TestDevice(IsolatedAsyncioTestCase):
         await self.subject.async_refresh()
         self.assertEqual(self.subject._api_protocol_version_index, 3)
 
+    def test_connection_matches_working_connection(self):
+        self.subject._cached_state = {"1": True, "updated_at": time()}
+        config = {
+            CONF_HOST: "some.ip.address",
+            CONF_LOCAL_KEY: "some_local_key",
+            CONF_PROTOCOL_VERSION: "auto",
+        }
+        self.assertTrue(self.subject.connection_matches(config))
+        # A change of protocol is negotiated on the working connection
+        self.assertTrue(
+            self.subject.connection_matches({**config, CONF_PROTOCOL_VERSION: 3.3})
+        )
+        self.assertTrue(
+            self.subject.connection_matches({**config, CONF_PROTOCOL_VERSION: 3.4})
+        )
+        self.assertFalse(
+            self.subject.connection_matches({**config, CONF_HOST: "another.ip"})
+        )
+        self.assertFalse(
+            self.subject.connection_matches({**config, CONF_LOCAL_KEY: "new_key"})
+        )
+        self.assertFalse(
+            self.subject.connection_matches({**config, CONF_DEVICE_CID: "sub"})
+        )
+        self.subject._api_protocol_working = False
+        self.assertFalse(self.subject.connection_matches(config))
+
+    def test_connection_matches_requires_state(self):
+        self.assertFalse(
+            self.subject.connection_matches(
+                {
+                    CONF_HOST: "some.ip.address",
+                    CONF_LOCAL_KEY: "some_local_key",
+                    CONF_PROTOCOL_VERSION: "auto",
+                }
+            )
+        )
+
+    async def test_async_close_connection(self):
+        await self.subject.async_close_connection()
+        self.mock_api().set_socketPersistent.assert_called_once_with(False)
+
+    async def test_async_close_connection_waits_for_receive_loop(self):
+        self.subject._receiving.start()
+        close = asyncio.create_task(self.subject.async_close_connection())
+        await asyncio.wait([close], timeout=0.1)
+        self.assertFalse(close.done())
+        self.mock_api().set_socketPersistent.assert_not_called()
+
+        self.subject._receiving.done()
+        await close
+        self.mock_api().set_socketPersistent.assert_called_once_with(False)
+
+    async def test_adopt_takes_over_negotiated_protocol_and_state(self):
+        self.subject._api_protocol_version_index = 3
+        self.subject._cached_state = {"1": True, "updated_at": time()}
+        device = TuyaLocalDevice(
+            "Other name",
+            "some_dev_id",
+            "some.ip.address",
+            "some_local_key",
+            "auto",
+            None,
+            self.hass(),
+        )
+        device.adopt(self.subject)
+
+        self.assertTrue(device.has_returned_state)
+        self.assertEqual(device.get_property("1"), True)
+        self.assertFalse(device.should_poll)
+        self.mock_api().set_version.reset_mock()
+        await device._rotate_api_protocol_version()
+        self.mock_api().set_version.assert_called_once_with(3.4)
+
+    def test_adopt_ignores_untested_device(self):
+        device = TuyaLocalDevice(
+            "Other name",
+            "some_dev_id",
+            "some.ip.address",
+            "some_local_key",
+            "auto",
+            None,
+            self.hass(),
+        )
+        self.subject.adopt(device)
+        self.assertFalse(self.subject.has_returned_state)
+        self.assertIsNone(self.subject._negotiated_protocol)
+
+    def test_setup_device_adopts_handed_off_device(self):
+        self.hass().data = {}
+        self.subject._cached_state = {"1": True, "updated_at": time()}
+        config = {
+            CONF_NAME: "Some name",
+            CONF_DEVICE_ID: "some_dev_id",
+            CONF_HOST: "some.ip.address",
+            CONF_LOCAL_KEY: "some_local_key",
+            CONF_PROTOCOL_VERSION: "auto",
+            CONF_POLL_ONLY: False,
+        }
+        tested_api = self.subject._api = Mock(parent=None)
+        hand_off_device(self.hass(), config, self.subject)
+        device = setup_device(self.hass(), config)
+        self.assertTrue(device.has_returned_state)
+        self.assertEqual(device._negotiated_protocol, 3.3)
+        # The tested connection is closed, as it is not used again
+        tested_api.close.assert_called_once()
+        # The handoff is only used once
+        self.assertFalse(setup_device(self.hass(), config).has_returned_state)
+
+    def test_setup_device_ignores_stale_handoff(self):
+        self.hass().data = {}
+        self.subject._cached_state = {"1": True, "updated_at": time()}
+        config = {
+            CONF_NAME: "Some name",
+            CONF_DEVICE_ID: "some_dev_id",
+            CONF_HOST: "some.ip.address",
+            CONF_LOCAL_KEY: "some_local_key",
+            CONF_PROTOCOL_VERSION: "auto",
+            CONF_POLL_ONLY: False,
+        }
+        tested_api = self.subject._api = Mock(parent=None)
+        with patch(
+            "custom_components.tuya_local.device.monotonic",
+            side_effect=[0, HANDOFF_TIMEOUT + 1],
+        ):
+            hand_off_device(self.hass(), config, self.subject)
+            device = setup_device(self.hass(), config)
+        self.assertFalse(device.has_returned_state)
+        tested_api.close.assert_called_once()
+
+    def test_unused_handoff_expires(self):
+        self.hass().data = {}
+        config = {
+            CONF_DEVICE_ID: "some_dev_id",
+            CONF_HOST: "some.ip.address",
+            CONF_LOCAL_KEY: "some_local_key",
+            CONF_PROTOCOL_VERSION: "auto",
+        }
+        tested_api = self.subject._api = Mock(parent=None)
+        hand_off_device(self.hass(), config, self.subject)
+        delay, expire, *args = self.hass().loop.call_later.call_args[0]
+        self.assertEqual(delay, HANDOFF_TIMEOUT)
+
+        expire(*args)
+        self.assertEqual(self.hass().data[DATA_HANDOFF], {})
+        tested_api.close.assert_called_once()
+
+    def reconfigure_options(self, **changes):
+        return {
+            CONF_HOST: "some.ip.address",
+            CONF_LOCAL_KEY: "some_local_key",
+            CONF_PROTOCOL_VERSION: "auto",
+            CONF_POLL_ONLY: False,
+            **changes,
+        }
+
+    async def test_reconfigure_applies_options_in_place(self):
+        self.subject._entity_dps = []
+        self.mock_api.reset_mock()
+        await self.subject.async_reconfigure(
+            self.reconfigure_options(
+                poll_only=True,
+                protocol_version=3.3,
+                min_update_interval=5,
+            )
+        )
+        self.mock_api.assert_not_called()
+        self.assertTrue(self.subject.should_poll)
+        self.assertEqual(self.subject._protocol_configured, 3.3)
+        # The working protocol is still allowed, so is kept
+        self.assertEqual(self.subject._api_protocol_version_index, 0)
+        self.assertTrue(self.subject._api_protocol_working)
+        # Update filters are rebuilt with the new interval
+        self.assertIsNone(self.subject._entity_dps)
+        self.assertEqual(self.subject._min_update_interval, 5)
+
+    async def test_reconfigure_with_new_protocol_renegotiates(self):
+        await self.subject.async_reconfigure(
+            self.reconfigure_options(protocol_version=3.4)
+        )
+        self.assertIsNone(self.subject._api_protocol_version_index)
+        self.assertFalse(self.subject._api_protocol_working)
+        await self.subject._rotate_api_protocol_version()
+        self.mock_api().set_version.assert_called_with(3.4)
+
+    async def test_reconfigure_with_new_host_reconnects(self):
+        self.subject._api_protocol_version_index = 3
+        self.subject._api_working_protocol_failures = 5
+        self.subject._cached_state = {"1": True, "updated_at": time()}
+        old_api = self.subject._api
+        new_api = Mock(parent=None)
+        self.mock_api.side_effect = [new_api]
+
+        await self.subject.async_reconfigure(
+            self.reconfigure_options(host="new.ip.address")
+        )
+        self.mock_api.assert_called_with(
+            "some_dev_id",
+            "new.ip.address",
+            "some_local_key",
+        )
+        self.assertIs(self.subject._api, new_api)
+        new_api.set_version.assert_called_once_with(3.4)
+        old_api.set_socketPersistent.assert_called_with(False)
+        # The old connection is not used again
+        old_api.close.assert_called_once()
+        new_api.close.assert_not_called()
+        # The state is kept, but fully refreshed through the new connection
+        self.assertTrue(self.subject.has_returned_state)
+        self.assertEqual(self.subject._cached_state["updated_at"], 0)
+        # The protocol is tried first, but not yet known to work
+        self.assertFalse(self.subject._api_protocol_working)
+        self.assertEqual(self.subject._api_working_protocol_failures, 0)
+
+    def reload_configs(self, entity_ids):
+        old = Mock(config_type="changed")
+        old.primary_entity.config_id = "switch"
+        old.secondary_entities.return_value = [Mock(config_id="removed")]
+        changed = Mock()
+        changed.primary_entity.config_id = "switch"
+        changed.secondary_entities.return_value = [
+            Mock(config_id=id) for id in entity_ids
+        ]
+        changed.find_entity.side_effect = lambda id: (
+            Mock(config_id=id) if id == "switch" or id in entity_ids else None
+        )
+        entity = Mock()
+        entity._config._device = old
+        entity._config.config_id = "switch"
+        other = Mock()
+        other._config._device.config_type = "unchanged"
+        removed = Mock()
+        removed._config._device = old
+        removed._config.config_id = "removed"
+        self.subject._children = [entity, other, removed]
+        self.subject._entity_dps = []
+        return changed, entity, other, removed
+
+    def test_reload_entity_configs(self):
+        changed, entity, other, removed = self.reload_configs(["removed"])
+
+        self.assertEqual(
+            self.subject.reload_entity_configs({"changed": changed}),
+            (2, False),
+        )
+        entity.reload_config.assert_called_once()
+        self.assertEqual(entity.reload_config.call_args[0][0].config_id, "switch")
+        entity.async_schedule_update_ha_state.assert_called_once()
+        other.reload_config.assert_not_called()
+        removed.reload_config.assert_called_once()
+        self.assertIsNone(self.subject._entity_dps)
+
+    def test_reload_entity_configs_recreates_removed_entities(self):
+        changed, entity, other, removed = self.reload_configs([])
+
+        self.assertEqual(
+            self.subject.reload_entity_configs({"changed": changed}),
+            (1, True),
+        )
+        removed.reload_config.assert_not_called()
+
+    def test_reload_entity_configs_recreates_entities_that_cannot_reload(self):
+        changed, entity, other, removed = self.reload_configs(["removed"])
+        entity.reload_config.return_value = False
+
+        self.assertEqual(
+            self.subject.reload_entity_configs({"changed": changed}),
+            (1, True),
+        )
+        entity.async_schedule_update_ha_state.assert_not_called()
+
+    def test_reload_entity_configs_recreates_when_entities_are_added(self):
+        changed, entity, other, removed = self.reload_configs(["removed", "new"])
+
+        self.assertEqual(
+            self.subject.reload_entity_configs({"changed": changed}),
+            (2, True),
+        )
+
     def test_reset_cached_state_clears_cached_state_and_pending_updates(self):
         self.subject._cached_state = {"1": True, "updated_at": time()}
         self.subject._pending_updates = {
@@ -365,6 +750,34 @@ class TestDevice(IsolatedAsyncioTestCase):
         self.subject._lock.acquire.assert_called_once()
         self.subject._lock.release.assert_called_once()
 
+    async def test_send_properties_sends_immediately(self):
+        self.assertTrue(await self.subject.async_send_properties({"1": True}))
+        self.mock_api().set_multiple_values.assert_called_once_with(
+            {"1": True},
+            nowait=True,
+        )
+        self.mock_sleep.assert_not_called()
+        self.assertTrue(self.subject._pending_updates["1"]["sent"])
+
+    async def test_send_properties_reports_failure(self):
+        self.mock_api().set_multiple_values.side_effect = Exception("Error")
+        self.assertFalse(await self.subject.async_send_properties({"1": True}))
+
+    async def test_commands_use_command_executor(self):
+        executor = Mock()
+        self.hass().data[DATA_COMMAND_EXECUTOR] = executor
+
+        async def run(executor, func, *args):
+            return func(*args)
+
+        self.hass().loop.run_in_executor = AsyncMock(side_effect=run)
+        self.assertTrue(await self.subject.async_send_properties({"1": True}))
+        self.hass().loop.run_in_executor.assert_awaited_once()
+        self.assertIs(self.hass().loop.run_in_executor.call_args[0][0], executor)
+        self.mock_api().set_multiple_values.assert_called_once()
+        self.assertEqual(self.subject.metrics.command_wait.count, 1)
+        self.assertEqual(self.subject._commands.in_flight, 0)
+
     def test_actually_start(self):
         # Set up the preconditions
         self.subject.receive_loop = Mock()
@@ -530,6 +943,406 @@ class TestDevice(IsolatedAsyncioTestCase):
         # Did we avoid restarting the loop?
         self.subject.start.assert_not_called()
 
+    def test_required_dps_follow_registered_entities(self):
+        # Set up preconditions
+        self.subject._running = True
+        self.subject._startup_listener = None
+        first = AsyncMock()
+        first._config = Mock()
+        first._config.dps.return_value = [
+            mock_dp("1", force=False),
+            mock_dp("2", force=True),
+        ]
+        second = AsyncMock()
+        second._config = Mock()
+        second._config.dps.return_value = [mock_dp("3", force=False)]
+
+        # Call the functions under test
+        self.subject.register_entity(first)
+        self.subject.register_entity(second)
+
+        # Are the dps of both entities required?
+        self.assertSetEqual(self.subject.required_dps, {"1", "2", "3"})
+        self.assertEqual(self.subject._force_dps, [2])
+
+    async def test_unregistered_entity_dps_no_longer_required(self):
+        # Set up preconditions
+        first = AsyncMock()
+        first._config = Mock()
+        first._config.dps.return_value = [mock_dp("1", force=True)]
+        second = AsyncMock()
+        second._config = Mock()
+        second._config.dps.return_value = [mock_dp("2", force=False)]
+        self.subject._children = [first, second]
+
+        # Call the function under test
+        await self.subject.async_unregister_entity(first)
+
+        # Were the dps of the removed entity dropped?
+        self.assertSetEqual(self.subject.required_dps, {"2"})
+        self.assertEqual(self.subject._force_dps, [])
+
+    def test_device22_requests_only_required_dps(self):
+        # Set up preconditions
+        entity = AsyncMock()
+        entity._config = Mock()
+        entity._config.dps.return_value = [
+            mock_dp("101", force=False),
+            mock_dp("2", force=False),
+        ]
+        self.subject._children = [entity]
+        self.subject._entity_dps = None
+        self.mock_api().dev_type = "device22"
+
+        # Call the function under test
+        self.subject._limit_requested_dps()
+
+        # Were only the required dps requested?
+        self.mock_api().set_dpsUsed.assert_called_once_with({"2": None, "101": None})
+
+    async def test_receive_loop_only_updates_affected_entities(self):
+        # Set up preconditions
+        first = Mock()
+        first._config.dps.return_value = [mock_dp("1")]
+        second = Mock()
+        second._config.dps.return_value = [mock_dp("2")]
+        self.subject._children = [first, second]
+
+        async def receive():
+            yield {"1": True, "full_poll": False}
+
+        self.subject.async_receive = receive
+
+        # Call the function under test
+        await self.subject.receive_loop()
+
+        # Was only the entity using the received dp updated?
+        first.async_write_ha_state.assert_called_once()
+        second.async_write_ha_state.assert_not_called()
+
+    async def test_receive_loop_is_traced(self):
+        entity = Mock()
+        entity._config.config_id = "switch"
+        entity._config.dps.return_value = [mock_dp("1", force=False)]
+        self.subject._children = [entity]
+
+        async def receive():
+            yield {"1": True, "full_poll": False}
+
+        self.subject.async_receive = receive
+        tracer = start_tracing()
+        self.addCleanup(stop_tracing)
+
+        await self.subject.receive_loop()
+
+        names = [e["name"] for e in tracer.as_dict()["traceEvents"]]
+        self.assertIn("process poll", names)
+        self.assertIn("cache merge", names)
+        self.assertIn("entity write", names)
+
+    async def test_slow_entity_updates_are_counted(self):
+        entity = Mock()
+        entity._config.config_id = "switch"
+        entity._config.dps.return_value = [mock_dp("1", force=False)]
+        self.subject._children = [entity]
+
+        async def receive():
+            yield {"1": True, "full_poll": False}
+
+        self.subject.async_receive = receive
+        # Any time taken is too long
+        set_stall_threshold(0)
+        self.addCleanup(set_stall_threshold, None)
+
+        with self.assertLogs("custom_components.tuya_local.helpers.watchdog") as logs:
+            await self.subject.receive_loop()
+
+        self.assertEqual(self.subject.metrics.stalls["switch"], 1)
+        self.assertEqual(self.subject.metrics.stalls["processing update"], 1)
+        self.assertIn("state update of switch with dps 1", logs.output[0])
+
+    async def test_capture_and_replay(self):
+        entity = Mock()
+        entity._config.config_id = "switch"
+        entity._config._device.config_type = "simple_switch"
+        entity._config.dps.return_value = [mock_dp("1", force=False, persist=True)]
+        self.subject._children = [entity]
+        self.mock_api().id = "some_dev_id"
+        self.mock_api().status.return_value = {"dps": {"1": True, "2": 3}}
+        self.mock_api().receive.return_value = {"dps": {"1": False}}
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "capture.jsonl")
+
+        await self.subject.async_start_capture(path, 10000)
+        self.subject._call_api("status", self.mock_api().status)
+        self.subject._call_api("receive", self.mock_api().receive)
+        self.subject._call_api("heartbeat", self.mock_api().heartbeat)
+        self.subject._call_api("set", self.mock_api().set_multiple_values, {"1": 1})
+        capture = await self.subject.async_stop_capture()
+
+        self.assertEqual(capture.records, 4)
+        records = read_capture(path)
+        self.assertEqual(records[0]["config_type"], "simple_switch")
+        self.assertEqual(records[0]["id"], "some_dev_id")
+        self.assertEqual(
+            [(r["type"], r["data"]) for r in records[1:]],
+            [
+                ("poll", {"1": True, "2": 3}),
+                ("poll", {"1": False}),
+                ("set", {"1": 1}),
+            ],
+        )
+        self.assertTrue(records[1]["full"])
+
+        entity.async_write_ha_state.reset_mock()
+        polls, _ = await async_replay(self.subject, records, speed=0)
+        self.assertEqual(polls, 2)
+        self.assertEqual(entity.async_write_ha_state.call_count, 2)
+        # The replayed command is pending, so overrides the last poll
+        self.assertEqual(self.subject.get_property("1"), 1)
+        self.assertEqual(self.subject.get_property("2"), 3)
+
+    def test_capture_is_bounded(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        capture = TrafficCapture(os.path.join(tmp.name, "capture.jsonl"), 200)
+        capture.open({"device": "Some name"})
+        for i in range(20):
+            capture.record_call("receive", (), {"dps": {"1": i}})
+        capture.close()
+
+        self.assertTrue(capture.full)
+        self.assertLessEqual(capture.size, 200)
+        self.assertEqual(len(read_capture(capture.path)), capture.records)
+
+    def test_capture_replaces_an_existing_file(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "capture.jsonl")
+        for i in range(2):
+            capture = TrafficCapture(path, 200)
+            capture.open({"device": "Some name"})
+            capture.record_call("receive", (), {"dps": {"1": i}})
+            capture.close()
+
+        records = read_capture(path)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]["type"], "header")
+        self.assertEqual(records[1]["data"], {"1": 1})
+        self.assertEqual(os.path.getsize(path), capture.size)
+
+    async def test_entity_updates_are_filtered(self):
+        entity = Mock()
+        entity._config.config_id = "sensor_power"
+        entity._config.entity = "sensor"
+        dp = Mock(
+            id="19",
+            force=False,
+            type=int,
+            min_interval=10,
+            deadband=None,
+            extrapolation=None,
+            get_value=lambda device: device.get_property("19"),
+        )
+        entity._config.dps.return_value = [dp]
+        self.subject._children = [entity]
+
+        self.subject._process_poll({"19": 100, "full_poll": False})
+        entity.async_write_ha_state.assert_called_once()
+
+        # A change soon after is written once the interval is over
+        self.subject._process_poll({"19": 101, "full_poll": False})
+        self.subject._process_poll({"19": 102, "full_poll": False})
+        entity.async_write_ha_state.assert_called_once()
+        self.hass().loop.call_later.assert_called_once()
+        delay, write, *args = self.hass().loop.call_later.call_args[0]
+        self.assertAlmostEqual(delay, 10, places=0)
+
+        write(*args)
+        self.assertEqual(entity.async_write_ha_state.call_count, 2)
+
+    def test_extrapolated_dps_are_written_until_they_end(self):
+        entity = Mock()
+        entity._config = TuyaEntityConfig(
+            self.subject,
+            {
+                "entity": "sensor",
+                "dps": [
+                    {
+                        "id": "5",
+                        "name": "sensor",
+                        "type": "integer",
+                        "range": {"min": 0, "max": 86400},
+                        "extrapolate": {"rate": -1},
+                    },
+                ],
+            },
+        )
+        entity.filter_updates = False
+        self.subject._children = [entity]
+        call_later = self.hass().loop.call_later
+
+        with patch(
+            "custom_components.tuya_local.device.monotonic", return_value=100
+        ), patch(
+            "custom_components.tuya_local.helpers.device_config.monotonic",
+            return_value=100,
+        ):
+            self.subject._process_poll({"5": 2, "full_poll": False})
+        self.assertEqual(self.subject.reported_at("5"), 100)
+        entity.async_write_ha_state.assert_called_once()
+        delay, tick = call_later.call_args[0]
+        self.assertEqual(delay, 1)
+
+        # Each step of the countdown is written
+        with patch(
+            "custom_components.tuya_local.device.monotonic", return_value=101
+        ), patch(
+            "custom_components.tuya_local.helpers.device_config.monotonic",
+            return_value=101,
+        ):
+            self.assertEqual(
+                entity._config.find_dps("sensor").get_value(self.subject), 1
+            )
+            tick()
+        self.assertEqual(entity.async_write_ha_state.call_count, 2)
+        self.assertNotEqual(self.subject._cached_state["updated_at"], 0)
+        delay, tick = call_later.call_args[0]
+        self.assertEqual(delay, 1)
+
+        # At the end, the device is polled once to confirm
+        with patch(
+            "custom_components.tuya_local.device.monotonic", return_value=102
+        ), patch(
+            "custom_components.tuya_local.helpers.device_config.monotonic",
+            return_value=102,
+        ):
+            tick()
+        self.assertEqual(entity.async_write_ha_state.call_count, 3)
+        self.assertEqual(self.subject._cached_state["updated_at"], 0)
+        self.assertEqual(call_later.call_count, 2)
+
+    async def test_extrapolation_end_resyncs_with_full_status(self):
+        entity = Mock()
+        entity._config = TuyaEntityConfig(
+            self.subject,
+            {
+                "entity": "sensor",
+                "dps": [
+                    {
+                        "id": "5",
+                        "name": "sensor",
+                        "type": "integer",
+                        "range": {"min": 0, "max": 86400},
+                        "extrapolate": {"rate": -1},
+                    },
+                    {"id": "1", "name": "forced", "type": "boolean", "force": True},
+                ],
+            },
+        )
+        entity.filter_updates = False
+        self.subject._children = [entity]
+        self.subject._api_protocol_working = True
+        call_later = self.hass().loop.call_later
+
+        for now in (100, 101):
+            with patch(
+                "custom_components.tuya_local.device.monotonic", return_value=now
+            ), patch(
+                "custom_components.tuya_local.helpers.device_config.monotonic",
+                return_value=now,
+            ):
+                if now == 100:
+                    self.subject._process_poll({"5": 1, "full_poll": False})
+                else:
+                    call_later.call_args[0][1]()
+        self.assertEqual(self.subject._force_dps, [1])
+        self.assertEqual(self.subject._cached_state["updated_at"], 0)
+
+        # The forced dps alone might not include the extrapolated dp
+        self.mock_api().status.return_value = {"dps": {"1": True, "5": 0}}
+        self.subject._running = True
+        loop = self.subject.async_receive()
+        result = await loop.__anext__()
+
+        self.mock_api().status.assert_called_once()
+        self.mock_api().updatedps.assert_not_called()
+        self.assertDictEqual(result, {"1": True, "5": 0, "full_poll": True})
+        self.assertFalse(self.subject._full_poll_due)
+        self.subject._running = False
+        with self.assertRaises(StopAsyncIteration):
+            await loop.__anext__()
+
+    def test_extrapolation_continues_after_entities_change(self):
+        entity = Mock()
+        entity._config = TuyaEntityConfig(
+            self.subject,
+            {
+                "entity": "sensor",
+                "dps": [
+                    {
+                        "id": "5",
+                        "name": "sensor",
+                        "type": "integer",
+                        "range": {"min": 0, "max": 86400},
+                        "extrapolate": {"rate": -1},
+                    },
+                ],
+            },
+        )
+        entity.filter_updates = False
+        self.subject._children = [entity]
+        call_later = self.hass().loop.call_later
+
+        # Reported before the entity dps were first needed
+        with patch(
+            "custom_components.tuya_local.helpers.device_config.monotonic",
+            return_value=100,
+        ), patch("custom_components.tuya_local.device.monotonic", return_value=100):
+            self.subject._add_properties_to_pending_updates({"5": 10})
+        self.assertEqual(self.subject.reported_at("5"), 100)
+        call_later.assert_called_once()
+
+        # Rebuilding the entity dps cancels the timer, then starts it again
+        self.subject._entity_dps = None
+        call_later.reset_mock()
+        with patch(
+            "custom_components.tuya_local.helpers.device_config.monotonic",
+            return_value=103.5,
+        ), patch("custom_components.tuya_local.device.monotonic", return_value=103.5):
+            self.subject._get_entity_dps()
+        call_later.return_value.cancel.assert_called_once()
+        delay, _ = call_later.call_args[0]
+        self.assertEqual(delay, 0.5)
+
+    def test_user_options_override_sensor_filters(self):
+        subject = TuyaLocalDevice(
+            "Some name",
+            "some_dev_id",
+            "some.ip.address",
+            "some_local_key",
+            "auto",
+            None,
+            self.hass(),
+            min_update_interval=30,
+            deadband=5,
+        )
+        entity = Mock()
+        entity._config.entity = "sensor"
+        entity._config.dps.return_value = [
+            mock_dp("19", force=False, type=int),
+            mock_dp("20", force=False, type=str),
+        ]
+        subject._children = [entity]
+
+        subject._get_entity_dps()
+        filters = subject._update_filters[entity]._filters
+        self.assertEqual(list(filters), ["19"])
+        self.assertEqual(filters["19"].min_interval, 30)
+        self.assertEqual(filters["19"].deadband, 0.05)
+        self.assertTrue(filters["19"].relative)
+
     async def test_unregister_one_of_many_entities(self):
         # Set up preconditions
         self.subject._children = ["First", "Second"]
@@ -607,6 +1420,118 @@ class TestDevice(IsolatedAsyncioTestCase):
             pass
         self.mock_api().set_socketPersistent.assert_called_once_with(False)
 
+    async def test_async_receive_resyncs_when_connection_lost(self):
+        self.mock_api().receive.return_value = {
+            "Error": "Network Error: Device Unreachable",
+            "Err": "905",
+            "Payload": None,
+        }
+        self.mock_api().status.return_value = {"dps": {"1": "RESYNC"}}
+        self.subject._running = True
+        self.subject._cached_state = {"1": "OLD", "updated_at": time()}
+
+        loop = self.subject.async_receive()
+        result = await loop.__anext__()
+
+        # The full state was fetched straight after the connection dropped
+        self.mock_api().receive.assert_called_once()
+        self.mock_api().status.assert_called_once()
+        self.mock_sleep.assert_any_call(0)
+        self.assertDictEqual(result, {"1": "RESYNC", "full_poll": True})
+        self.assertEqual(self.subject.metrics.reconnects, 1)
+        self.subject._running = False
+        with self.assertRaises(StopAsyncIteration):
+            await loop.__anext__()
+
+    async def test_async_receive_resyncs_full_state_with_forced_dps(self):
+        entity = Mock()
+        entity._config.dps.return_value = [mock_dp("1", force=True, persist=True)]
+        self.subject._children = [entity]
+        self.mock_api().receive.return_value = {
+            "Error": "Network Error: Unable to Connect",
+            "Err": "901",
+            "Payload": None,
+        }
+        self.mock_api().status.return_value = {"dps": {"1": "RESYNC"}}
+        self.subject._running = True
+        self.subject._cached_state = {"1": "OLD", "updated_at": time()}
+
+        loop = self.subject.async_receive()
+        result = await loop.__anext__()
+
+        self.assertEqual(self.subject._force_dps, [1])
+        self.mock_api().status.assert_called_once()
+        self.mock_api().updatedps.assert_not_called()
+        self.assertDictEqual(result, {"1": "RESYNC", "full_poll": True})
+        self.subject._running = False
+        with self.assertRaises(StopAsyncIteration):
+            await loop.__anext__()
+
+    async def test_async_receive_does_not_resync_on_bad_payload(self):
+        self.mock_api().receive.side_effect = [
+            {"Error": "Unexpected Payload from Device", "Err": "904"},
+            {"dps": {"1": "NEW"}},
+        ]
+        self.subject._running = True
+        self.subject._cached_state = {"1": "OLD", "updated_at": time()}
+
+        loop = self.subject.async_receive()
+        result = await loop.__anext__()
+
+        self.mock_api().status.assert_not_called()
+        self.assertDictEqual(result, {"1": "NEW", "full_poll": False})
+        self.assertEqual(self.subject.metrics.reconnects, 0)
+        self.subject._running = False
+        with self.assertRaises(StopAsyncIteration):
+            await loop.__anext__()
+
+    async def test_async_receive_awaits_messages_pushed_by_worker(self):
+        api = AsyncMock(spec=WorkerApi, is_async=True)
+        api.parent = None
+        api.async_receive.return_value = {"dps": {"1": "PUSHED"}}
+        self.subject._api = api
+        self.subject._running = True
+        self.subject._cached_state = {"1": "OLD", "updated_at": time()}
+
+        loop = self.subject.async_receive()
+        result = await loop.__anext__()
+
+        api.listen.assert_called_once()
+        api.async_receive.assert_awaited_once()
+        api.receive.assert_not_called()
+        api.heartbeat.assert_not_called()
+        self.hass().async_add_executor_job.assert_not_called()
+        self.assertDictEqual(result, {"1": "PUSHED", "full_poll": False})
+        self.assertEqual(self.subject.metrics.latency["receive"].count, 1)
+        self.subject._running = False
+        with self.assertRaises(StopAsyncIteration):
+            await loop.__anext__()
+
+    async def test_commands_are_awaited_through_worker(self):
+        api = AsyncMock(spec=WorkerApi, is_async=True)
+        api.parent = None
+        self.subject._api = api
+        self.subject._api_protocol_version_index = 0
+        self.subject._pending_updates = {
+            "1": {"value": True, "updated_at": time(), "sent": False},
+        }
+
+        await self.subject._send_pending_updates()
+
+        api.async_call.assert_awaited_once_with(
+            "set_multiple_values",
+            {"1": True},
+            nowait=True,
+        )
+        self.assertTrue(self.subject._pending_updates["1"]["sent"])
+        self.hass().async_add_executor_job.assert_not_called()
+
+    def test_reconnect_delay_backs_off(self):
+        self.assertEqual(
+            [self.subject._reconnect_delay(n) for n in range(1, 9)],
+            [0, 1, 2, 4, 8, 16, 30, 30],
+        )
+
     def test_should_poll(self):
         self.subject._cached_state = {"1": "sample", "updated_at": time()}
         self.subject._poll_only = False
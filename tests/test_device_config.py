@@ -1,20 +1,26 @@
 """Test the config parser"""
 from fuzzywuzzy import fuzz
+import json
 from unittest import IsolatedAsyncioTestCase
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, Mock, patch
 
+from homeassistant.components.fan import FanEntityFeature
 from homeassistant.components.sensor import SensorDeviceClass
+from homeassistant.exceptions import HomeAssistantError
 
 from custom_components.tuya_local.helpers.config import get_device_id
 from custom_components.tuya_local.helpers.device_config import (
+    _CONFIG_CACHE,
     available_configs,
     get_config,
+    reload_changed_configs,
     _bytes_to_fmt,
     _typematch,
     TuyaDeviceConfig,
     TuyaDpsConfig,
     TuyaEntityConfig,
 )
+from custom_components.tuya_local.fan import TuyaLocalFan
 from custom_components.tuya_local.sensor import TuyaLocalSensor
 
 from .const import (
@@ -255,6 +261,7 @@ class TestDeviceConfig(IsolatedAsyncioTestCase):
                 dp._config.get("name"), f"dp name missing from {e} in {cfg}"
             )
             extra.add(dp.name)
+            self.check_extrapolation(dp, entity, cfg)
 
         expected = KNOWN_DPS.get(entity.entity)
         for rule in expected["required"]:
@@ -295,6 +302,29 @@ class TestDeviceConfig(IsolatedAsyncioTestCase):
                     f"{cfg} {e} has a device class of enum, but has no mapped values",
                 )
 
+    def check_extrapolation(self, dp, entity, cfg):
+        """
+        Check that extrapolated dps have a rate, and somewhere to stop.
+        """
+        model = dp.extrapolation
+        if model is None:
+            return
+        e = entity.config_id
+        self.assertTrue(
+            model.rate or model.travel_time,
+            f"{dp.name} extrapolated without rate or travel_time in {e} in {cfg}",
+        )
+        if model.toward is None:
+            self.assertIsNotNone(
+                dp._config.get("range"),
+                f"{dp.name} extrapolated without range or toward in {e} in {cfg}",
+            )
+        else:
+            self.assertIsNotNone(
+                entity.find_dps(model.toward),
+                f"{dp.name} extrapolated toward missing {model.toward} in {e} in {cfg}",
+            )
+
     def test_config_files_parse(self):
         """
         All configs should be parsable and meet certain criteria
@@ -371,6 +401,122 @@ class TestDeviceConfig(IsolatedAsyncioTestCase):
         cfg = get_config("kogan_switch")
         self.assertEqual(cfg.config, "smartplugv1.yaml")
 
+    def test_config_is_parsed_again_only_when_changed(self):
+        """Test that configs in use are cached until their file changes"""
+        _CONFIG_CACHE.clear()
+        self.addCleanup(_CONFIG_CACHE.clear)
+        first = get_config("smartplugv1")
+        self.assertIs(get_config("smartplugv1")._config, first._config)
+        self.assertEqual(reload_changed_configs(), [])
+
+        with patch(
+            "custom_components.tuya_local.helpers.device_config.getmtime",
+            return_value=0,
+        ):
+            self.assertEqual(reload_changed_configs(), ["smartplugv1"])
+            second = get_config("smartplugv1")
+        self.assertIsNot(second._config, first._config)
+        self.assertEqual(second._config, first._config)
+
+    def test_failed_reload_keeps_previous_config(self):
+        """Test that a config that fails to parse is not replaced"""
+        _CONFIG_CACHE.clear()
+        self.addCleanup(_CONFIG_CACHE.clear)
+        first = get_config("smartplugv1")
+        with patch(
+            "custom_components.tuya_local.helpers.device_config.getmtime",
+            return_value=0,
+        ), patch(
+            "custom_components.tuya_local.helpers.device_config.load_yaml",
+            side_effect=HomeAssistantError("bad yaml"),
+        ):
+            self.assertEqual(reload_changed_configs(), [])
+        self.assertIs(_CONFIG_CACHE["smartplugv1.yaml"][1], first._config)
+
+    def test_find_entity(self):
+        """Test that entities can be found by their config id"""
+        cfg = get_config("kogan_kahtp_heater")
+        self.assertEqual(cfg.find_entity("climate").entity, "climate")
+        self.assertEqual(
+            cfg.find_entity("lock_child_lock").config_id,
+            "lock_child_lock",
+        )
+        self.assertIsNone(cfg.find_entity("sensor_nothing"))
+
+    def test_entity_reload_config(self):
+        """Test that entities take the dps from a changed config"""
+        device = Mock()
+        entity = TuyaLocalSensor(
+            device,
+            get_config("goldair_gpph_heater").find_entity("sensor_power_level"),
+        )
+        changed = TuyaDeviceConfig("goldair_gpph_heater.yaml").find_entity(
+            "sensor_power_level"
+        )
+        self.assertTrue(entity.reload_config(changed))
+        self.assertIs(entity._config, changed)
+        self.assertIs(entity._sensor_dps._entity, changed)
+        for dp in entity._attr_dps:
+            self.assertIs(dp._entity, changed)
+
+    def changed_entity(self, config, config_id, **changes):
+        """Return a changed copy of an entity config, without the cache."""
+        entity = config.find_entity(config_id)
+        return TuyaEntityConfig(
+            entity._device,
+            {**entity._config, **changes},
+            entity._is_primary,
+        )
+
+    def test_entity_reload_config_updates_features(self):
+        """Test that entities take on features added to a changed config"""
+        config = get_config("anko_fan")
+        old = self.changed_entity(
+            config,
+            "fan",
+            dps=[
+                d
+                for d in config.primary_entity._config["dps"]
+                if d["name"] != "oscillate"
+            ],
+        )
+        entity = TuyaLocalFan(Mock(), old)
+        self.assertIsNone(entity._oscillate_dps)
+        self.assertFalse(entity.supported_features & FanEntityFeature.OSCILLATE)
+
+        self.assertTrue(entity.reload_config(config.primary_entity))
+        self.assertEqual(entity._oscillate_dps.name, "oscillate")
+        self.assertTrue(entity.supported_features & FanEntityFeature.OSCILLATE)
+
+    def test_entity_reload_config_fails_for_changed_aggregates(self):
+        """Test that entities with changed aggregates must be recreated"""
+        config = get_config("goldair_gpph_heater")
+        entity = TuyaLocalSensor(Mock(), config.find_entity("sensor_power_level"))
+        changed = self.changed_entity(
+            config,
+            "sensor_power_level",
+            aggregates=[{"type": "mean"}],
+        )
+
+        self.assertFalse(entity.reload_config(changed))
+        self.assertIsNot(entity._config, changed)
+
+    def test_entity_reload_config_keeps_entity_when_config_is_unusable(self):
+        """Test that an entity is unchanged by a config it cannot use"""
+        config = get_config("goldair_gpph_heater")
+        original = config.find_entity("sensor_power_level")
+        entity = TuyaLocalSensor(Mock(), original)
+        sensor_dps = entity._sensor_dps
+        changed = self.changed_entity(
+            config,
+            "sensor_power_level",
+            dps=[d for d in original._config["dps"] if d["name"] != "sensor"],
+        )
+
+        self.assertFalse(entity.reload_config(changed))
+        self.assertIs(entity._config, original)
+        self.assertIs(entity._sensor_dps, sensor_dps)
+
     def test_float_matches_ints(self):
         """Test that the _typematch function matches int values to float dps"""
         self.assertTrue(_typematch(float, 1))
@@ -407,6 +553,7 @@ class TestDeviceConfig(IsolatedAsyncioTestCase):
         mock_entity = MagicMock()
         mock_config = {"id": "1", "name": "test", "type": "base64"}
         mock_device = MagicMock()
+        mock_device.decoded_dps = {}
         mock_device.get_property.return_value = "VGVzdA=="
         cfg = TuyaDpsConfig(mock_entity, mock_config)
         self.assertEqual(
@@ -414,6 +561,91 @@ class TestDeviceConfig(IsolatedAsyncioTestCase):
             bytes("Test", "utf-8"),
         )
 
+    def test_decoding_is_cached(self):
+        """Test that decoded_value only decodes a changed value once."""
+        mock_entity = MagicMock()
+        mock_config = {"id": "1", "name": "test", "type": "base64"}
+        mock_device = MagicMock()
+        mock_device.decoded_dps = {}
+        mock_device.get_property.return_value = "VGVzdA=="
+        cfg = TuyaDpsConfig(mock_entity, mock_config)
+        first = cfg.decoded_value(mock_device)
+        self.assertIs(cfg.decoded_value(mock_device), first)
+        # The cache is kept by the device, so is shared by new dp configs
+        other = TuyaDpsConfig(mock_entity, mock_config)
+        self.assertIs(other.decoded_value(mock_device), first)
+        mock_device.get_property.return_value = "a25vY2sga25vY2s="
+        self.assertEqual(cfg.decoded_value(mock_device), b"knock knock")
+        # The raw string is not kept by the cache
+        for raw, _ in mock_device.decoded_dps.values():
+            self.assertNotIsInstance(raw, str)
+
+    def test_json_field(self):
+        """Test that fields within json dps can be read and set."""
+        mock_entity = MagicMock()
+        mock_config = {
+            "id": "1",
+            "name": "test",
+            "type": "json",
+            "field": "temp",
+            "mapping": [{"scale": 10}],
+        }
+        mock_device = MagicMock()
+        mock_device.decoded_dps = {}
+        mock_device.get_property.return_value = '{"temp":215,"mode":"eco"}'
+        cfg = TuyaDpsConfig(mock_entity, mock_config)
+        self.assertEqual(cfg.get_value(mock_device), 21.5)
+        self.assertEqual(
+            cfg.get_values_to_set(mock_device, 22),
+            {"1": '{"temp":220,"mode":"eco"}'},
+        )
+
+    def test_json_is_parsed_once(self):
+        """Test that json dps are only parsed when the value changes."""
+        mock_entity = MagicMock()
+        mock_device = MagicMock()
+        mock_device.decoded_dps = {}
+        mock_device.get_property.return_value = '{"a":1,"b":2}'
+        cfg = TuyaDpsConfig(
+            mock_entity, {"id": "1", "name": "a", "type": "json", "field": "a"}
+        )
+        other = TuyaDpsConfig(
+            mock_entity, {"id": "1", "name": "b", "type": "json", "field": "b"}
+        )
+        with patch(
+            "custom_components.tuya_local.helpers.device_config.json.loads",
+            wraps=json.loads,
+        ) as loads:
+            first = cfg.decoded_value(mock_device)
+            self.assertEqual(first, {"a": 1, "b": 2})
+            self.assertIs(cfg.decoded_value(mock_device), first)
+            self.assertEqual(cfg.get_value(mock_device), 1)
+            self.assertEqual(other.get_value(mock_device), 2)
+            loads.assert_called_once()
+
+            # A newly set value is not parsed again
+            mock_device.get_property.return_value = cfg.get_values_to_set(
+                mock_device, 3
+            )["1"]
+            self.assertEqual(other.get_value(mock_device), 2)
+            loads.assert_called_once()
+
+    def test_setting_two_json_fields(self):
+        """Test that setting two fields of one json dp keeps both changes."""
+        mock_entity = MagicMock()
+        mock_device = MagicMock()
+        mock_device.decoded_dps = {}
+        mock_device.get_property.return_value = '{"low":18,"high":24,"mode":1}'
+        low = TuyaDpsConfig(
+            mock_entity, {"id": "1", "name": "low", "type": "json", "field": "low"}
+        )
+        high = TuyaDpsConfig(
+            mock_entity, {"id": "1", "name": "high", "type": "json", "field": "high"}
+        )
+        dps_map = low.get_values_to_set(mock_device, 16)
+        dps_map.update(high.get_values_to_set(mock_device, 26, dps_map))
+        self.assertEqual(dps_map, {"1": '{"low":16,"high":26,"mode":1}'})
+
     def test_decoding_unencoded(self):
         """Test that decoded_value returns the raw value when not encoded."""
         mock_entity = MagicMock()
@@ -491,3 +723,114 @@ class TestDeviceConfig(IsolatedAsyncioTestCase):
         mock_config = {"id": "1", "name": "test", "type": "string"}
         cfg = TuyaDpsConfig(mock_entity, mock_config)
         self.assertIsNone(cfg.default)
+
+    def test_countdown_is_extrapolated(self):
+        """Test that a countdown is calculated from the time since reported."""
+        mock_entity = MagicMock()
+        mock_config = {
+            "id": "1",
+            "name": "timer",
+            "type": "integer",
+            "range": {"min": 0, "max": 86400},
+            "extrapolate": {"rate": -1},
+        }
+        mock_device = MagicMock()
+        mock_device.get_property.return_value = 60
+        mock_device.reported_at.return_value = 100
+        cfg = TuyaDpsConfig(mock_entity, mock_config)
+        with patch(
+            "custom_components.tuya_local.helpers.device_config.monotonic",
+            return_value=110.5,
+        ):
+            self.assertEqual(cfg.get_value(mock_device), 50)
+            self.assertEqual(cfg.extrapolate(mock_device, 60), (50, 0.5))
+        with patch(
+            "custom_components.tuya_local.helpers.device_config.monotonic",
+            return_value=200,
+        ):
+            self.assertEqual(cfg.extrapolate(mock_device, 60), (0, None))
+        mock_device.reported_at.assert_called_with("1")
+
+        # Without a report time, the reported value is used as is
+        mock_device.reported_at.return_value = None
+        self.assertEqual(cfg.get_value(mock_device), 60)
+
+    def test_unbounded_extrapolation_is_rejected(self):
+        """Test that extrapolation needs a range or toward to stop at."""
+
+        def entity(extrapolate, **kwargs):
+            return TuyaEntityConfig(
+                MagicMock(),
+                {
+                    "entity": "sensor",
+                    "dps": [
+                        {"id": "1", "name": "target", "type": "integer"},
+                        {
+                            "id": "2",
+                            "name": "sensor",
+                            "type": "integer",
+                            "extrapolate": extrapolate,
+                            **kwargs,
+                        },
+                    ],
+                },
+            )
+
+        for extrapolate, kwargs in (
+            ({"rate": 1}, {}),
+            ({"rate": -1}, {}),
+            ({"travel_time": 10}, {}),
+            ({"rate": 1, "toward": "missing"}, {}),
+            ({}, {"range": {"min": 0, "max": 100}}),
+        ):
+            with self.subTest(extrapolate=extrapolate):
+                e = entity(extrapolate, **kwargs)
+                with self.assertRaises(AssertionError):
+                    self.check_extrapolation(e.find_dps("sensor"), e, "test")
+                # Not extrapolated at runtime either
+                mock_device = MagicMock()
+                mock_device.get_property.return_value = 10
+                mock_device.reported_at.return_value = 0
+                self.assertEqual(
+                    e.find_dps("sensor").extrapolate(mock_device, 10), (10, None)
+                )
+
+        for extrapolate, kwargs in (
+            ({"rate": 1}, {"range": {"min": 0, "max": 100}}),
+            ({"rate": 1, "toward": "target"}, {}),
+        ):
+            with self.subTest(extrapolate=extrapolate):
+                e = entity(extrapolate, **kwargs)
+                self.check_extrapolation(e.find_dps("sensor"), e, "test")
+
+    def test_position_is_extrapolated_toward_target(self):
+        """Test that a position moves toward its target at the travel rate."""
+        entity = TuyaEntityConfig(
+            MagicMock(),
+            {
+                "entity": "cover",
+                "dps": [
+                    {"id": "2", "name": "position", "type": "integer"},
+                    {
+                        "id": "3",
+                        "name": "current_position",
+                        "type": "integer",
+                        "extrapolate": {"travel_time": 20, "toward": "position"},
+                    },
+                ],
+            },
+        )
+        cfg = entity.find_dps("current_position")
+        mock_device = MagicMock()
+        mock_device.get_property.side_effect = {"2": 0, "3": 100}.get
+        mock_device.reported_at.return_value = 100
+        with patch(
+            "custom_components.tuya_local.helpers.device_config.monotonic",
+            return_value=104,
+        ):
+            self.assertEqual(cfg.get_value(mock_device), 80)
+        mock_device.reported_at.assert_called_with("3", "2")
+
+        # Once at the target, it is no longer changing
+        mock_device.get_property.side_effect = {"2": 100, "3": 100}.get
+        self.assertEqual(cfg.extrapolate(mock_device, 100), (100, None))
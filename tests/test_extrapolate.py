@@ -0,0 +1,41 @@
+"""Tests for extrapolation of steadily changing dps"""
+from unittest import TestCase
+
+from custom_components.tuya_local.helpers.extrapolate import (
+    LinearExtrapolation,
+    extrapolate,
+    next_change,
+)
+
+
+class TestExtrapolate(TestCase):
+    def test_extrapolate_in_whole_steps(self):
+        self.assertEqual(extrapolate(10, -1, 0, 3.5), 7)
+        self.assertEqual(extrapolate(10, -1, 0, 30), 0)
+        self.assertEqual(extrapolate(10, 0.1, None, 30), 13)
+        self.assertEqual(extrapolate(0, 5, 100, 30), 100)
+
+    def test_next_change(self):
+        self.assertEqual(next_change(10, -1, 0, 3.5), 0.5)
+        self.assertAlmostEqual(next_change(10, 0.1, 100, 0), 10)
+        self.assertAlmostEqual(next_change(10, 0.1, 100, 10), 10)
+        # Stopped at the limit, or not changing at all
+        self.assertIsNone(next_change(10, -1, 0, 10))
+        self.assertIsNone(next_change(10, 0, 0, 1))
+
+    def test_rate_and_limit(self):
+        countdown = LinearExtrapolation.from_config({"rate": -1})
+        # Without a range or target, there is no telling where it ends
+        self.assertEqual(countdown.rate_and_limit(60, None, None, None), (0, None))
+        self.assertEqual(countdown.rate_and_limit(60, None, 1, 100), (-1, 1))
+
+        rising = LinearExtrapolation(rate=2)
+        self.assertEqual(rising.rate_and_limit(60, None, 0, 100), (2, 100))
+        # Rejected, as it would rise forever
+        self.assertEqual(rising.rate_and_limit(60, None, None, None), (0, None))
+
+        cover = LinearExtrapolation(travel_time=25, toward="position")
+        self.assertEqual(cover.rate_and_limit(100, 0, None, None), (-4, 0))
+        self.assertEqual(cover.rate_and_limit(0, 50, 0, 100), (4, 50))
+        self.assertEqual(cover.rate_and_limit(50, 50, 0, 100), (0, 50))
+        self.assertEqual(cover.rate_and_limit(50, None, 0, 100), (0, None))
@@ -0,0 +1,37 @@
+"""Tests for the device message history"""
+from unittest import TestCase
+
+from custom_components.tuya_local.helpers.history import MessageHistory
+
+
+class TestMessageHistory(TestCase):
+    def test_messages_are_recorded(self):
+        subject = MessageHistory(5)
+        subject.record_call("status", (), {"dps": {"1": True}}, 0.0123)
+        subject.record_call("heartbeat", (), None, 0.001)
+        subject.record_call("set", ({"1": False},), None, 0.002)
+        subject.record_call("receive", (), {"Error": "Timeout"}, 5)
+
+        messages = subject.as_list()
+        self.assertEqual(
+            [(m["direction"], m["call"], m["data"]) for m in messages],
+            [
+                ("received", "status", {"1": True}),
+                ("sent", "set", {"1": False}),
+                ("received", "receive", {"Error": "Timeout"}),
+            ],
+        )
+        self.assertEqual(messages[0]["latency_ms"], 12.3)
+
+    def test_oldest_messages_are_discarded(self):
+        subject = MessageHistory(3)
+        for i in range(7):
+            subject.record("received", "receive", 0, {"1": i})
+
+        self.assertEqual([m["data"]["1"] for m in subject.as_list()], [4, 5, 6])
+
+    def test_history_can_be_disabled(self):
+        subject = MessageHistory(0)
+        subject.record("received", "receive", 0, {"1": True})
+
+        self.assertEqual(subject.as_list(), [])
@@ -0,0 +1,57 @@
+"""Tests for the device metrics"""
+from unittest import TestCase
+
+from custom_components.tuya_local.helpers.metrics import (
+    DeviceMetrics,
+    LatencyHistogram,
+)
+
+
+class TestLatencyHistogram(TestCase):
+    def test_percentiles_use_bucket_bounds(self):
+        subject = LatencyHistogram()
+        for t in [0.001, 0.002, 0.02, 0.03, 0.2]:
+            subject.observe(t)
+
+        self.assertEqual(subject.count, 5)
+        self.assertEqual(subject.percentile(0.5), 0.025)
+        self.assertEqual(subject.percentile(0.95), 0.2)
+        self.assertEqual(subject.as_dict()["max_ms"], 200.0)
+
+    def test_empty_histogram(self):
+        subject = LatencyHistogram()
+        self.assertIsNone(subject.percentile(0.5))
+        self.assertIsNone(subject.as_dict()["mean_ms"])
+
+
+class TestDeviceMetrics(TestCase):
+    def test_call_returns_result(self):
+        subject = DeviceMetrics()
+        self.assertEqual(subject.call("status", lambda: {"dps": {}}), {"dps": {}})
+        self.assertEqual(subject.latency["status"].count, 1)
+        self.assertEqual(subject.failures["status"], 0)
+        self.assertIsNotNone(subject.response_time)
+
+    def test_error_results_are_failures(self):
+        subject = DeviceMetrics()
+        subject.call("status", lambda: {"Error": "Network Error"})
+        self.assertEqual(subject.failures["status"], 1)
+        self.assertIsNone(subject.response_time)
+
+    def test_exceptions_are_failures(self):
+        subject = DeviceMetrics()
+
+        def fail():
+            raise ConnectionError("Broken")
+
+        with self.assertRaises(ConnectionError):
+            subject.call("set", fail)
+        self.assertEqual(subject.failures["set"], 1)
+        self.assertEqual(subject.latency["set"].count, 1)
+
+    def test_as_dict(self):
+        subject = DeviceMetrics()
+        subject.messages_received = 3
+        result = subject.as_dict()
+        self.assertEqual(result["messages_received"], 3)
+        self.assertIn("heartbeat", result["calls"])
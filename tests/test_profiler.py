@@ -0,0 +1,75 @@
+"""Tests for the sampling profiler"""
+from os.path import join
+from types import SimpleNamespace
+from unittest import TestCase
+
+from custom_components.tuya_local.helpers.profiler import _SCOPE, SamplingProfiler
+
+
+def stack(*functions):
+    """Return a fake frame for a stack of (filename, name), outermost first."""
+    frame = None
+    for line, (filename, name) in enumerate(functions):
+        code = SimpleNamespace(
+            co_filename=filename,
+            co_firstlineno=line + 1,
+            co_qualname=name,
+        )
+        frame = SimpleNamespace(f_code=code, f_back=frame)
+    return frame
+
+
+DEVICE = join(_SCOPE, "device.py")
+CONFIG = join(_SCOPE, "helpers", "device_config.py")
+TINYTUYA = "/site-packages/tinytuya/core.py"
+ASYNCIO = "/lib/asyncio/events.py"
+
+
+class TestSamplingProfiler(TestCase):
+    def test_samples_are_attributed(self):
+        subject = SamplingProfiler()
+        for _ in range(3):
+            subject.sample(
+                stack(
+                    (ASYNCIO, "_run"),
+                    (DEVICE, "receive_loop"),
+                    (CONFIG, "get_value"),
+                    (ASYNCIO, "isinstance"),
+                )
+            )
+        subject.sample(stack((ASYNCIO, "_run"), (DEVICE, "receive_loop")))
+        subject.sample(stack((DEVICE, "_call_api"), (TINYTUYA, "status")))
+        subject.sample(stack((ASYNCIO, "_run"), (ASYNCIO, "select")))
+
+        self.assertEqual(subject.samples, 5)
+        self.assertEqual(subject.io_samples, 1)
+        ranked = subject.ranked()
+        self.assertEqual(
+            [subject.describe(f) for f in ranked],
+            [
+                "helpers/device_config.py:3(get_value)",
+                "device.py:2(receive_loop)",
+            ],
+        )
+        self.assertEqual(subject.own[ranked[1]], 1)
+        self.assertEqual(subject.total[ranked[1]], 4)
+        self.assertEqual(subject.ranked("device.py"), [ranked[1]])
+
+    def test_summary(self):
+        subject = SamplingProfiler()
+        subject.sample(stack((DEVICE, "receive_loop"), (CONFIG, "get_value")))
+        summary = subject.summary()
+        self.assertIn("1 samples in Tuya Local code", summary)
+        self.assertIn("100.00%  helpers/device_config.py", summary)
+        self.assertIn(
+            "100.00%  100.00%  helpers/device_config.py:2(get_value)",
+            summary,
+        )
+
+    def test_start_and_stop(self):
+        subject = SamplingProfiler(interval=0.001)
+        subject.start()
+        self.assertTrue(subject.running)
+        subject.stop()
+        self.assertFalse(subject.running)
+        self.assertGreater(subject.duration, 0)
@@ -0,0 +1,52 @@
+"""Tests for the Prometheus metrics export"""
+from unittest.mock import Mock
+
+from custom_components.tuya_local.const import DOMAIN
+from custom_components.tuya_local.helpers.metrics import DeviceMetrics
+from custom_components.tuya_local.prometheus import render_metrics
+
+
+def make_device(running=True, available=True):
+    device = Mock()
+    device._running = running
+    device.has_returned_state = available
+    device.metrics = DeviceMetrics()
+    return device
+
+
+def test_render_metrics_aggregates_devices():
+    first = make_device()
+    first.metrics.call("status", lambda: {"dps": {}})
+    first.metrics.messages_received = 2
+    second = make_device(available=False)
+    second.metrics.call("status", lambda: {"Error": "Network Error"})
+    second.metrics.messages_received = 3
+    second.metrics.detection_time = 1.5
+    second.metrics.command_wait.observe(0.02)
+    hass = Mock(loop=None)
+    hass.data = {
+        DOMAIN: {"first": {"device": first}, "second": {"device": second}},
+    }
+
+    lines = render_metrics(hass).splitlines()
+
+    assert 'tuya_local_devices{state="available"} 1' in lines
+    assert 'tuya_local_devices{state="unavailable"} 1' in lines
+    assert 'tuya_local_call_duration_seconds_count{call="status"} 2' in lines
+    assert 'tuya_local_call_duration_seconds_bucket{call="status",le="+Inf"} 2' in lines
+    assert 'tuya_local_call_failures_total{call="status"} 1' in lines
+    assert "tuya_local_messages_received_total 5" in lines
+    assert 'tuya_local_command_wait_seconds_bucket{le="0.025"} 1' in lines
+    assert "tuya_local_command_wait_seconds_count 1" in lines
+    assert "tuya_local_detection_seconds_sum 1.500000" in lines
+    assert lines[-1] == "# EOF"
+
+
+def test_render_metrics_without_devices():
+    hass = Mock(loop=None)
+    hass.data = {}
+
+    lines = render_metrics(hass).splitlines()
+
+    assert 'tuya_local_devices{state="available"} 0' in lines
+    assert lines[-1] == "# EOF"
@@ -0,0 +1,42 @@
+"""Tests for the scheduling of device I/O"""
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from homeassistant.const import EVENT_HOMEASSISTANT_CLOSE
+import pytest
+
+from custom_components.tuya_local.helpers.scheduler import (
+    DATA_COMMAND_EXECUTOR,
+    CommandTracker,
+    get_command_executor,
+    start_command_executor,
+)
+
+
+class TestCommandTracker(IsolatedAsyncioTestCase):
+    async def test_waits_for_commands_in_flight(self):
+        subject = CommandTracker()
+        await asyncio.wait_for(subject.async_wait_idle(), 1)
+
+        subject.start()
+        subject.start()
+        waiter = asyncio.create_task(subject.async_wait_idle())
+        await asyncio.sleep(0)
+        subject.done()
+        await asyncio.sleep(0)
+        self.assertFalse(waiter.done())
+        subject.done()
+        await asyncio.wait_for(waiter, 1)
+        self.assertEqual(subject.in_flight, 0)
+
+
+@pytest.mark.asyncio
+async def test_command_executor_stops_with_home_assistant(hass):
+    executor = start_command_executor(hass)
+    assert get_command_executor(hass) is executor
+    assert await hass.loop.run_in_executor(executor, lambda: 42) == 42
+
+    hass.bus.async_fire(EVENT_HOMEASSISTANT_CLOSE)
+    await hass.async_block_till_done()
+    assert DATA_COMMAND_EXECUTOR not in hass.data
+    assert executor._shutdown
@@ -1,17 +1,21 @@
 """Tests for the sensor entity."""
 from pytest_homeassistant_custom_component.common import MockConfigEntry
 import pytest
-from unittest.mock import AsyncMock, Mock
+from unittest.mock import AsyncMock, Mock, patch
 
 from custom_components.tuya_local.const import (
     CONF_DEVICE_ID,
+    CONF_METRIC_SENSORS,
     CONF_PROTOCOL_VERSION,
     CONF_TYPE,
+    DATA_OPTIONS,
     DOMAIN,
 )
 from custom_components.tuya_local.helpers.device_config import TuyaEntityConfig
 from custom_components.tuya_local.sensor import (
     async_setup_entry,
+    TuyaLocalAggregateSensor,
+    TuyaLocalMetricSensor,
     TuyaLocalSensor,
 )
 
@@ -67,6 +71,35 @@ async def test_init_entry_fails_if_device_has_no_sensor(hass):
     m_add_entities.assert_not_called()
 
 
+@pytest.mark.asyncio
+async def test_init_entry_adds_metric_sensors(hass):
+    """Test metric sensors are added, even if device has no sensors"""
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        data={
+            CONF_TYPE: "mirabella_genio_usb",
+            CONF_DEVICE_ID: "dummy",
+            CONF_PROTOCOL_VERSION: "auto",
+        },
+    )
+    m_add_entities = Mock()
+    m_device = AsyncMock()
+    m_device.metrics.messages_received = 5
+
+    hass.data[DATA_OPTIONS] = {CONF_METRIC_SENSORS: True}
+    hass.data[DOMAIN] = {
+        "dummy": {"device": m_device},
+    }
+
+    await async_setup_entry(hass, entry, m_add_entities)
+    m_add_entities.assert_called_once()
+    sensors = hass.data[DOMAIN]["dummy"]["metric_sensors"]
+    assert all(type(s) == TuyaLocalMetricSensor for s in sensors)
+    messages = [s for s in sensors if s.name == "Messages received"][0]
+    assert messages.native_value == 5
+    assert not messages.entity_registry_enabled_default
+
+
 @pytest.mark.asyncio
 async def test_init_entry_fails_if_config_is_missing(hass):
     """Test initialisation when device has no matching entity"""
@@ -119,3 +152,76 @@ def test_sensor_suggested_display_precision():
     )
     sensor = TuyaLocalSensor(mock_device, config)
     assert sensor.suggested_display_precision is None
+
+
+def test_aggregate_sensors():
+    mock_device = Mock()
+    mock_device.unique_id = "dummy"
+    dps = {"19": 100}
+    mock_device.get_property.side_effect = lambda id: dps.get(id)
+    config = TuyaEntityConfig(
+        mock_device,
+        {
+            "entity": "sensor",
+            "name": "Power",
+            "class": "power",
+            "dps": [
+                {
+                    "id": 19,
+                    "name": "sensor",
+                    "type": "integer",
+                    "unit": "W",
+                }
+            ],
+            "aggregates": [
+                {"type": "max", "window": 60, "interval": 3600},
+                {"type": "energy", "interval": 3600},
+            ],
+        },
+    )
+    maximum, energy = [
+        TuyaLocalAggregateSensor(mock_device, config, a) for a in config.aggregates
+    ]
+    assert maximum.name == "Power maximum"
+    assert maximum.unique_id == "dummy-sensor_power-max_60"
+    assert maximum.native_unit_of_measurement == "W"
+    assert energy.name == "Energy"
+    assert energy.unique_id == "dummy-sensor_power-energy"
+    assert energy.native_unit_of_measurement == "kWh"
+
+    with patch("custom_components.tuya_local.sensor.monotonic") as m_time, patch(
+        "homeassistant.components.sensor.SensorEntity.async_write_ha_state"
+    ) as m_write:
+        for t, power in ((0, 100), (1800, 300), (3600, 200)):
+            m_time.return_value = t
+            dps["19"] = power
+            maximum.async_write_ha_state()
+            energy.async_write_ha_state()
+        # The sample in the middle of the interval is not written
+        assert m_write.call_count == 4
+        m_time.return_value = 3600
+        assert maximum.native_value == 300
+        assert energy.native_value == 0.2
+
+
+def test_aggregate_sensor_keeps_samples_when_config_reloads():
+    mock_device = Mock()
+    mock_device.get_property.return_value = 100
+    entity_config = {
+        "entity": "sensor",
+        "dps": [{"id": 19, "name": "sensor", "type": "integer", "unit": "W"}],
+        "aggregates": [{"type": "max", "window": 60}],
+    }
+    config = TuyaEntityConfig(mock_device, entity_config)
+    sensor = TuyaLocalAggregateSensor(mock_device, config, config.aggregates[0])
+    with patch("custom_components.tuya_local.sensor.monotonic", return_value=0):
+        sensor._sample()
+
+    changed = TuyaEntityConfig(
+        mock_device,
+        {**entity_config, "name": "Power"},
+    )
+    assert sensor.reload_config(changed)
+    assert sensor.name == "Power maximum"
+    with patch("custom_components.tuya_local.sensor.monotonic", return_value=1):
+        assert sensor.native_value == 100
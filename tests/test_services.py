@@ -0,0 +1,236 @@
+"""Tests for the integration services"""
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+from pytest_homeassistant_custom_component.common import MockConfigEntry
+
+from custom_components.tuya_local.const import CONF_DEVICE_ID, DOMAIN
+from custom_components.tuya_local.helpers.trace import get_tracer
+from custom_components.tuya_local.services import (
+    async_set_dps,
+    async_setup_services,
+)
+
+
+@pytest.mark.asyncio
+async def test_trace_services(hass):
+    await async_setup_services(hass)
+
+    await hass.services.async_call(
+        DOMAIN,
+        "start_trace",
+        {"max_events": 1000},
+        blocking=True,
+    )
+    tracer = get_tracer()
+    assert tracer is not None
+
+    with patch.object(tracer, "export") as m_export:
+        await hass.services.async_call(DOMAIN, "stop_trace", {}, blocking=True)
+        m_export.assert_called_once()
+        assert m_export.call_args[0][0].startswith(hass.config.path("tuya_local_trace"))
+    assert get_tracer() is None
+
+
+@pytest.mark.asyncio
+async def test_profile_service(hass):
+    await async_setup_services(hass)
+
+    with patch(
+        "custom_components.tuya_local.services.SamplingProfiler.export"
+    ) as m_export:
+        await hass.services.async_call(
+            DOMAIN,
+            "profile",
+            {"duration": 1},
+            blocking=True,
+        )
+        m_export.assert_called_once()
+        assert m_export.call_args[0][0].startswith(
+            hass.config.path("tuya_local_profile")
+        )
+
+
+@pytest.mark.asyncio
+async def test_capture_services(hass):
+    await async_setup_services(hass)
+    first = Mock(async_start_capture=AsyncMock(), async_stop_capture=AsyncMock())
+    second = Mock(async_start_capture=AsyncMock(), async_stop_capture=AsyncMock())
+    second.async_stop_capture.return_value = None
+    hass.data[DOMAIN] = {"first": {"device": first}, "second": {"device": second}}
+
+    await hass.services.async_call(
+        DOMAIN,
+        "start_capture",
+        {"device_id": "first", "max_size": 100},
+        blocking=True,
+    )
+    first.async_start_capture.assert_awaited_once()
+    path, max_bytes = first.async_start_capture.call_args[0]
+    assert path.startswith(hass.config.path("tuya_local_capture_first"))
+    assert max_bytes == 102400
+    second.async_start_capture.assert_not_awaited()
+
+    await hass.services.async_call(DOMAIN, "stop_capture", {}, blocking=True)
+    first.async_stop_capture.assert_awaited_once()
+    second.async_stop_capture.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_import_devices_service(hass):
+    await async_setup_services(hass)
+    devices = [{"name": "test"}]
+    results = [{"name": "test", "device_id": "id", "result": "no response"}]
+
+    with patch(
+        "custom_components.tuya_local.services.load_devices",
+        return_value=devices,
+    ) as m_load, patch(
+        "custom_components.tuya_local.services.async_import_devices",
+        return_value=results,
+    ) as m_import, patch(
+        "custom_components.tuya_local.services._write_json"
+    ) as m_write:
+        await hass.services.async_call(
+            DOMAIN,
+            "import_devices",
+            {"path": "snapshot.json", "concurrency": 5},
+            blocking=True,
+        )
+    m_load.assert_called_once_with(hass.config.path("snapshot.json"))
+    m_import.assert_awaited_once_with(hass, devices, 5)
+    m_write.assert_called_once()
+    assert m_write.call_args[0][1] == results
+
+
+@pytest.mark.asyncio
+async def test_reload_device_configs_service(hass):
+    await async_setup_services(hass)
+    device = Mock(reload_entity_configs=Mock(return_value=(2, False)))
+    hass.data[DOMAIN] = {"first": {"device": device}}
+    config = Mock()
+
+    with patch(
+        "custom_components.tuya_local.services.reload_changed_configs",
+        return_value=["smartplugv1"],
+    ), patch(
+        "custom_components.tuya_local.services.get_config",
+        return_value=config,
+    ) as m_get:
+        await hass.services.async_call(
+            DOMAIN,
+            "reload_device_configs",
+            {},
+            blocking=True,
+        )
+    m_get.assert_called_once_with("smartplugv1")
+    device.reload_entity_configs.assert_called_once_with({"smartplugv1": config})
+
+
+@pytest.mark.asyncio
+async def test_reload_device_configs_reloads_entries_that_need_it(hass):
+    await async_setup_services(hass)
+    device = Mock(reload_entity_configs=Mock(return_value=(1, True)))
+    hass.data[DOMAIN] = {"first": {"device": device}}
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        data={CONF_DEVICE_ID: "first"},
+        options={},
+    )
+    entry.add_to_hass(hass)
+    other = MockConfigEntry(
+        domain=DOMAIN,
+        data={CONF_DEVICE_ID: "second"},
+        options={},
+    )
+    other.add_to_hass(hass)
+
+    with patch(
+        "custom_components.tuya_local.services.reload_changed_configs",
+        return_value=[],
+    ), patch.object(
+        hass.config_entries,
+        "async_reload",
+        AsyncMock(),
+    ) as m_reload:
+        await hass.services.async_call(
+            DOMAIN,
+            "reload_device_configs",
+            {},
+            blocking=True,
+        )
+    m_reload.assert_awaited_once_with(entry.entry_id)
+
+
+@pytest.mark.asyncio
+async def test_set_dps_combines_commands_per_device(hass):
+    first = Mock(async_send_properties=AsyncMock(return_value=True))
+    second = Mock(async_send_properties=AsyncMock(return_value=False))
+    hass.data[DOMAIN] = {"first": {"device": first}, "second": {"device": second}}
+
+    results = await async_set_dps(
+        hass,
+        [
+            {"device_id": "first", "dps": {"1": True, "2": 20}},
+            {"device_id": "second", "dps": {"1": False}},
+            {"device_id": "first", "dps": {"2": 25}},
+            {"device_id": "missing", "dps": {"1": False}},
+        ],
+        2,
+    )
+    first.async_send_properties.assert_awaited_once_with({"1": True, "2": 25})
+    second.async_send_properties.assert_awaited_once_with({"1": False})
+    assert [(r["device_id"], r["success"]) for r in results] == [
+        ("first", True),
+        ("second", False),
+        ("missing", False),
+    ]
+    assert results[0]["latency_ms"] >= 0
+    assert results[1]["error"] == "not sent"
+    assert results[2]["error"] == "unknown device"
+
+
+@pytest.mark.asyncio
+async def test_set_dps_limits_parallelism(hass):
+    sending = 0
+    most = 0
+
+    async def send(dps):
+        nonlocal sending, most
+        sending += 1
+        most = max(most, sending)
+        await asyncio.sleep(0.01)
+        sending -= 1
+        return True
+
+    hass.data[DOMAIN] = {
+        f"dev{i}": {"device": Mock(async_send_properties=send)} for i in range(10)
+    }
+    results = await async_set_dps(
+        hass,
+        [{"device_id": f"dev{i}", "dps": {"1": True}} for i in range(10)],
+        3,
+    )
+    assert all(r["success"] for r in results)
+    assert most == 3
+
+
+@pytest.mark.asyncio
+async def test_set_dps_service_fires_result_event(hass):
+    await async_setup_services(hass)
+    device = Mock(async_send_properties=AsyncMock(return_value=True))
+    hass.data[DOMAIN] = {"first": {"device": device}}
+    events = []
+    hass.bus.async_listen("tuya_local_set_dps_result", events.append)
+
+    await hass.services.async_call(
+        DOMAIN,
+        "set_dps",
+        {"commands": [{"device_id": "first", "dps": {"1": True}}]},
+        blocking=True,
+    )
+    await hass.async_block_till_done()
+    device.async_send_properties.assert_awaited_once_with({"1": True})
+    assert len(events) == 1
+    assert events[0].data["results"][0]["success"]
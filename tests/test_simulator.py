@@ -0,0 +1,66 @@
+"""Smoke tests of TuyaLocalDevice against simulated devices"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest import IsolatedAsyncioTestCase
+
+import pytest
+
+from custom_components.tuya_local.device import TuyaLocalDevice
+from custom_components.tuya_local.helpers.device_config import get_config
+from util.benchmark import BenchmarkEntity, BenchmarkHass
+from util.simulator import VERSIONS, FakeDevice
+
+
+@pytest.mark.enable_socket
+class TestSimulator(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        executor = ThreadPoolExecutor(4)
+        self.addCleanup(executor.shutdown)
+        self.hass = BenchmarkHass(asyncio.get_running_loop(), executor)
+        # Calls are made by the tests, so keep the receive loop from
+        # making its own calls on the same connection.
+        self.hass.is_running = False
+
+    async def test_status_and_set_round_trip(self):
+        config = get_config("simple_switch")
+        # Only 127.0.0.1 can be connected to in tests, so only one device
+        # can be simulated at a time on the standard port.
+        for version in VERSIONS:
+            with self.subTest(version=version):
+                fake = FakeDevice(
+                    config,
+                    "simtest0123456789",
+                    "0123456789abcdef",
+                    version,
+                )
+                await fake.start()
+                try:
+                    device = TuyaLocalDevice(
+                        "Simulated",
+                        fake.id,
+                        fake.host,
+                        fake.local_key,
+                        version,
+                        None,
+                        self.hass,
+                    )
+                    entity = BenchmarkEntity(device, config.primary_entity)
+                    device.register_entity(entity)
+
+                    await device.async_refresh()
+                    self.assertTrue(device.has_returned_state)
+                    self.assertEqual(device.get_property("1"), fake.dps["1"])
+
+                    value = not fake.dps["1"]
+                    await device.async_set_property("1", value)
+                    self.assertEqual(fake.commands[-1][1], {"1": value})
+                    self.assertEqual(fake.dps["1"], value)
+
+                    device._reset_cached_state()
+                    await device.async_refresh()
+                    self.assertEqual(device.get_property("1"), value)
+                    self.assertGreater(entity.writes, 1)
+                finally:
+                    await device.async_stop()
+                    await device.async_close_connection()
+                    await fake.stop()
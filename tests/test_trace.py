@@ -0,0 +1,53 @@
+"""Tests for the device tracer"""
+from unittest import TestCase
+
+from custom_components.tuya_local.helpers.trace import (
+    QUEUE_TRACK,
+    Tracer,
+    get_tracer,
+    start_tracing,
+    stop_tracing,
+    trace_span,
+)
+
+
+class TestTracer(TestCase):
+    def tearDown(self):
+        stop_tracing()
+
+    def test_spans_are_recorded(self):
+        subject = Tracer()
+        with subject.span("status", "socket", "Device", {"dp": "1"}):
+            pass
+        subject.add("queue wait", "queue", "Other", 1.0, 1.5, track=QUEUE_TRACK)
+
+        events = subject.as_dict()["traceEvents"]
+        spans = [e for e in events if e["ph"] == "X"]
+        self.assertEqual([s["name"] for s in spans], ["status", "queue wait"])
+        self.assertEqual(spans[0]["args"], {"dp": "1"})
+        self.assertEqual(spans[1]["dur"], 500000)
+        self.assertEqual(spans[1]["tid"], QUEUE_TRACK)
+        self.assertNotEqual(spans[0]["pid"], spans[1]["pid"])
+        names = [e["args"]["name"] for e in events if e["name"] == "process_name"]
+        self.assertEqual(names, ["Device", "Other"])
+
+    def test_events_are_bounded(self):
+        subject = Tracer(max_events=2)
+        for i in range(5):
+            subject.add(f"span {i}", "test", "Device", i, i + 1)
+
+        spans = [e for e in subject.as_dict()["traceEvents"] if e["ph"] == "X"]
+        self.assertEqual([s["name"] for s in spans], ["span 3", "span 4"])
+
+    def test_tracing_is_off_by_default(self):
+        self.assertIsNone(get_tracer())
+        with trace_span("status", "socket", "Device"):
+            pass
+
+    def test_start_and_stop(self):
+        tracer = start_tracing(100)
+        with trace_span("status", "socket", "Device"):
+            pass
+        self.assertIs(stop_tracing(), tracer)
+        self.assertIsNone(get_tracer())
+        self.assertEqual(len(tracer._events), 1)
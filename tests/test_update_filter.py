@@ -0,0 +1,67 @@
+"""Tests for filtering of entity state writes"""
+from unittest import TestCase
+from unittest.mock import Mock
+
+from custom_components.tuya_local.helpers.update_filter import (
+    DpFilter,
+    EntityUpdateFilter,
+    parse_deadband,
+)
+
+
+class FakeDevice:
+    def __init__(self, dps):
+        self.dps = dps
+
+
+def dp(id):
+    return Mock(id=id, get_value=lambda device: device.dps.get(id))
+
+
+class TestUpdateFilter(TestCase):
+    def test_parse_deadband(self):
+        self.assertEqual(parse_deadband(None), (None, False))
+        self.assertEqual(parse_deadband(5), (5.0, False))
+        self.assertEqual(parse_deadband("2%"), (0.02, True))
+
+    def test_within_deadband(self):
+        absolute = DpFilter(dp("1"), deadband=5)
+        self.assertTrue(absolute.within_deadband(104, 100))
+        self.assertFalse(absolute.within_deadband(106, 100))
+        self.assertFalse(absolute.within_deadband(None, 100))
+
+        relative = DpFilter(dp("1"), deadband="10%")
+        self.assertTrue(relative.within_deadband(1050, 1000))
+        self.assertFalse(relative.within_deadband(120, 100))
+
+        none = DpFilter(dp("1"), min_interval=10)
+        self.assertTrue(none.within_deadband(True, True))
+        self.assertFalse(none.within_deadband(101, 100))
+
+    def test_changes_are_delayed_until_interval(self):
+        device = FakeDevice({"1": 100, "2": True})
+        subject = EntityUpdateFilter([DpFilter(dp("1"), 10, 5)])
+
+        # The first change is always written
+        self.assertEqual(subject.delay(device, {"1"}, 0), 0)
+        subject.written(device, 0)
+
+        # Changes within the deadband are ignored
+        device.dps["1"] = 103
+        self.assertIsNone(subject.delay(device, {"1"}, 1))
+
+        # Larger changes are delayed until the interval has passed
+        device.dps["1"] = 110
+        self.assertEqual(subject.delay(device, {"1"}, 4), 6)
+        self.assertEqual(subject.delay(device, {"1"}, 10), 0)
+
+        # Changes to unfiltered dps are written immediately
+        self.assertEqual(subject.delay(device, {"1", "2"}, 4), 0)
+
+    def test_written_cancels_timer(self):
+        subject = EntityUpdateFilter([])
+        timer = Mock()
+        subject.timer = timer
+        subject.written(FakeDevice({}), 0)
+        timer.cancel.assert_called_once()
+        self.assertIsNone(subject.timer)
@@ -0,0 +1,211 @@
+"""Tests for the worker process connection"""
+import asyncio
+from multiprocessing import Pipe
+from threading import Thread
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+import pytest
+
+from custom_components.tuya_local.helpers.device_config import get_config
+from custom_components.tuya_local.worker import (
+    serve,
+    Worker,
+    WorkerApi,
+    WorkerError,
+)
+from util.simulator import FakeDevice
+
+
+def start_worker(test):
+    """
+    Run the worker loop in a thread instead of a separate process, so
+    tinytuya can be mocked.
+    """
+    worker = Worker()
+    req_recv, worker._requests = Pipe(duplex=False)
+    worker._responses, resp_send = Pipe(duplex=False)
+    worker._process = Thread(
+        target=serve,
+        args=(req_recv, resp_send),
+        daemon=True,
+    )
+    worker._process.start()
+    worker.attach(asyncio.get_running_loop())
+    test.addCleanup(worker.stop)
+    test.addCleanup(worker.detach)
+    return worker
+
+
+class TestWorker(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        device_patcher = patch("tinytuya.Device")
+        self.addCleanup(device_patcher.stop)
+        self.mock_api = device_patcher.start()
+        self.mock_api().dev_type = "default"
+        self.mock_api().dps_cache = {}
+        self.mock_api().set_version.return_value = None
+        self.mock_api().receive.return_value = None
+        self.worker = start_worker(self)
+
+    async def test_calls_are_made_in_the_worker(self):
+        self.mock_api().status.return_value = {"dps": {"1": True}}
+        subject = WorkerApi(self.worker, "dev_id", "host", "key")
+
+        self.assertTrue(subject.is_async)
+        self.assertEqual(await subject.async_call("status"), {"dps": {"1": True}})
+        self.mock_api.assert_called_with("dev_id", "host", "key")
+        self.assertIsNone(subject._local)
+
+    async def test_calls_can_be_made_from_other_threads(self):
+        self.mock_api().status.return_value = {"dps": {"1": True}}
+        subject = WorkerApi(self.worker, "dev_id", "host", "key")
+
+        self.assertEqual(
+            await asyncio.to_thread(subject.status),
+            {"dps": {"1": True}},
+        )
+        self.assertIsNone(subject._local)
+
+    async def test_settings_are_applied_in_the_worker(self):
+        subject = WorkerApi(self.worker, "dev_id", "host", "key")
+        subject.set_socketPersistent(True)
+        await asyncio.to_thread(subject.set_version, 3.4)
+
+        self.mock_api().set_socketPersistent.assert_called_once_with(True)
+        self.mock_api().set_version.assert_called_once_with(3.4)
+        self.assertEqual(subject.version, 3.4)
+
+    async def test_side_effects_are_returned(self):
+        def detect():
+            self.mock_api().dev_type = "device22"
+            return {"dps": {}}
+
+        self.mock_api().status.side_effect = detect
+        subject = WorkerApi(self.worker, "dev_id", "host", "key")
+        await subject.async_call("status")
+
+        self.assertEqual(subject.dev_type, "device22")
+
+    async def test_errors_are_raised(self):
+        self.mock_api().status.side_effect = ConnectionError("Broken")
+        subject = WorkerApi(self.worker, "dev_id", "host", "key")
+
+        with self.assertRaises(WorkerError):
+            await subject.async_call("status")
+
+    async def test_received_messages_are_pushed(self):
+        self.mock_api().receive.side_effect = [{"dps": {"1": True}}, None]
+        subject = WorkerApi(self.worker, "dev_id", "host", "key")
+        subject.set_socketPersistent(True)
+        subject.listen()
+
+        self.assertEqual(await subject.async_receive(5), {"dps": {"1": True}})
+        self.mock_api().heartbeat.assert_called_with(nowait=True)
+
+    async def test_receive_times_out_without_messages(self):
+        subject = WorkerApi(self.worker, "dev_id", "host", "key")
+        subject.set_socketPersistent(True)
+        subject.listen()
+
+        self.assertIsNone(await subject.async_receive(0.1))
+
+    async def test_receive_fails_when_the_worker_stops(self):
+        subject = WorkerApi(self.worker, "dev_id", "host", "key")
+        subject.set_socketPersistent(True)
+        subject.listen()
+        self.worker.detach()
+
+        with self.assertRaises(WorkerError):
+            await subject.async_receive(5)
+        self.assertFalse(subject.is_async)
+
+    async def test_closing_releases_the_device(self):
+        self.mock_api().status.return_value = {"dps": {"1": True}}
+        subject = WorkerApi(self.worker, "dev_id", "host", "key")
+        handle = subject._handle
+        await subject.async_call("status")
+        subject.set_socketPersistent(True)
+        subject.listen()
+
+        subject.close()
+        self.assertIsNone(subject._handle)
+        self.assertNotIn(handle, self.worker._listeners)
+        # The device is removed from the worker in the background
+        for _ in range(50):
+            try:
+                await self.worker.async_call(handle, "status")
+            except WorkerError as e:
+                self.assertIn("KeyError", str(e))
+                break
+            await asyncio.sleep(0.01)
+        else:
+            self.fail("device was not removed from the worker")
+        self.mock_api().close.assert_called_once()
+
+    async def test_falls_back_to_local_connection(self):
+        subject = WorkerApi(self.worker, "dev_id", "host", "key")
+        subject.set_socketRetryLimit(1)
+        self.worker.detach()
+        await asyncio.to_thread(self.worker.stop)
+        self.mock_api.reset_mock()
+        self.mock_api().status.return_value = {"dps": {"1": False}}
+
+        self.assertEqual(subject.status(), {"dps": {"1": False}})
+        # Was a local device created with the same settings?
+        self.assertIs(subject._local, self.mock_api())
+        self.mock_api().set_socketRetryLimit.assert_called_once_with(1)
+
+
+@pytest.mark.enable_socket
+class TestWorkerWithSimulator(IsolatedAsyncioTestCase):
+    """Tests against simulated devices, using the real tinytuya."""
+
+    async def asyncSetUp(self):
+        self.worker = start_worker(self)
+
+    async def connect(self, version):
+        # Only 127.0.0.1 can be connected to in tests, so only one device
+        # can be simulated at a time on the standard port.
+        device = FakeDevice(
+            get_config("simple_switch"),
+            "simworker0123456789",
+            "0123456789abcdef",
+            version,
+        )
+        await device.start()
+        self.addAsyncCleanup(device.stop)
+        api = WorkerApi(self.worker, device.id, device.host, device.local_key)
+        api.set_socketRetryLimit(1)
+        await asyncio.to_thread(api.set_version, version)
+        return device, api
+
+    async def test_status_and_set(self):
+        for version in (3.1, 3.3, 3.4, 3.5):
+            with self.subTest(version=version):
+                device, api = await self.connect(version)
+                status = await api.async_call("status")
+                self.assertEqual(status["dps"], device.dps)
+
+                await api.async_call(
+                    "set_multiple_values",
+                    {"1": not device.dps["1"]},
+                )
+                self.assertEqual(device.commands[-1][1], {"1": not status["dps"]["1"]})
+                api.set_socketPersistent(False)
+                await device.stop()
+
+    async def test_changes_are_pushed(self):
+        device, api = await self.connect(3.4)
+        await api.async_call("status")
+        api.set_socketPersistent(True)
+        api.listen()
+        await asyncio.sleep(0.2)
+
+        device.update({"1": not device.dps["1"]})
+        for _ in range(3):
+            received = await api.async_receive(5)
+            if received and "dps" in received:
+                break
+        self.assertEqual(received["dps"], {"1": device.dps["1"]})
+        api.set_socketPersistent(False)
@@ -0,0 +1,366 @@
+"""
+Benchmark TuyaLocalDevice against a fleet of simulated devices.
+
+The simulated devices run in a separate process, so they do not compete for
+the event loop being measured.  Run from the top level of the repository:
+
+    python -m util.benchmark --count 500 --version 3.3,3.4 simple_switch
+
+Reports, as JSON:
+    loop_lag_ms: how late the event loop runs callbacks that are due.
+    executor: how many executor threads are busy, and how long jobs wait
+        for a free thread.
+    availability_s: time from starting until devices have returned state.
+    command_latency_ms: time from setting a dp until the device reports
+        the new value back.
+    memory_per_device_kb: growth in resident memory per device.
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import sys
+from threading import Lock
+import time
+
+from custom_components.tuya_local.device import TuyaLocalDevice
+from custom_components.tuya_local.worker import Worker
+
+from util.simulator import TUYA_PORT, create_devices, run
+
+# Home Assistant's default executor size
+EXECUTOR_THREADS = 64
+SAMPLE_INTERVAL = 0.1
+
+
+class BenchmarkExecutor(ThreadPoolExecutor):
+    """An executor that records how busy it is."""
+
+    def __init__(self, max_workers):
+        super().__init__(max_workers, "benchmark")
+        self.busy = 0
+        self.waits = []
+        self._stats_lock = Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        queued = time.monotonic()
+
+        def job():
+            with self._stats_lock:
+                self.busy += 1
+                self.waits.append(time.monotonic() - queued)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self.busy -= 1
+
+        return super().submit(job)
+
+
+class _Bus:
+    def async_listen_once(self, event_type, listener):
+        return lambda: None
+
+
+class BenchmarkHass:
+    """The parts of HomeAssistant used by TuyaLocalDevice."""
+
+    def __init__(self, loop, executor):
+        self.loop = loop
+        self.executor = executor
+        self.data = {}
+        self.bus = _Bus()
+        self.is_running = True
+        self.is_stopping = False
+
+    def async_add_executor_job(self, target, *args):
+        return self.loop.run_in_executor(self.executor, target, *args)
+
+    def async_create_task(self, target):
+        return self.loop.create_task(target)
+
+
+class BenchmarkEntity:
+    """An entity that reads its dps whenever its state is written."""
+
+    def __init__(self, device, config):
+        self._device = device
+        self._config = config
+        self.writes = 0
+
+    def async_write_ha_state(self):
+        self.writes += 1
+        for dp in self._config.dps():
+            dp.get_value(self._device)
+
+    def async_schedule_update_ha_state(self, force_refresh=False):
+        self.async_write_ha_state()
+
+
+def _stats(values, scale=1):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values) * scale, 3),
+        "p50": round(values[len(values) // 2] * scale, 3),
+        "p95": round(values[int(len(values) * 0.95)] * scale, 3),
+        "max": round(values[-1] * scale, 3),
+    }
+
+
+def _rss():
+    """Return the resident memory of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def _simulate(args, ready):
+    _raise_file_limit()
+    devices = create_devices(**args)
+    try:
+        asyncio.run(run(devices, ready.set))
+    except KeyboardInterrupt:
+        pass
+
+
+class Benchmark:
+    def __init__(self, fakes, threads, host=None, worker=None):
+        self.loop = asyncio.get_running_loop()
+        self.executor = BenchmarkExecutor(threads)
+        self.hass = BenchmarkHass(self.loop, self.executor)
+        self.fakes = fakes
+        self.host = host
+        self.worker = worker
+        self.devices = []
+        self.entities = []
+        self.lag = []
+        self.busy = []
+        self.queued = []
+        self._sampling = True
+
+    async def sample(self):
+        """Sample event loop lag and executor use until stopped."""
+        while self._sampling:
+            due = self.loop.time() + SAMPLE_INTERVAL
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            self.lag.append(self.loop.time() - due)
+            self.busy.append(self.executor.busy)
+            self.queued.append(self.executor._work_queue.qsize())
+
+    def create_devices(self):
+        for fake in self.fakes:
+            device = TuyaLocalDevice(
+                fake.info()["name"],
+                fake.id,
+                self.host or fake.host,
+                fake.local_key,
+                fake.version,
+                None,
+                self.hass,
+                worker=self.worker,
+            )
+            if self.host:
+                device._api.port = fake.port
+            config = fake.config
+            entities = [config.primary_entity] + list(config.secondary_entities())
+            for entity in entities:
+                self.entities.append(BenchmarkEntity(device, entity))
+                device.register_entity(self.entities[-1])
+            self.devices.append(device)
+
+    async def wait_available(self, start, timeout):
+        times = {}
+        while len(times) < len(self.devices) and time.monotonic() - start < timeout:
+            for device in self.devices:
+                if device not in times and device.has_returned_state:
+                    times[device] = time.monotonic() - start
+            await asyncio.sleep(SAMPLE_INTERVAL)
+        return list(times.values())
+
+    async def command(self, device, dp):
+        value = not device._cached_state.get(dp, False)
+        start = time.monotonic()
+        await device.async_set_property(dp, value)
+        while time.monotonic() - start < 10:
+            if device._cached_state.get(dp) == value:
+                return time.monotonic() - start
+            await asyncio.sleep(0.005)
+
+    async def send_commands(self, count, duration, rnd):
+        targets = []
+        for device, fake in zip(self.devices, self.fakes):
+            config = fake.config
+            for entity in [config.primary_entity] + list(config.secondary_entities()):
+                for dp in entity.dps():
+                    if dp.rawtype == "boolean" and not dp.readonly:
+                        targets.append((device, dp.id))
+        tasks = []
+        for _ in range(count if targets else 0):
+            await asyncio.sleep(duration / count)
+            tasks.append(asyncio.create_task(self.command(*rnd.choice(targets))))
+        if not tasks:
+            await asyncio.sleep(duration)
+        return await asyncio.gather(*tasks)
+
+    async def stop(self):
+        self._sampling = False
+        await asyncio.gather(*(d.async_stop() for d in self.devices))
+        self.executor.shutdown()
+
+
+async def benchmark(args, fakes, worker):
+    rss_before = _rss()
+    bench = Benchmark(fakes, args.threads, args.host, worker)
+    if worker:
+        worker.attach(bench.loop)
+    sampler = asyncio.create_task(bench.sample())
+
+    start = time.monotonic()
+    bench.create_devices()
+    available = await bench.wait_available(start, args.timeout)
+    memory = (_rss() - rss_before) / len(fakes) / 1024
+    startup_lag = bench.lag
+    bench.lag = []
+
+    latencies = await bench.send_commands(
+        args.commands,
+        args.duration,
+        random.Random(args.seed),
+    )
+    await bench.stop()
+    await sampler
+    if worker:
+        worker.detach()
+
+    return {
+        "devices": len(fakes),
+        "versions": args.version,
+        "configs": args.configs,
+        "worker_process": worker is not None,
+        "executor_threads": args.threads,
+        "available": len(available),
+        "availability_s": _stats(available),
+        "loop_lag_ms": {
+            "startup": _stats(startup_lag, 1000),
+            "steady": _stats(bench.lag, 1000),
+        },
+        "executor": {
+            "busy_threads": _stats(bench.busy),
+            "queued_jobs": _stats(bench.queued),
+            "queue_wait_ms": _stats(bench.executor.waits, 1000),
+        },
+        "command_latency_ms": _stats([t for t in latencies if t is not None], 1000),
+        "commands_failed": sum(1 for t in latencies if t is None),
+        "memory_per_device_kb": round(memory, 1),
+        "entity_writes": sum(e.writes for e in bench.entities),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("configs", nargs="+", help="device config names")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument(
+        "--version",
+        default="3.3",
+        help="comma separated protocol versions to cycle through",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0.1,
+        help="changes per second to readonly dps of each device",
+    )
+    parser.add_argument(
+        "--host",
+        help="run devices on consecutive ports of host rather than "
+        "separate loopback addresses",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=TUYA_PORT,
+        help="the first of the consecutive ports used with --host",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=30,
+        help="seconds to measure for after devices are available",
+    )
+    parser.add_argument("--commands", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--threads", type=int, default=EXECUTOR_THREADS)
+    parser.add_argument("--worker", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the results to")
+    args = parser.parse_args()
+
+    if args.worker and args.host:
+        parser.error("--worker requires devices on separate addresses")
+    if args.port != TUYA_PORT and not args.host:
+        # Devices are connected to on the standard port, unless they share
+        # a host and so need a port each.
+        parser.error(
+            f"--port requires --host, devices on separate addresses use {TUYA_PORT}"
+        )
+
+    logging.basicConfig(level=logging.ERROR)
+    _raise_file_limit()
+
+    sim_args = {
+        "config_types": args.configs,
+        "count": args.count,
+        "versions": [float(v) for v in args.version.split(",")],
+        "rate": args.rate,
+        "seed": args.seed,
+        "host": args.host,
+        "port": args.port,
+    }
+    fakes = create_devices(**sim_args)
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Event()
+    simulator = ctx.Process(target=_simulate, args=(sim_args, ready), daemon=True)
+    simulator.start()
+    worker = None
+    try:
+        if not ready.wait(60):
+            print("Simulator failed to start", file=sys.stderr)
+            return 1
+        if args.worker:
+            worker = Worker()
+            worker.start()
+        results = asyncio.run(benchmark(args, fakes, worker))
+    finally:
+        if worker:
+            worker.stop()
+        simulator.terminate()
+        simulator.join()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+Time the device config operations used on every state update.
+
+For every config in devices/, representative dps are generated from the
+mappings and ranges in the config, then get_value, get_values_to_set,
+values, range, icon and match_quality are timed against them.  Run from the
+top level of the repository:
+
+    python -m util.config_benchmark --output results.json
+    python -m util.config_benchmark --baseline results.json
+    python -m util.config_benchmark --compare
+
+Results are in microseconds per call, totalled per config and per
+platform.  When a baseline is given, any config, platform or operation that
+has become slower by more than the threshold is listed, and the exit status
+is 1.  --compare uses the baseline stored in the repository, which can be
+updated with --output util/config_benchmark_baseline.json.  A fixed
+workload is timed along with the results, and baseline timings are scaled
+by how much faster or slower it ran, so baselines from other machines can
+be compared against.
+
+Errors raised by the operations are reported separately, as they usually
+point to a problem in the config.  Operations that fail are left out of the
+timings, and configs with failures are left out of the platform and
+operation totals, so that the totals stay comparable between runs.
+"""
+import argparse
+import json
+from os.path import dirname, join
+import random
+import sys
+import time
+
+from custom_components.tuya_local.helpers.device_config import (
+    TuyaDeviceConfig,
+    available_configs,
+)
+
+from util.simulator import generate_dps
+
+OPERATIONS = [
+    "get_value",
+    "get_values_to_set",
+    "values",
+    "range",
+    "icon",
+    "match_quality",
+]
+
+BASELINE = join(dirname(__file__), "config_benchmark_baseline.json")
+
+
+class FakeDevice:
+    def __init__(self, dps):
+        self._dps = dps
+        self.decoded_dps = {}
+
+    def get_property(self, id):
+        return self._dps.get(id)
+
+
+def _remove_duplicates(seq):
+    seen = set()
+    return [x for x in seq if not (x in seen or seen.add(x))]
+
+
+def _time(func, number):
+    """Return the best time per call, in microseconds, over a few runs."""
+    best = None
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e6 / number
+
+
+def _calibrate(number):
+    """Time a fixed workload, to scale timings taken on other machines."""
+    data = list(range(1000, 0, -1))
+    return _time(lambda: sorted(str(x) for x in data), number)
+
+
+def _timer(number, errors, failed):
+    """
+    Return a function to time calls, recording any errors raised, and the
+    operations that raised them.
+    """
+
+    def timed(totals, op, label, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            errors.append(f"{label}: {type(e).__name__}: {e}")
+            failed.add(op)
+            return
+        totals[op] += _time(lambda: func(*args), number)
+
+    return timed
+
+
+def benchmark_config(config, number, seed=0):
+    """
+    Time the operations for config.
+
+    Returns:
+        the totals for each operation, the totals per platform, a list of
+        errors raised by the operations, and the set of operations that
+        raised them.
+    """
+    dps, _ = generate_dps(config, random.Random(seed))
+    device = FakeDevice(dps)
+    platforms = {}
+    errors = []
+    failed = set()
+    timed = _timer(number, errors, failed)
+    for entity in [config.primary_entity] + list(config.secondary_entities()):
+        totals = platforms.setdefault(
+            entity.entity,
+            {op: 0.0 for op in OPERATIONS if op != "match_quality"},
+        )
+        # Entities hold on to their dps, so reuse them as entities do.
+        for dp in list(entity.dps()):
+            label = f"{entity.config_id}.{dp.name}"
+            timed(totals, "get_value", label, dp.get_value, device)
+            try:
+                current = dp.get_value(device)
+            except Exception:
+                current = None
+            timed(
+                totals,
+                "get_values_to_set",
+                label,
+                dp.get_values_to_set,
+                device,
+                current,
+            )
+            timed(totals, "values", label, dp.values, device)
+            timed(totals, "range", label, dp.range, device)
+        timed(totals, "icon", entity.config_id, entity.icon, device)
+
+    result = {op: 0.0 for op in OPERATIONS}
+    for totals in platforms.values():
+        for op, t in totals.items():
+            result[op] += t
+    timed(result, "match_quality", config.config_type, config.match_quality, dps)
+    return result, platforms, errors, failed
+
+
+def run(number, seed=0, names=None):
+    results = {
+        "configs": {},
+        "platforms": {},
+        "operations": {},
+        "errors": {},
+        "failed": {},
+        "calibration": round(_calibrate(number), 3),
+    }
+    for fname in available_configs():
+        config = TuyaDeviceConfig(fname)
+        if names and config.config_type not in names:
+            continue
+        totals, platforms, errors, failed = benchmark_config(config, number, seed)
+        results["configs"][config.config_type] = {
+            op: round(t, 3) for op, t in totals.items()
+        }
+        if errors:
+            results["errors"][config.config_type] = _remove_duplicates(errors)
+            results["failed"][config.config_type] = sorted(failed)
+            continue
+        for platform, ops in platforms.items():
+            summary = results["platforms"].setdefault(
+                platform,
+                {op: 0.0 for op in ops},
+            )
+            for op, t in ops.items():
+                summary[op] += t
+        for op, t in totals.items():
+            results["operations"][op] = results["operations"].get(op, 0.0) + t
+
+    for ops in results["platforms"].values():
+        for op in ops:
+            ops[op] = round(ops[op], 3)
+    for op in results["operations"]:
+        results["operations"][op] = round(results["operations"][op], 3)
+    return results
+
+
+def compare(results, baseline, threshold, minimum):
+    """
+    Compare results against baseline.
+
+    Returns:
+        a list of (section, name, operation, baseline, result) for each
+        timing that is slower by more than threshold (a fraction) and by at
+        least minimum microseconds.  Operations of a config that failed in
+        either run are not compared.
+    """
+    scale = 1.0
+    if results.get("calibration") and baseline.get("calibration"):
+        scale = results["calibration"] / baseline["calibration"]
+    regressions = []
+    for section in ("operations", "platforms", "configs"):
+        for name, ops in results[section].items():
+            if section == "operations":
+                ops, name = {name: ops}, ""
+            base = baseline.get(section, {})
+            base = base if not name else base.get(name)
+            if base is None:
+                continue
+            failed = set()
+            if section == "configs":
+                failed.update(results.get("failed", {}).get(name, ()))
+                failed.update(baseline.get("failed", {}).get(name, ()))
+            for op, t in ops.items():
+                b = None if op in failed else base.get(op)
+                if b is not None:
+                    b *= scale
+                if b is not None and t - b > max(b * threshold, minimum):
+                    regressions.append((section, name, op, b, t))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("configs", nargs="*", help="limit to these configs")
+    parser.add_argument(
+        "--number",
+        type=int,
+        default=20,
+        help="calls to time for each operation",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the results to")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="compare against the baseline stored in the repository",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=25,
+        help="percentage slowdown to report as a regression",
+    )
+    parser.add_argument(
+        "--minimum",
+        type=float,
+        default=5,
+        help="ignore slowdowns of less than this many microseconds",
+    )
+    args = parser.parse_args()
+
+    results = run(args.number, args.seed, set(args.configs))
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(json.dumps(results["operations"], indent=2))
+    for name, errors in results["errors"].items():
+        for error in errors:
+            print(f"{name} {error}", file=sys.stderr)
+
+    if args.compare:
+        args.baseline = args.baseline or BASELINE
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            results,
+            baseline,
+            args.threshold / 100,
+            args.minimum,
+        )
+        for section, name, op, b, t in regressions:
+            where = f"{section} {name}" if name else section
+            print(f"{where} {op}: {b:.1f}us -> {t:.1f}us (+{(t - b) * 100 / b:.0f}%)")
+        if regressions:
+            return 1
+        print("No regressions found")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
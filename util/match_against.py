@@ -11,6 +11,7 @@ from custom_components.tuya_local.helpers.device_config import (
 class FakeDevice:
     def __init__(self, dps):
         self._dps = dps
+        self.decoded_dps = {}
 
     def get_property(self, id):
         return self._dps.get(id)
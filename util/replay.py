@@ -0,0 +1,121 @@
+"""
+Replay captured device traffic, and measure the time spent processing it.
+
+Captures are recorded with the tuya_local.start_capture service.  The polls
+are fed into a TuyaLocalDevice with entities for the device config, without
+using the network.  Run from the top level of the repository:
+
+    python -m util.replay tuya_local_capture_<device>_<time>.jsonl --speed 0
+
+Reports, as JSON, the number of polls replayed, the time taken to replay
+them and the time spent processing them, including entity state writes.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from custom_components.tuya_local.device import TuyaLocalDevice
+from custom_components.tuya_local.helpers.capture import (
+    HEADER,
+    async_replay,
+    read_capture,
+)
+from custom_components.tuya_local.helpers.device_config import get_config
+
+from util.benchmark import BenchmarkEntity, BenchmarkExecutor, BenchmarkHass
+
+
+async def replay(records, config_type, speed, repeat):
+    loop = asyncio.get_running_loop()
+    executor = BenchmarkExecutor(1)
+    hass = BenchmarkHass(loop, executor)
+    # Devices only start their receive loops once Home Assistant is
+    # running, so this keeps them off the network.
+    hass.is_running = False
+    header = records[0] if records and records[0]["type"] == HEADER else {}
+
+    device = TuyaLocalDevice(
+        header.get("device", "replay"),
+        header.get("id", "replay"),
+        "127.0.0.1",
+        "0123456789abcdef",
+        3.3,
+        None,
+        hass,
+    )
+    config = get_config(config_type)
+    entities = []
+    for entity in [config.primary_entity] + list(config.secondary_entities()):
+        entities.append(BenchmarkEntity(device, entity))
+        device.register_entity(entities[-1])
+    startup_writes = sum(e.writes for e in entities)
+
+    polls = 0
+    processing = 0.0
+    start = time.monotonic()
+    for _ in range(repeat):
+        p, t = await async_replay(device, records, speed)
+        polls += p
+        processing += t
+    elapsed = time.monotonic() - start
+    executor.shutdown()
+
+    return {
+        "device": header.get("device"),
+        "config": config_type,
+        "records": len(records),
+        "polls": polls,
+        "replay_s": round(elapsed, 3),
+        "processing_ms": round(processing * 1000, 3),
+        "processing_per_poll_us": (
+            round(processing * 1e6 / polls, 1) if polls else None
+        ),
+        "entity_writes": sum(e.writes for e in entities) - startup_writes,
+        "receive_errors": device.metrics.receive_errors,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("capture", help="capture file to replay")
+    parser.add_argument(
+        "--config",
+        help="device config to use, if not recorded in the capture",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1,
+        help="how many times faster than recorded to replay, 0 for no delays",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="times to replay the capture",
+    )
+    parser.add_argument("--output", help="file to write the results to")
+    args = parser.parse_args()
+
+    records = read_capture(args.capture)
+    config_type = args.config
+    if config_type is None and records and records[0]["type"] == HEADER:
+        config_type = records[0].get("config_type")
+    if config_type is None:
+        parser.error("--config is needed as the capture does not record it")
+    if get_config(config_type) is None:
+        parser.error(f"No device config found for {config_type}")
+
+    results = asyncio.run(replay(records, config_type, args.speed, args.repeat))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
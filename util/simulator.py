@@ -0,0 +1,502 @@
+"""
+Simulate Tuya devices on the local network.
+
+Each simulated device listens for TCP connections like a real device, and
+speaks the Tuya local protocol versions 3.1 to 3.5.  The dps it reports are
+generated from one of the configs in devices/, so the devices can be
+detected and used like the real thing, and readonly dps change at a
+configurable rate to generate traffic.
+
+Run from the top level of the repository:
+
+    python -m util.simulator --count 10 --version 3.4 simple_switch
+
+A list of the simulated devices, in the same format as the devices.json file
+produced by tinytuya, is written to stdout.  On Linux, any address in
+127.0.0.0/8 can be used without configuration, so each device gets its own
+address on the standard port.
+"""
+import argparse
+import asyncio
+from base64 import b64encode
+from hashlib import sha256
+import hmac
+import json
+import logging
+import random
+import struct
+import sys
+import time
+
+import tinytuya
+
+from custom_components.tuya_local.helpers.device_config import get_config
+
+_LOGGER = logging.getLogger(__name__)
+
+VERSIONS = [3.1, 3.2, 3.3, 3.4, 3.5]
+TUYA_PORT = 6668
+
+_QUERY_CMDS = (tinytuya.DP_QUERY, tinytuya.DP_QUERY_NEW)
+_CONTROL_CMDS = (tinytuya.CONTROL, tinytuya.CONTROL_NEW)
+
+
+def device_address(index):
+    """Return a distinct loopback address for the device at index."""
+    return f"127.0.{index // 250}.{index % 250 + 2}"
+
+
+def _random_bytes(rnd, count):
+    return bytes(rnd.randrange(256) for _ in range(count))
+
+
+def _format_bytes(dp):
+    fmt = dp._config.get("format")
+    if fmt:
+        return sum(f.get("bytes", 1) for f in fmt)
+    masks = [m["mask"] for m in dp._config.get("mapping", []) if "mask" in m]
+    if masks:
+        return max(len(m) for m in masks) // 2
+
+
+def _mapped_values(dp):
+    """Return the raw values listed in the mapping of dp."""
+    values = []
+    for m in dp._config.get("mapping", []):
+        v = m.get("dps_val")
+        if v is None or isinstance(v, list):
+            continue
+        if dp.rawtype == "boolean" and not isinstance(v, bool):
+            continue
+        if dp.rawtype in ("integer", "bitfield", "float") and (
+            isinstance(v, bool) or not isinstance(v, (int, float))
+        ):
+            continue
+        if dp.rawtype == "string" and not isinstance(v, str):
+            continue
+        values.append(v)
+    return values
+
+
+def sample_value(dp, rnd):
+    """Return a random value that is valid for dp."""
+    values = _mapped_values(dp)
+    if values:
+        return rnd.choice(values)
+
+    t = dp.rawtype
+    if t == "boolean":
+        return rnd.choice([True, False])
+    if t in ("integer", "bitfield", "float"):
+        r = dp._config.get("range")
+        if not r:
+            return 0
+        if t == "float":
+            return round(rnd.uniform(r["min"], r["max"]), 1)
+        return rnd.randint(int(r["min"]), int(r["max"]))
+    if t == "hex":
+        return _random_bytes(rnd, _format_bytes(dp) or 1).hex()
+    if t == "base64":
+        return b64encode(_random_bytes(rnd, _format_bytes(dp) or 0)).decode()
+    return ""
+
+
+def _next_value(dp, value, rnd):
+    """Return a value for dp that could follow value."""
+    r = dp._config.get("range")
+    if dp.rawtype in ("integer", "float") and r and not _mapped_values(dp):
+        step = max((r["max"] - r["min"]) // 20, 1)
+        value = min(max(value + rnd.randint(-step, step), r["min"]), r["max"])
+        return round(value, 1) if dp.rawtype == "float" else int(value)
+    if dp.rawtype == "boolean":
+        return not value
+    return sample_value(dp, rnd)
+
+
+def generate_dps(config, rnd):
+    """
+    Generate an initial state for a device matching config.
+
+    Returns:
+        a dict of dp values, and a list of the dps that change over time.
+    """
+    dps = {}
+    fields = {}
+    changing = []
+    entities = [config.primary_entity] + list(config.secondary_entities())
+    for entity in entities:
+        sensor = entity.entity in ("sensor", "binary_sensor")
+        for dp in entity.dps():
+            if dp.field:
+                fields.setdefault(dp.id, {})[dp.field] = sample_value(dp, rnd)
+                continue
+            if dp.id in dps:
+                continue
+            dps[dp.id] = sample_value(dp, rnd)
+            if (sensor or dp.readonly) and dp.rawtype in (
+                "boolean",
+                "integer",
+                "float",
+            ):
+                changing.append(dp)
+
+    for id, value in fields.items():
+        dps[id] = json.dumps(value, separators=(",", ":"))
+
+    return dps, changing
+
+
+class FakeDevice:
+    """A simulated Tuya device, serving connections on host:port."""
+
+    def __init__(
+        self,
+        config,
+        dev_id,
+        local_key,
+        version,
+        host="127.0.0.1",
+        port=TUYA_PORT,
+        rate=0.0,
+        seed=None,
+    ):
+        """
+        Args:
+            config (TuyaDeviceConfig): the config to generate dps from.
+            dev_id (str): the device id.
+            local_key (str): the 16 character encryption key.
+            version (float): the protocol version to speak.
+            host (str): the address to listen on.
+            port (int): the port to listen on.
+            rate (float): changes per second to readonly dps.
+            seed: seed for the random generator, for repeatable results.
+        """
+        self.config = config
+        self.id = dev_id
+        self.local_key = local_key
+        self.version = version
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self._rnd = random.Random(seed)
+        self.dps, self._changing = generate_dps(config, self._rnd)
+        self._connections = set()
+        self._server = None
+        self._traffic = None
+        self.commands = []
+
+    def info(self):
+        """Return the device details, in tinytuya's devices.json format."""
+        return {
+            "name": f"{self.config.name} {self.id[-4:]}",
+            "id": self.id,
+            "key": self.local_key,
+            "ip": self.host,
+            "port": self.port,
+            "version": str(self.version),
+            "product_name": self.config.config_type,
+        }
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        if self.port == 0:
+            self.port = self._server.sockets[0].getsockname()[1]
+        if self.rate > 0 and self._changing:
+            self._traffic = asyncio.create_task(self._generate_traffic())
+
+    async def stop(self):
+        if self._traffic:
+            self._traffic.cancel()
+        for conn in list(self._connections):
+            conn.close()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def update(self, dps):
+        """Change dps, and notify connected clients."""
+        self.dps.update(dps)
+        for conn in list(self._connections):
+            conn.send_status(dps)
+
+    async def _generate_traffic(self):
+        while True:
+            await asyncio.sleep(self._rnd.expovariate(self.rate))
+            dp = self._rnd.choice(self._changing)
+            self.update({dp.id: _next_value(dp, self.dps[dp.id], self._rnd)})
+
+    async def _serve(self, reader, writer):
+        conn = _Connection(self, writer)
+        self._connections.add(conn)
+        try:
+            while True:
+                await conn.handle(await _read_message(reader))
+        except (asyncio.IncompleteReadError, ConnectionError, tinytuya.DecodeError):
+            pass
+        except Exception:
+            _LOGGER.exception("%s failed handling message", self.id)
+        finally:
+            self._connections.discard(conn)
+            conn.close()
+
+
+async def _read_message(reader):
+    prefix = await reader.readexactly(4)
+    header_len = 18 if prefix == tinytuya.PREFIX_6699_BIN else 16
+    data = prefix + await reader.readexactly(header_len - 4)
+    header = tinytuya.parse_header(data)
+    return data + await reader.readexactly(header.total_length - header_len)
+
+
+class _Connection:
+    """The device side of a client connection."""
+
+    def __init__(self, device, writer):
+        self._device = device
+        self._writer = writer
+        self._real_key = device.local_key.encode("latin1")
+        self._key = self._real_key
+        self._local_nonce = None
+        self._remote_nonce = None
+        self._seqno = 0
+        self._version_header = (
+            str(device.version).encode() + tinytuya.PROTOCOL_3x_HEADER
+        )
+
+    @property
+    def version(self):
+        return self._device.version
+
+    def close(self):
+        self._writer.close()
+
+    def _decode(self, data):
+        v = self.version
+        hmac_key = self._key if v >= 3.4 else None
+        msg = tinytuya.unpack_message(data, hmac_key=hmac_key, no_retcode=True)
+        payload = msg.payload
+        if v == 3.4:
+            payload = tinytuya.AESCipher(self._key).decrypt(payload, False, False)
+        if v >= 3.2:
+            if payload.startswith(self._version_header):
+                payload = payload[len(self._version_header) :]
+            if v < 3.4 and payload:
+                payload = tinytuya.AESCipher(self._key).decrypt(payload, False, False)
+        elif payload.startswith(tinytuya.PROTOCOL_VERSION_BYTES_31):
+            payload = tinytuya.AESCipher(self._key).decrypt(payload[19:], True, False)
+        return msg.cmd, msg.seqno, payload
+
+    def _encode(self, cmd, payload, header=False):
+        v = self.version
+        if header and v >= 3.2:
+            if v < 3.4:
+                payload = tinytuya.AESCipher(self._key).encrypt(payload, False)
+                payload = self._version_header + payload
+            else:
+                payload = self._version_header + payload
+        elif v in (3.2, 3.3) and payload:
+            payload = tinytuya.AESCipher(self._key).encrypt(payload, False)
+        if v == 3.4 and payload:
+            payload = tinytuya.AESCipher(self._key).encrypt(payload, False)
+
+        self._seqno += 1
+        retcode = struct.pack(tinytuya.MESSAGE_RETCODE_FMT, 0)
+        if v >= 3.5:
+            msg = tinytuya.TuyaMessage(
+                self._seqno,
+                cmd,
+                0,
+                payload,
+                0,
+                True,
+                tinytuya.PREFIX_6699_VALUE,
+                True,
+            )
+        else:
+            msg = tinytuya.TuyaMessage(
+                self._seqno,
+                cmd,
+                0,
+                retcode + payload,
+                0,
+                True,
+                tinytuya.PREFIX_55AA_VALUE,
+                False,
+            )
+        return tinytuya.pack_message(msg, hmac_key=self._key if v >= 3.4 else None)
+
+    def _send(self, cmd, payload=b"", header=False):
+        if not self._writer.is_closing():
+            self._writer.write(self._encode(cmd, payload, header))
+
+    def _dps_payload(self, dps):
+        if self.version >= 3.4:
+            msg = {"protocol": 4, "t": int(time.time()), "data": {"dps": dps}}
+        else:
+            msg = {"devId": self._device.id, "dps": dps, "t": int(time.time())}
+        return json.dumps(msg, separators=(",", ":")).encode()
+
+    def send_status(self, dps):
+        """Send an asynchronous status update to the client."""
+        self._send(tinytuya.STATUS, self._dps_payload(dps), header=True)
+
+    async def handle(self, data):
+        cmd, seqno, payload = self._decode(data)
+
+        if cmd == tinytuya.SESS_KEY_NEG_START:
+            self._local_nonce = payload[:16]
+            self._remote_nonce = _random_bytes(self._device._rnd, 16)
+            check = hmac.new(self._real_key, self._local_nonce, sha256).digest()
+            self._send(tinytuya.SESS_KEY_NEG_RESP, self._remote_nonce + check)
+            return
+        if cmd == tinytuya.SESS_KEY_NEG_FINISH:
+            self._key = self._session_key()
+            return
+
+        try:
+            request = json.loads(payload) if payload else {}
+        except ValueError:
+            request = {}
+        dps = request.get("dps", request.get("data", {}).get("dps", {}))
+
+        if cmd in _QUERY_CMDS:
+            if self.version == 3.2:
+                self._send(cmd, b"data unvalid")
+            else:
+                self._send(cmd, self._dps_payload(self._device.dps))
+        elif cmd in _CONTROL_CMDS and dps and all(v is None for v in dps.values()):
+            # device22 devices query by sending the dps wanted to CONTROL_NEW
+            result = {k: v for k, v in self._device.dps.items() if k in dps}
+            self._send(tinytuya.DP_QUERY, self._dps_payload(result))
+        elif cmd in _CONTROL_CMDS:
+            self._device.commands.append((time.monotonic(), dps))
+            self._send(cmd)
+            self._device.update(dps)
+        elif cmd == tinytuya.UPDATEDPS:
+            self._send(cmd)
+            ids = [str(i) for i in request.get("dpId", [])]
+            result = {k: v for k, v in self._device.dps.items() if k in ids}
+            if result:
+                self.send_status(result)
+        else:
+            # HEART_BEAT and anything not simulated gets an empty response
+            self._send(cmd)
+        await self._writer.drain()
+
+    def _session_key(self):
+        key = bytes(a ^ b for a, b in zip(self._local_nonce, self._remote_nonce))
+        cipher = tinytuya.AESCipher(self._real_key)
+        if self.version == 3.4:
+            return cipher.encrypt(key, False, pad=False)
+        return cipher.encrypt(
+            key,
+            use_base64=False,
+            pad=False,
+            iv=self._local_nonce[:12],
+        )[12:28]
+
+
+def create_devices(
+    config_types,
+    count,
+    versions,
+    rate=0.0,
+    seed=0,
+    host=None,
+    port=TUYA_PORT,
+):
+    """
+    Create count simulated devices, cycling through configs and versions.
+
+    Args:
+        config_types (list): the device config names to use.
+        count (int): the number of devices to create.
+        versions (list): the protocol versions to use.
+        rate (float): changes per second to readonly dps of each device.
+        seed: seed for the random generators, for repeatable results.
+        host (str): a single address to listen on, with consecutive ports
+            starting from port.  Otherwise each device listens on its own
+            loopback address.
+        port (int): the port or starting port to listen on.
+    """
+    configs = []
+    for name in config_types:
+        config = get_config(name)
+        if config is None:
+            raise ValueError(f"No device config for {name}")
+        configs.append(config)
+    rnd = random.Random(seed)
+    devices = []
+    for i in range(count):
+        devices.append(
+            FakeDevice(
+                configs[i % len(configs)],
+                f"sim{i:05d}" + _random_bytes(rnd, 6).hex(),
+                _random_bytes(rnd, 8).hex(),
+                versions[i % len(versions)],
+                host=host or device_address(i),
+                port=port + i if host and port else port,
+                rate=rate,
+                seed=rnd.random(),
+            )
+        )
+    return devices
+
+
+async def run(devices, ready=None):
+    """Serve devices until cancelled."""
+    for device in devices:
+        await device.start()
+    if ready:
+        ready()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for device in devices:
+            await device.stop()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("configs", nargs="+", help="device config names")
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument(
+        "--version",
+        default="3.3",
+        help="comma separated protocol versions to cycle through",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0.1,
+        help="changes per second to readonly dps of each device",
+    )
+    parser.add_argument("--host", help="listen on consecutive ports of host")
+    parser.add_argument("--port", type=int, default=TUYA_PORT)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    devices = create_devices(
+        args.configs,
+        args.count,
+        [float(v) for v in args.version.split(",")],
+        rate=args.rate,
+        seed=args.seed,
+        host=args.host,
+        port=args.port,
+    )
+
+    def ready():
+        json.dump([d.info() for d in devices], sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+
+    try:
+        asyncio.run(run(devices, ready))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())